@@ -0,0 +1,270 @@
+import copy
+import json
+import os
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+"""
+Metadata-only access to the CZI files. The metadata XML is parsed in one streaming pass without building the whole
+tree and without decoding the pixels, the results can be kept in an on-disk cache keyed by the file path, size and
+modification time.
+"""
+
+_CHUNK_SIZE = 1 << 16
+
+_AXIS_MAP = {"MTBStageAxisX": "x", "MTBStageAxisY": "y", "MTBFocus": "z"}
+
+
+def _local(tag):
+    """
+    :return: tag name without the XML namespace
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _to_float(text):
+    """
+    :return: float of the text or None for the missing or empty text
+    """
+    return float(text) if text else None
+
+
+class CziMetadata(namedtuple('CziMetadata', ['scaling_um_per_pixel', 'channels', 'stage_position', 'z_scan',
+                                             'tiles'])):
+    """
+    Metadata of the CZI file, to_dict gives the dictionary used by the analyzers and the PixelStageConverter.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        """
+        :return: dict with scaling_um_per_pixel, channels, stage_position, z_scan and tiles keys
+        """
+        return dict(self._asdict())
+
+    @classmethod
+    def from_dict(cls, metadata):
+        """
+        :param dict metadata: dict returned by to_dict
+        :return: CziMetadata
+        """
+        return cls(**{field: metadata.get(field) for field in cls._fields})
+
+
+class _MetadataCollector:
+    """
+    Collects the metadata from the start and end events of the XML pull parser, keeping only the stack of the open
+    elements instead of the whole tree.
+    """
+
+    def __init__(self):
+        self.scaling = {}
+        self.channels = []
+        self.scene_positions = []
+        self.axis_values = {}
+        self.z_scan = None
+        self.tiles = []
+
+        self._stack = []
+        self._distances = []
+        self._open_channels = []
+        self._open_tiles = []
+        self._z_stack_setup = None
+        self._z_stack_done = False
+
+    def start(self, elem):
+        name = _local(elem.tag)
+        parents = [_local(e.tag) for e in self._stack[-3:]]
+
+        if name == "Distance":
+            self._distances.append([elem.attrib.get("Id"), None])
+
+        elif name == "Channel":
+            channel = {"id": elem.attrib.get("Id"), "name": None, "emission_nm": None, "excitation_nm": None}
+            self.channels.append(channel)
+            self._open_channels.append([channel, set()])
+
+        elif name == "Position" and parents == ["Scenes", "Scene", "Positions"]:
+            self.scene_positions.append({axis.lower(): _to_float(elem.attrib.get(axis)) for axis in "XYZ"})
+
+        elif elem.tag == "ZStackSetup" and not self._z_stack_done and self._z_stack_setup is None:
+            self._z_stack_setup = elem
+            self.z_scan = {
+                'is_activated': elem.get('IsActivated', 'false').lower() == 'true',
+                'is_center_mode': False,
+                'is_interval_kept': False
+            }
+
+        if elem.tag.endswith("SingleTileRegion"):
+            tile = {"name": elem.get("Name"), "x": None, "y": None, "z": None}
+            self.tiles.append(tile)
+            self._open_tiles.append([elem, tile, set()])
+
+        self._stack.append(elem)
+
+    def end(self, elem):
+        self._stack.pop()
+        name = _local(elem.tag)
+        parent = self._stack[-1] if self._stack else None
+
+        if name == "Value" and self._distances:
+            for distance in self._distances:
+                if distance[1] is None:
+                    distance[1] = elem.text
+        elif name == "Distance":
+            axis, value = self._distances.pop()
+            if axis and value is not None:
+                self.scaling[axis] = float(value)
+
+        for channel, found in self._open_channels:
+            for tag, key in [("Name", "name"), ("EmissionWavelength", "emission_nm"),
+                             ("ExcitationWavelength", "excitation_nm")]:
+                if name == tag and key not in found:
+                    found.add(key)
+                    channel[key] = (elem.text or "") if key == "name" else _to_float(elem.text)
+        if name == "Channel":
+            self._open_channels.pop()
+
+        if name == "Position" and parent is not None and _local(parent.tag) == "ParameterCollection":
+            axis_id = parent.attrib.get("Id")
+            if axis_id in _AXIS_MAP and elem.text:
+                try:
+                    self.axis_values[_AXIS_MAP[axis_id]] = float(elem.text)
+                except ValueError:
+                    self.axis_values[_AXIS_MAP[axis_id]] = None
+
+        if parent is not None and parent is self._z_stack_setup and elem.text:
+            if elem.tag == 'IsCenterMode':
+                self.z_scan['is_center_mode'] = elem.text.lower() == 'true'
+            elif elem.tag == 'IsIntervalKept':
+                self.z_scan['is_interval_kept'] = elem.text.lower() == 'true'
+        if elem is self._z_stack_setup:
+            self._z_stack_setup = None
+            self._z_stack_done = True
+
+        if self._open_tiles and parent is self._open_tiles[-1][0]:
+            tile, found = self._open_tiles[-1][1], self._open_tiles[-1][2]
+            for axis in "XYZ":
+                if axis not in found and elem.tag.endswith(axis) and elem.text:
+                    found.add(axis)
+                    try:
+                        tile[axis.lower()] = float(elem.text)
+                    except ValueError:
+                        tile[axis.lower()] = None
+        if self._open_tiles and elem is self._open_tiles[-1][0]:
+            self._open_tiles.pop()
+
+        # the element is not needed anymore, its children were processed at their own end events
+        elem.clear()
+
+    def result(self):
+        positions = self.scene_positions + ([self.axis_values] if self.axis_values else [])
+
+        return CziMetadata(scaling_um_per_pixel=self.scaling, channels=self.channels, stage_position=positions[0],
+                           z_scan=self.z_scan, tiles=self.tiles)
+
+
+def parse_czi_metadata(metadata_str):
+    """
+    Parses the CZI metadata XML in one streaming pass.
+    :param str metadata_str: raw metadata of the CZI file
+    :return: CziMetadata
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    collector = _MetadataCollector()
+
+    for i in range(0, len(metadata_str), _CHUNK_SIZE):
+        parser.feed(metadata_str[i:i + _CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            getattr(collector, event)(elem)
+
+    parser.close()
+    for event, elem in parser.read_events():
+        getattr(collector, event)(elem)
+
+    return collector.result()
+
+
+class CziMetadataCache:
+    """
+    On-disk cache of the CZI metadata, an entry is valid as long as the size and modification time of the file do not
+    change. With cache_path None the cache is kept only in memory, e.g. in the worker processes.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = self._load()
+        self.is_modified = False
+
+    def _load(self):
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            print("[WARNING] Ignoring unreadable metadata cache: {}".format(self.cache_path))
+            return {}
+
+    @staticmethod
+    def _key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, path):
+        """
+        :param str path: path to the CZI file
+        :return: CziMetadata or None when the file is not cached or has changed
+        """
+        key, size, mtime = self._key(path)
+        entry = self.entries.get(key)
+        if entry is None or entry["size"] != size or entry["mtime_ns"] != mtime:
+            return None
+        return CziMetadata.from_dict(copy.deepcopy(entry["metadata"]))
+
+    def put(self, path, metadata):
+        """
+        :param str path: path to the CZI file
+        :param CziMetadata metadata: metadata of the file
+        :return: None
+        """
+        key, size, mtime = self._key(path)
+        self.entries[key] = {"size": size, "mtime_ns": mtime, "metadata": metadata.to_dict()}
+        self.is_modified = True
+
+    def save(self):
+        """
+        Writes the cache to the disk, if any entry was added.
+        :return: None
+        """
+        if not self.is_modified or self.cache_path is None:
+            return
+
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.cache_path)
+        self.is_modified = False
+
+
+def read_czi_metadata(path, cache=None):
+    """
+    Reads only the metadata of the CZI file, the pixels are not decoded.
+    :param str path: path to the CZI file
+    :param CziMetadataCache cache: optional cache checked before opening the file
+    :return: CziMetadata
+    """
+    if cache is not None:
+        metadata = cache.get(path)
+        if metadata is not None:
+            return metadata
+
+    from pylibCZIrw import czi as pyczi
+
+    with pyczi.open_czi(path) as czidoc:
+        metadata = parse_czi_metadata(czidoc.raw_metadata)
+
+    if cache is not None:
+        cache.put(path, metadata)
+
+    return metadata
@@ -0,0 +1,200 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+"""
+Columnar form of the measurement points, written next to the JSON read by the ZEN macro. The points of one file are
+stored as typed columns in an uncompressed .npz: id, x, y, z, source and timestamp, followed by one column per point
+property. The schema with the kind of every property column is kept in the file, so the whole temp folder is loaded
+with one concatenation per column instead of one DataFrame per file. The JSON files saved without the .npz go through
+the same conversion, so the folder gives the same columns and dtypes whichever form the points were saved in.
+"""
+
+SCHEMA_KEY = '__schema__'
+SCHEMA_VERSION = 1
+
+# the kinds of the property columns, properties which are not numbers or strings are stored as JSON strings
+_KIND_DTYPES = {'float': np.float64, 'bool': np.bool_, 'str': np.str_, 'json': np.str_}
+
+
+def _property_kind(values):
+    """
+    :param list values: values of one property, None for the points without it
+    :return: str kind of the column
+    """
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, (bool, np.bool_)) for v in present) and len(present) == len(values):
+        return 'bool'
+    if all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_))
+           for v in present):
+        return 'float'
+    if all(isinstance(v, str) for v in present):
+        return 'str'
+    return 'json'
+
+
+def _column(values, kind):
+    if kind == 'float':
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if kind == 'bool':
+        return np.array(values, dtype=np.bool_)
+    if kind == 'str':
+        return np.array(['' if v is None else v for v in values], dtype=np.str_)
+    return np.array([json.dumps(v) for v in values], dtype=np.str_)
+
+
+def points_to_columns(points):
+    """
+    Converts the measurement points in the JSON form to the typed columns.
+    :param dict points: {point id: {"position": [x, y, z], "source": str, "timestamp": str, ...properties}}
+    :return: (dict of ndarrays, dict schema {column: kind})
+    """
+    ids = list(points.keys())
+    entries = [points[i] for i in ids]
+
+    positions = np.array([[np.nan if c is None else c for c in (list(e.get('position') or []) + [None] * 3)[:3]]
+                          for e in entries], dtype=np.float64).reshape(-1, 3)
+
+    columns = {
+        'id': np.array(ids, dtype=np.str_),
+        'x': positions[:, 0],
+        'y': positions[:, 1],
+        'z': positions[:, 2],
+        'source': np.array([str(e.get('source', '')) for e in entries], dtype=np.str_),
+        'timestamp': np.array([str(e['timestamp']).rstrip('Z') if e.get('timestamp') else 'NaT' for e in entries],
+                              dtype='datetime64[us]'),
+    }
+    schema = {'id': 'str', 'x': 'float', 'y': 'float', 'z': 'float', 'source': 'str', 'timestamp': 'datetime'}
+
+    names = []
+    for e in entries:
+        names.extend(k for k in e if k not in ('position', 'source', 'timestamp') and k not in names)
+
+    for name in names:
+        values = [e.get(name) for e in entries]
+        kind = _property_kind(values)
+        columns[name] = _column(values, kind)
+        schema[name] = kind
+
+    return columns, schema
+
+
+def save_measurement_points_table(points, path):
+    """
+    Writes the measurement points in the columnar form.
+    :param dict points: measurement points in the JSON form
+    :param str path: path of the .npz file
+    :return: None
+    """
+    columns, schema = points_to_columns(points)
+    header = json.dumps({'version': SCHEMA_VERSION, 'columns': schema})
+
+    # the column names are stored in the schema, the arrays are saved under their positions
+    arrays = {'c{}'.format(i): columns[name] for i, name in enumerate(schema)}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **{SCHEMA_KEY: np.array(header)}, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_measurement_points_table(path):
+    """
+    :param str path: path of the .npz file
+    :return: (dict of ndarrays, dict schema {column: kind})
+    """
+    with np.load(path, allow_pickle=False) as data:
+        schema = json.loads(str(data[SCHEMA_KEY]))['columns']
+        columns = {name: data['c{}'.format(i)] for i, name in enumerate(schema)}
+    return columns, schema
+
+
+def _empty_column(kind, length):
+    if kind == 'float':
+        return np.full(length, np.nan)
+    if kind == 'datetime':
+        return np.full(length, np.datetime64('NaT'), dtype='datetime64[us]')
+    # the dtype follows the fill value, np.str_ alone would truncate 'null' to one character
+    return np.full(length, 'null' if kind == 'json' else '')
+
+
+def load_measurement_points_json(path):
+    """
+    Converts the measurement points of the JSON file to the columns of the .npz form.
+    :param str path: path of the JSON file
+    :return: (dict of ndarrays, dict schema {column: kind}), None if the file does not hold measurement points
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        points = json.load(f)
+
+    if not isinstance(points, dict) or not all(isinstance(p, dict) for p in points.values()):
+        return None
+    return points_to_columns(points)
+
+
+def read_measurement_points_folder(folder, with_position=False, include_json=False):
+    """
+    Loads all the .npz measurement points of the folder into one DataFrame, every column is concatenated once.
+    :param str folder: folder with the .npz files, e.g. the temp folder of the session
+    :param bool with_position: add the 'position' column with the [x, y, z] lists, as in the JSON form
+    :param bool include_json: also load the JSON files without the .npz of the same name
+    :return: DataFrame indexed by the point id with the 'file' column
+    """
+    names = os.listdir(folder)
+    npz_files = [os.path.join(folder, f) for f in names if f.lower().endswith('.npz')]
+    tables = {f: load_measurement_points_table(f) for f in npz_files}
+
+    if include_json:
+        columnar = {os.path.splitext(f)[0] for f in npz_files}
+        for f in names:
+            path = os.path.join(folder, f)
+            if not f.lower().endswith('.json') or os.path.splitext(path)[0] in columnar:
+                continue
+            table = load_measurement_points_json(path)
+            if table is None:
+                print("[WARNING] Skipping {}, it does not contain measurement points".format(path))
+                continue
+            tables[path] = table
+
+    files = sorted(tables)
+    tables = [tables[f] for f in files]
+
+    schema = {}
+    for _, file_schema in tables:
+        for name, kind in file_schema.items():
+            # the same property of different kinds is kept as JSON strings
+            schema[name] = kind if schema.get(name, kind) == kind else 'json'
+
+    # a flag missing in some files is unknown there, not False, the column is kept as JSON with None as in one file
+    for name, kind in schema.items():
+        if kind == 'bool' and not all(name in columns for columns, _ in tables):
+            schema[name] = 'json'
+
+    merged = {}
+    for name, kind in schema.items():
+        parts = []
+        for columns, file_schema in tables:
+            length = len(columns['id'])
+            if name not in columns:
+                parts.append(_empty_column(kind, length))
+            elif file_schema[name] != kind:
+                parts.append(_column([None if v != v else v for v in columns[name].tolist()], kind))
+            else:
+                parts.append(columns[name])
+        merged[name] = np.concatenate(parts) if parts else _empty_column(kind, 0)
+
+    merged['file'] = np.repeat(np.array(files, dtype=np.str_), [len(c['id']) for c, _ in tables]) \
+        if tables else np.zeros(0, dtype=np.str_)
+
+    df = pd.DataFrame({name: values for name, values in merged.items() if name != 'id'},
+                      index=pd.Index(merged.get('id', np.zeros(0, dtype=np.str_)), name='id'))
+
+    for name, kind in schema.items():
+        if kind == 'json':
+            df[name] = [json.loads(v) for v in df[name]]
+
+    if with_position:
+        df['position'] = df[['x', 'y', 'z']].to_numpy().tolist()
+
+    return df
@@ -1,6 +1,50 @@
-import xml.etree.ElementTree as ET
 from pylibCZIrw import czi as pyczi
 import numpy as np
+import copy
+import threading
+
+from IO.czi_metadata import parse_czi_metadata
+
+
+class CziRegionImage:
+    """
+    2D image of the CZI file decoded region by region on the slicing, image[y0:y1, x0:x1] reads only this region, so
+    the whole image is never held in the memory, e.g. for the tiled segmentation of the large overviews.
+    """
+
+    ndim = 2
+
+    def __init__(self, reader, shape):
+        """
+        :param CziFileReader reader: reader created with load_image=False
+        :param tuple shape: (H, W) of the image
+        """
+        self.reader = reader
+        self.shape = tuple(shape)
+        # the regions are decoded one at a time, also when the tiles are segmented on many threads
+        self._lock = threading.Lock()
+
+    def __getitem__(self, index):
+        rows, cols = index if isinstance(index, tuple) else (index, slice(None))
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = cols.indices(self.shape[1])
+
+        with self._lock:
+            return self.reader.read_region((x0, y0, x1 - x0, y1 - y0))
+
+    def __array__(self, dtype=None, copy=None):
+        image = self[:, :]
+        return image if dtype is None else image.astype(dtype)
+
+    def preview(self, max_size=2048):
+        """
+        Downsampled image, e.g. for the visualization of the points.
+        :param int max_size: largest edge of the preview in pixels
+        :return: ndarray (h, w)
+        """
+        factor = min(1.0, float(max_size) / max(self.shape))
+        with self._lock:
+            return self.reader.read_region((0, 0, self.shape[1], self.shape[0]), factor)
 
 
 class CziFileReader:
@@ -8,229 +52,299 @@ class CziFileReader:
     Class for reading a CZI file and extracting image data and metadata for analysis.
     """
 
-    def __init__(self, path, analysis_channel):
+    def __init__(self, path, analysis_channel, roi=None, roi_um=None, metadata_cache=None, plane_reducer=None,
+                 zoom=1.0, load_image=True):
+        """
+        :param str path: path to the CZI file
+        :param analysis_channel: index of the channel to read or list of indices read in one pass
+        :param roi: optional region of interest (x, y, width, height) in pixels of the image
+        :param roi_um: optional region of interest (x, y, width, height) in um, x and y are the stage coordinates of
+                       the region center, None takes the stage position of the image
+        :param metadata_cache: optional CziMetadataCache, the metadata XML is parsed only for the files missing in it
+        :param plane_reducer: optional callable reducing each decoded plane to a float, czi_file is then the 1D array
+                              of the values and the shape of the planes read is stored as metadata['stack_shape']
+        :param float zoom: read the image downsampled by this factor, from the pyramid level when the file has one,
+                           the scaling in the metadata is adjusted to the downsampled image
+        :param bool load_image: False reads only the metadata, czi_file is then the CziRegionImage decoding the regions
+                                of the 2D image of the analysis channel on the slicing
+        """
 
         self.path = path
         self.analysis_channel = analysis_channel
+        self.roi = roi
+        self.roi_um = roi_um
+        self.metadata_cache = metadata_cache
+        self.plane_reducer = plane_reducer
+        self.zoom = zoom
+        self.load_image = load_image
+        # metadata of the full resolution image, used for reading the regions after the downsampled read
+        self.full_resolution_metadata = None
+        # (x, y, width, height) in pixels of the full resolution image covered by czi_file
+        self.read_roi = None
 
         self.czi_file, self.metadata = self.read_czi_file(path)
 
     def read_czi_file(self, path):
         """
-        Open CZI file, extract metadata and image data for the chosen channel.
+        Open CZI file, extract metadata and image data for the chosen channel. When the ROI is given only the region
+        is decoded and its position in the full image is stored in the metadata.
         :return: tuple (image_data as ndarray, metadata as dict)
         """
 
         with pyczi.open_czi(path) as czidoc:
-            metadata = self.extract_metadata(czidoc.raw_metadata)
-            image_data = self.get_image_to_analyze(czidoc, self.analysis_channel)
+            metadata = self.metadata_cache.get(path) if self.metadata_cache is not None else None
+            if metadata is None:
+                metadata = parse_czi_metadata(czidoc.raw_metadata)
+                if self.metadata_cache is not None:
+                    self.metadata_cache.put(path, metadata)
+            metadata = metadata.to_dict()
+            self.full_resolution_metadata = copy.deepcopy(metadata)
+
+            rect = self._reference_rectangle(czidoc)
+
+            roi = self.roi
+            if roi is None and self.roi_um is not None:
+                roi = self.roi_um_to_pixels(self.roi_um, metadata, (rect.h, rect.w))
+
+            if roi is not None:
+                roi = self._clip_roi(roi, (rect.h, rect.w))
+                metadata['image_shape'] = (rect.h, rect.w)
+                metadata['roi'] = {'x': roi[0], 'y': roi[1], 'width': roi[2], 'height': roi[3]}
+            self.read_roi = roi if roi is not None else (0, 0, rect.w, rect.h)
+
+            if self.zoom != 1:
+                self._zoom_metadata(metadata, (rect.h, rect.w))
+
+            if not self.load_image and self.plane_reducer is None and not isinstance(self.analysis_channel,
+                                                                                    (list, tuple)):
+                shape = (int(round(self.read_roi[3] * self.zoom)), int(round(self.read_roi[2] * self.zoom)))
+                image_data = CziRegionImage(self, shape)
+            elif self.plane_reducer is not None:
+                image_data, stack_shape = self.reduce_planes(czidoc, self.analysis_channel, self.plane_reducer, roi,
+                                                             self.zoom)
+                metadata['stack_shape'] = stack_shape
+                metadata.setdefault('image_shape', stack_shape[1:])
+            else:
+                image_data = self.get_image_to_analyze(czidoc, self.analysis_channel, roi, self.zoom)
 
         return image_data, metadata
 
-    def extract_metadata(self, metadata_str):
+    @staticmethod
+    def _reference_rectangle(czidoc):
         """
-        Parse CZI metadata string into structured dictionary.
-        :return: dict with scaling, channels, stage position, z_scan, and tiles info
+        :return: bounding rectangle of the image, for the multi-scene files of the first scene, as the roi is given
+                 relative to every scene
+        """
+        if len(czidoc.scenes_bounding_rectangle_no_pyramid) > 1:
+            return next(iter(czidoc.scenes_bounding_rectangle_no_pyramid.values()))
+        return czidoc.total_bounding_rectangle
+
+    def _zoom_metadata(self, metadata, image_shape):
         """
+        Adjusts the scaling, image shape and roi offset in the metadata to the downsampled image.
+        :param dict metadata: metadata of the image
+        :param tuple image_shape: (H, W) of the full resolution image
+        :return: None
+        """
+        metadata['zoom'] = self.zoom
+        metadata['scaling_um_per_pixel'] = dict(metadata['scaling_um_per_pixel'])
+        for axis in ['X', 'Y']:
+            metadata['scaling_um_per_pixel'][axis] /= self.zoom
 
-        root = ET.fromstring(metadata_str)
-
-        metadata = {}
-        metadata["scaling_um_per_pixel"] = self._extract_scaling(root)
-        metadata["channels"] = self._extract_channels(root)
-        metadata["stage_position"] = self._extract_positions(root)[0]
-        metadata['z_scan'] = self._extract_z_scan_informations(root)
-        metadata['tiles'] = self._extract_tiles_informations(root)
-
-        return metadata
-
-    def _extract_scaling(self, root):
-        """
-        Extract scaling in micrometers per pixel for each axis.
-        :return: dict {axis: scaling in um/pixel}
-        """
-        scaling = {}
-        for dist in root.findall(".//{*}Distance"):
-            axis = dist.attrib.get("Id")
-            val = dist.find(".//{*}Value")
-            if axis and val is not None:
-                scaling[axis] = float(val.text)
-        return scaling
-
-    def _extract_channels(self, root):
-        """
-        Extract channel information including emission and excitation wavelengths.
-        :return: list of dicts with channel id, name, emission_nm, excitation_nm
-        """
-        channels = []
-        for ch in root.findall(".//{*}Channel"):
-            ch_id = ch.attrib.get("Id")
-            ch_name = ch.findtext(".//{*}Name")
-            em = ch.findtext(".//{*}EmissionWavelength")
-            ex = ch.findtext(".//{*}ExcitationWavelength")
-            channels.append({
-                "id": ch_id,
-                "name": ch_name,
-                "emission_nm": float(em) if em else None,
-                "excitation_nm": float(ex) if ex else None
-            })
-        return channels
-
-    def _extract_positions(self, root):
-        """
-        Extract stage positions from Scenes and ParameterCollection.
-        :return: list of dicts with keys x, y, z (float or None)
-        """
-        positions = []
-
-        # --- 1. Standardowe pozycje w Scenes/Positions ---
-        for pos in root.findall(".//{*}Scenes/{*}Scene/{*}Positions/{*}Position"):
-            x = pos.attrib.get("X")
-            y = pos.attrib.get("Y")
-            z = pos.attrib.get("Z")
-            positions.append({
-                "x": float(x) if x else None,
-                "y": float(y) if y else None,
-                "z": float(z) if z else None,
-            })
-
-        # --- 2. Parametry osi w ParameterCollection ---
-        axis_map = {"MTBStageAxisX": "x", "MTBStageAxisY": "y", "MTBFocus": "z"}
-        axis_values = {}
-
-        for pc in root.findall(".//{*}ParameterCollection"):
-            axis_id = pc.attrib.get("Id")
-            if axis_id in axis_map:
-                pos_elem = pc.find("{*}Position")
-                if pos_elem is not None and pos_elem.text:
-                    try:
-                        axis_values[axis_map[axis_id]] = float(pos_elem.text)
-                    except ValueError:
-                        axis_values[axis_map[axis_id]] = None
-
-        if axis_values:
-            positions.append(axis_values)
-
-        return positions
-
-    def _extract_z_scan_informations(self, root):
-        """
-        Extract Z-stack scan settings: activated, center mode, interval kept.
-        :return: dict with keys is_activated, is_center_mode, is_interval_kept
-        """
-
-        z_scan_info = {
-            'is_activated': False,
-            'is_center_mode': False,
-            'is_interval_kept': False
-        }
-
-        z_stack_setup = root.find('.//ZStackSetup')
-
-        if z_stack_setup is not None:
-            # Check if Z-stack is activated
-            is_activated = z_stack_setup.get('IsActivated', 'false').lower() == 'true'
-            z_scan_info['is_activated'] = is_activated
-
-            # Get center mode
-            is_center_mode = z_stack_setup.find('IsCenterMode')
-            if is_center_mode is not None and is_center_mode.text:
-                z_scan_info['is_center_mode'] = is_center_mode.text.lower() == 'true'
-
-            # Get interval kept
-            is_interval_kept = z_stack_setup.find('IsIntervalKept')
-            if is_interval_kept is not None and is_interval_kept.text:
-                z_scan_info['is_interval_kept'] = is_interval_kept.text.lower() == 'true'
-            return z_scan_info
+        metadata['image_shape'] = (int(round(image_shape[0] * self.zoom)), int(round(image_shape[1] * self.zoom)))
+        if 'roi' in metadata:
+            metadata['roi'] = {k: int(round(v * self.zoom)) for k, v in metadata['roi'].items()}
 
-        else:
-            return None
+    def iter_regions(self, rois_um, channel=None):
+        """
+        Reads the full resolution regions of the file opened once, e.g. for refining the candidates found on the
+        downsampled image.
+        :param rois_um: iterable of (x, y, width, height) in um, x and y are the stage coordinates of the region center
+        :param int channel: channel index, by default the analysis channel
+        :return: generator of tuples (image data as ndarray, metadata as dict with the region position)
+        """
+        channel = self.analysis_channel if channel is None else channel
+
+        with pyczi.open_czi(self.path) as czidoc:
+            rect = self._reference_rectangle(czidoc)
+
+            for roi_um in rois_um:
+                metadata = copy.deepcopy(self.full_resolution_metadata)
+                roi = self._clip_roi(self.roi_um_to_pixels(roi_um, metadata, (rect.h, rect.w)), (rect.h, rect.w))
+
+                metadata['image_shape'] = (rect.h, rect.w)
+                metadata['roi'] = {'x': roi[0], 'y': roi[1], 'width': roi[2], 'height': roi[3]}
 
-    def _extract_tiles_informations(self, root):
+                yield self.get_image_to_analyze(czidoc, channel, roi), metadata
+
+    def read_region(self, roi, zoom_factor=1.0):
+        """
+        Reads a region of the image described by czi_file, used by the CziRegionImage.
+        :param roi: (x, y, width, height) in pixels of czi_file, i.e. relative to the read roi and downsampled by zoom
+        :param float zoom_factor: additional downsampling of the region
+        :return: ndarray of image data of the analysis channel
+        """
+        x0, y0 = self.read_roi[0], self.read_roi[1]
+        full_roi = (x0 + int(np.floor(roi[0] / self.zoom)), y0 + int(np.floor(roi[1] / self.zoom)),
+                    int(np.ceil(roi[2] / self.zoom)), int(np.ceil(roi[3] / self.zoom)))
+
+        with pyczi.open_czi(self.path) as czidoc:
+            return self.get_image_to_analyze(czidoc, self.analysis_channel, full_roi, self.zoom * zoom_factor)
+
+    @staticmethod
+    def roi_um_to_pixels(roi_um, metadata, image_shape):
         """
-        Extract tile positions and names from the CZI metadata.
-        :return: list of dicts with keys name, x, y, z
+        Converts the region of interest in the stage coordinates to the pixels of the image, the inverse of the
+        PixelStageConverter normal XY mode.
+        :param roi_um: (x, y, width, height) in um, x and y are the stage coordinates of the region center
+        :param dict metadata: metadata of the image
+        :param tuple image_shape: (H, W) of the full image
+        :return: tuple (x, y, width, height) in pixels
         """
-        positions = []
-        for elem in root.iter():
-            if elem.tag.endswith("SingleTileRegion"):
-                name = elem.get("Name")
+        stage = metadata["stage_position"]
+        scaling = metadata["scaling_um_per_pixel"]
+        H, W = image_shape
+
+        x_um, y_um, width_um, height_um = roi_um
+        x_um = stage["x"] if x_um is None else x_um
+        y_um = stage["y"] if y_um is None else y_um
 
-                def get_float(tag):
-                    for child in elem:
-                        if child.tag.endswith(tag) and child.text:
-                            try:
-                                return float(child.text)
-                            except ValueError:
-                                return None
-                    return None
+        x_scale = scaling["X"] * 1e6
+        y_scale = scaling["Y"] * 1e6
 
-                positions.append({
-                    "name": name,
-                    "x": get_float("X"),
-                    "y": get_float("Y"),
-                    "z": get_float("Z")
-                })
+        width = int(np.ceil(width_um / x_scale))
+        height = int(np.ceil(height_um / y_scale))
+        x_center = (x_um - stage["x"]) / x_scale + H / 2 - 0.5
+        y_center = (y_um - stage["y"]) / y_scale + W / 2 - 0.5
 
-        return positions
+        return int(np.round(x_center - width / 2)), int(np.round(y_center - height / 2)), width, height
 
-    def get_image_to_analyze(self, czidoc, analysis_channel):
+    @staticmethod
+    def _clip_roi(roi, image_shape):
+        """
+        Clips the region of interest to the image.
+        :param roi: (x, y, width, height) in pixels
+        :param tuple image_shape: (H, W) of the full image
+        :return: tuple (x, y, width, height) in pixels
+        """
+        x, y, width, height = [int(v) for v in roi]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, image_shape[1]), min(y + height, image_shape[0])
+
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("Region of interest {} is outside of the image of shape {}".format(roi, image_shape))
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    def extract_metadata(self, metadata_str):
+        """
+        Parse CZI metadata string into structured dictionary.
+        :return: dict with scaling, channels, stage position, z_scan, and tiles info
+        """
+        return parse_czi_metadata(metadata_str).to_dict()
+
+    def get_image_to_analyze(self, czidoc, analysis_channel, roi=None, zoom=1.0):
         """
         Extract image data for the chosen channel as ndarray, handling Z-stack and scenes.
-        :return: ndarray of image data (Z, H, W) or (H, W) depending on file
+        :param analysis_channel: int channel index or list of channel indices read from the opened file in one pass
+        :param roi: optional (x, y, width, height) in pixels of the image, only this region is read
+        :param float zoom: downsampling factor of the read
+        :return: ndarray of image data (Z, H, W) or (H, W) depending on file, for the list of channels the channel axis
+                 is added in front
         """
+        if isinstance(analysis_channel, (list, tuple)):
+            stack = self.read_stack(czidoc, list(analysis_channel), roi, zoom)
+            return stack[:, 0] if stack.shape[1] == 1 else stack
 
+        stack = self.read_stack(czidoc, [analysis_channel], roi, zoom)[0]
+        return stack[0] if stack.shape[0] == 1 else stack
+
+    def iter_planes(self, czidoc, channel, roi=None, zoom=1.0):
+        """
+        Decodes the planes of one channel one at a time.
+        :param int channel: channel index
+        :param roi: optional (x, y, width, height) in pixels of the image, only this region is read
+        :param float zoom: downsampling factor of the read, pylibCZIrw uses the pyramid level closest to it
+        :return: tuple (number of planes, generator of 2D ndarrays), the planes are the Z-slices, the scenes or the
+                 single image
+        """
         bbox = czidoc.total_bounding_box
-        available_dims = list(bbox.keys())
+        rect = czidoc.total_bounding_rectangle
+        scenes = czidoc.scenes_bounding_rectangle_no_pyramid
+
+        # pylibCZIrw expects the roi in the CZI global coordinates, which do not have to start at 0
+        czi_roi = None if roi is None else (rect.x + roi[0], rect.y + roi[1], roi[2], roi[3])
 
+        base_plane = {dim: 0 for dim in bbox.keys() if dim in ['C', 'Z', 'T', 'H', 'S', 'B']}
+        if 'C' in base_plane:
+            base_plane['C'] = channel
         z_size = bbox['Z'][1] - bbox['Z'][0]
 
+        # every read is described by the (plane index, roi, scene) tuple
         if z_size > 1:
-            z_stack = []
-
-            for z in range(z_size):
-                plane = {}
-                for dim in available_dims:
-                    if dim in ['C', 'Z', 'T', 'H', 'S', 'B']:
-                        if dim == 'C':
-                            plane['C'] = analysis_channel
-                        elif dim == 'Z':
-                            plane['Z'] = z
-                        else:
-                            plane[dim] = 0
-
-                img = czidoc.read(plane=plane)
-                img_array = np.squeeze(np.array(img))
-                z_stack.append(img_array)
-
-            z_stack = np.stack(z_stack, axis=0)
-            return z_stack
+            reads = [({'Z': z} if 'Z' in base_plane else {}, czi_roi, None) for z in range(z_size)]
+        elif len(scenes) > 1:
+            reads = [({}, None if roi is None else (scene_rect.x + roi[0], scene_rect.y + roi[1], roi[2], roi[3]), i)
+                     for i, scene_rect in scenes.items()]
         else:
-            plane = {}
-            for dim in available_dims:
-                if dim in ['C', 'Z', 'T', 'H', 'S', 'B']:
-                    if dim == 'C':
-                        plane['C'] = analysis_channel
-                    else:
-                        plane[dim] = 0
+            reads = [({}, czi_roi, None)]
+
+        def planes():
+            for plane_index, read_roi, scene in reads:
+                plane = dict(base_plane, **plane_index)
+                yield np.squeeze(np.asarray(czidoc.read(roi=read_roi, plane=plane, zoom=zoom, scene=scene)))
 
-            if len(czidoc.scenes_bounding_rectangle_no_pyramid) > 1:
+        return len(reads), planes()
 
-                scene_stack = []
+    def read_stack(self, czidoc, channels, roi=None, zoom=1.0):
+        """
+        Reads the chosen channels of the opened file into one preallocated array, filled plane by plane.
+        :param list channels: channel indices
+        :param roi: optional (x, y, width, height) in pixels of the image, only this region is read
+        :param float zoom: downsampling factor of the read
+        :return: ndarray (C, Z, H, W) for the Z-stack, (C, S, H, W) for the scenes and (C, 1, H, W) otherwise
+        """
+        stack = None
+        for c_index, channel in enumerate(channels):
+            n_planes, planes = self.iter_planes(czidoc, channel, roi, zoom)
+            for n, img_array in enumerate(planes):
+                if stack is None:
+                    stack = np.empty((len(channels), n_planes) + img_array.shape, dtype=img_array.dtype)
+                stack[c_index, n] = img_array
 
-                for i in range(len(czidoc.scenes_bounding_rectangle_no_pyramid)):
-                    img = czidoc.read(scene=i, plane=plane)
-                    img_array = np.squeeze(np.array(img))
-                    scene_stack.append(img_array)
+        return stack
 
-                scene_stack = np.stack(scene_stack, axis=0)
+    def reduce_planes(self, czidoc, channel, plane_reducer, roi=None, zoom=1.0):
+        """
+        Reduces every plane to one value as soon as it is decoded, only one plane is kept in the memory.
+        :param int channel: channel index
+        :param plane_reducer: callable taking the 2D ndarray and returning a float, e.g. the focus metric
+        :param roi: optional (x, y, width, height) in pixels of the image, only this region is read
+        :param float zoom: downsampling factor of the read
+        :return: tuple (ndarray (N,) of the reduced values, (N, H, W) shape of the planes read)
+        """
+        n_planes, planes = self.iter_planes(czidoc, channel, roi, zoom)
 
-                return scene_stack
+        values = np.empty(n_planes)
+        plane_shape = ()
+        for n, img_array in enumerate(planes):
+            values[n] = plane_reducer(img_array)
+            plane_shape = img_array.shape
 
-            img = czidoc.read(plane=plane)
-            img_array = np.squeeze(np.array(img))
+        return values, (n_planes,) + plane_shape
+
+    def get_channel(self, channel):
+        """
+        Returns the image of one channel read by the CziFileReader with the list of channels.
+        :param int channel: channel index
+        :return: ndarray of image data of the channel
+        """
+        if not isinstance(self.analysis_channel, (list, tuple)):
+            if channel != self.analysis_channel:
+                raise ValueError("Channel {} was not read from {}".format(channel, self.path))
+            return self.czi_file
 
-            return img_array
+        return self.czi_file[list(self.analysis_channel).index(channel)]
 
 
 if __name__ == '__main__':
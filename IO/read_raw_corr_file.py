@@ -3,72 +3,131 @@ import os
 from datetime import datetime
 
 
-def read_confo_cor3(filepath):
-    """
-    Reads Zeiss ConfoCor3 .raw photon arrival time files.
-    Returns dict compatible with photonData struct.
-    """
+# 64 bytes of the header text followed by 16 uint32: identifier, settings and 8 reserved entries
+HEADER_TEXT_SIZE = 64
+DATA_OFFSET = HEADER_TEXT_SIZE + 16 * 4
+CHUNK_SIZE = 1 << 22
 
-    photon_data = {
-        "ph_sync": None,
-        "ph_dtime": None,
-        "ph_channel": None,
-        "mark_sync": None,
-        "mark_chan": None,
-        "mark_dtime": None,
-        "TTResult_SyncRate": None,
-        "MeasDesc_Resolution": 1,
-        "File_CreatingTime": None,
-        "HWSync_Divider": None,
-        "MeasDesc_AcquisitionTime": None,
-        "Headers": {}
-    }
-
-    with open(filepath, "rb") as f:
-        # === HEADER ===
-        header_text = f.read(64).decode("ascii", errors="ignore")
-        photon_data["Headers"]["Header"] = header_text
-
-        identifier = np.fromfile(f, dtype=np.uint32, count=4)
-        photon_data["Headers"]["Identifier"] = identifier
-
-        settings = np.fromfile(f, dtype=np.uint32, count=4)
-        photon_data["Headers"]["Settings"] = settings
-
-        # skip 8 uint32
-        _ = np.fromfile(f, dtype=np.uint32, count=8)
 
-        # Sync rate is the 4th setting entry
-        photon_data["TTResult_SyncRate"] = int(settings[3])
-
-        # === DATA SECTION ===
-        t3record = np.fromfile(f, dtype=np.uint32)
+def constant_array(value, length, dtype=np.uint64):
+    """
+    Read-only array of the given length filled with one value, a broadcast view of a single element, so it takes no
+    memory per photon but behaves as an ndarray in the comparisons, arithmetic and slicing. Used for the photon channel
+    and dtime, which are the same for every photon of the ConfoCor3 file.
+    :param value: value of every element
+    :param int length: number of elements
+    :return: read-only ndarray (length,)
+    """
+    return np.broadcast_to(np.array(value, dtype=dtype), (length,))
 
-    # Photon arrival times in sync units (cumulative sum)
-    ph_sync = np.cumsum(t3record, dtype=np.uint64)
 
-    # channel ID = last character of header interpreted as a number
-    try:
-        channel_number = int(header_text.strip()[-1])
-    except ValueError:
-        channel_number = 0
+class ConfoCor3RawFile:
+    """
+    Zeiss ConfoCor3 .raw photon arrival time file. The records are memory-mapped and the arrival times are computed
+    in chunks, so the file is never loaded to the memory at once.
+    """
 
-    ph_channel = np.ones_like(ph_sync) * channel_number
-    ph_dtime = np.ones_like(ph_sync)
+    def __init__(self, filepath):
+        """
+        :param str filepath: path to the .raw file
+        """
+        self.filepath = filepath
 
-    meas_time_ms = ph_sync[-1] / photon_data["TTResult_SyncRate"]
+        with open(filepath, "rb") as f:
+            self.header_text = f.read(HEADER_TEXT_SIZE).decode("ascii", errors="ignore")
+            self.identifier = np.fromfile(f, dtype=np.uint32, count=4)
+            self.settings = np.fromfile(f, dtype=np.uint32, count=4)
 
-    # File timestamp
-    mtime = os.path.getmtime(filepath)
-    file_time = datetime.fromtimestamp(mtime).isoformat()
+        # Sync rate is the 4th setting entry
+        self.sync_rate = int(self.settings[3])
+
+        # channel ID = last character of header interpreted as a number
+        try:
+            self.channel_number = int(self.header_text.strip()[-1])
+        except (ValueError, IndexError):
+            self.channel_number = 0
+
+        n_records = max(os.path.getsize(filepath) - DATA_OFFSET, 0) // 4
+        if n_records:
+            self.records = np.memmap(filepath, dtype=np.uint32, mode="r", offset=DATA_OFFSET, shape=(n_records,))
+        else:
+            self.records = np.zeros(0, dtype=np.uint32)
+
+        self._last_arrival_time = None
+
+    @property
+    def n_photons(self):
+        return len(self.records)
+
+    def iter_arrival_times(self, chunk_size=CHUNK_SIZE):
+        """
+        Generates the photon arrival times in sync units (cumulative sum of the records) block by block.
+        :param int chunk_size: number of photons in a block
+        :return: generator of uint64 ndarrays
+        """
+        offset = np.uint64(0)
+        for start in range(0, self.n_photons, chunk_size):
+            block = np.cumsum(self.records[start:start + chunk_size], dtype=np.uint64)
+            block += offset
+            offset = block[-1]
+            yield block
+
+    @property
+    def last_arrival_time(self):
+        """
+        Arrival time of the last photon in sync units, computed without the cumulative sum.
+        """
+        if self._last_arrival_time is None:
+            total = 0
+            for start in range(0, self.n_photons, CHUNK_SIZE):
+                total += int(self.records[start:start + CHUNK_SIZE].sum(dtype=np.uint64))
+            self._last_arrival_time = total
+        return self._last_arrival_time
+
+    def arrival_times(self):
+        """
+        :return: uint64 ndarray of all arrival times in sync units, filled block by block
+        """
+        ph_sync = np.empty(self.n_photons, dtype=np.uint64)
+        start = 0
+        for block in self.iter_arrival_times():
+            ph_sync[start:start + len(block)] = block
+            start += len(block)
+        return ph_sync
+
+    def photon_data(self):
+        """
+        Returns dict compatible with photonData struct, channel and dtime are the read-only constant_array views.
+        """
+        ph_sync = self.arrival_times()
+
+        # File timestamp
+        mtime = os.path.getmtime(self.filepath)
+        file_time = datetime.fromtimestamp(mtime).isoformat()
+
+        return {
+            "ph_sync": ph_sync,
+            "ph_dtime": constant_array(1, len(ph_sync)),
+            "ph_channel": constant_array(self.channel_number, len(ph_sync)),
+            "mark_sync": None,
+            "mark_chan": None,
+            "mark_dtime": None,
+            "TTResult_SyncRate": self.sync_rate,
+            "MeasDesc_Resolution": 1,
+            "File_CreatingTime": file_time,
+            "HWSync_Divider": None,
+            "MeasDesc_AcquisitionTime": ph_sync[-1] / self.sync_rate,
+            "Headers": {
+                "Header": self.header_text,
+                "Identifier": self.identifier,
+                "Settings": self.settings
+            }
+        }
 
-    # Fill in dictionary
-    photon_data.update({
-        "ph_sync": ph_sync,
-        "ph_dtime": ph_dtime,
-        "ph_channel": ph_channel,
-        "MeasDesc_AcquisitionTime": meas_time_ms,
-        "File_CreatingTime": file_time,
-    })
 
-    return photon_data
+def read_confo_cor3(filepath):
+    """
+    Reads Zeiss ConfoCor3 .raw photon arrival time files.
+    Returns dict compatible with photonData struct.
+    """
+    return ConfoCor3RawFile(filepath).photon_data()
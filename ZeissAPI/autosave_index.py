@@ -0,0 +1,259 @@
+import heapq
+import os
+import threading
+
+try:
+    from System.IO import Directory, File, FileSystemWatcher, NotifyFilters
+except ImportError:
+    # outside of ZEN the plain-Python file system stand-in is used, e.g. on Linux
+    Directory = None
+
+"""
+Incremental index of the Zen autosave folder used by the FCS experiments. The .fcs and .raw files are grouped by the
+FCS UUID, the part of the file name before the first "_", and the groups with an .fcs are kept in a heap ordered by the
+last write time of the .fcs, so the newest FCS and its RAWs are found without listing the folder.
+
+The index is updated from the directory change events: on_created, on_changed, on_deleted and on_renamed, fed by a
+.NET FileSystemWatcher inside ZEN. Without the events refresh() works as a cursor: it lists the file names, reads the
+times of the files not seen before and of the indexed .fcs files, so a rewritten .fcs is ranked again, while the times
+of the known .raw files are not read again. The folder is scanned again when the events were lost (watcher buffer
+overflow) or a file of the newest group disappeared unnoticed.
+"""
+
+INDEXED_EXTENSIONS = (".fcs", ".raw")
+
+
+class DotNetFileSystem:
+    """
+    Access to the folder through System.IO, with the FileSystemWatcher feeding the index.
+    """
+
+    @staticmethod
+    def list_files(folder):
+        return list(Directory.GetFiles(folder))
+
+    @staticmethod
+    def mtime(path):
+        return File.GetLastWriteTimeUtc(path).Ticks
+
+    @staticmethod
+    def exists(path):
+        return File.Exists(path)
+
+    @staticmethod
+    def watch(folder, index):
+        """
+        Starts the FileSystemWatcher of the folder calling the event handlers of the index
+        :return: FileSystemWatcher, has to be kept referenced
+        """
+        watcher = FileSystemWatcher(folder)
+        watcher.NotifyFilter = NotifyFilters.FileName | NotifyFilters.LastWrite
+        watcher.InternalBufferSize = 64 * 1024
+        watcher.Created += lambda sender, e: index.on_created(e.FullPath)
+        watcher.Changed += lambda sender, e: index.on_changed(e.FullPath)
+        watcher.Deleted += lambda sender, e: index.on_deleted(e.FullPath)
+        watcher.Renamed += lambda sender, e: index.on_renamed(e.OldFullPath, e.FullPath)
+        watcher.Error += lambda sender, e: index.invalidate()
+        watcher.EnableRaisingEvents = True
+        return watcher
+
+
+class LocalFileSystem:
+    """
+    Plain-Python stand-in of DotNetFileSystem, without the watcher the index is updated by refresh().
+    """
+
+    @staticmethod
+    def list_files(folder):
+        return [os.path.join(folder, f) for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
+
+    @staticmethod
+    def mtime(path):
+        return os.path.getmtime(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(path)
+
+    @staticmethod
+    def watch(folder, index):
+        return None
+
+
+def fcs_uuid(path):
+    """
+    :param str path: path of the .fcs or .raw file
+    :return str: UUID of the FCS measurement, None for the other files
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    if extension.lower() not in INDEXED_EXTENSIONS:
+        return None
+    return name.split("_")[0]
+
+
+class AutosaveIndex:
+    """
+    Index of the .fcs and .raw files of the autosave folder grouped by the FCS UUID.
+
+    param str folder: path to the Zen autosave folder
+    param file_system: DotNetFileSystem or LocalFileSystem, by default the one available
+    param bool watch: start the FileSystemWatcher when the file system supports it
+    """
+
+    def __init__(self, folder, file_system=None, watch=True):
+
+        self.folder = folder
+        self.file_system = file_system or (DotNetFileSystem if Directory is not None else LocalFileSystem)
+
+        self.fcs = {}  # uuid: (path, mtime)
+        self.raws = {}  # uuid: {path: mtime}
+        self._heap = []  # (-mtime of the .fcs, uuid), outdated entries are skipped on the lookup
+        self._stale = True
+        self._lock = threading.RLock()
+
+        self.watcher = self.file_system.watch(folder, self) if watch else None
+        self.rescan()
+
+    def rescan(self):
+        """
+        Builds the index from the listing of the whole folder
+        :return: None
+        """
+        with self._lock:
+            self.fcs, self.raws, self._heap = {}, {}, []
+            for path in self.file_system.list_files(self.folder):
+                self._add(path)
+            self._stale = False
+
+    def refresh(self):
+        """
+        Cursor update without the events: adds the new files and removes the missing ones, the times are read for
+        the new files and the .fcs files, so a rewritten .fcs is ranked by its new time; the order of the known .raw
+        files is not updated
+        :return: None
+        """
+        with self._lock:
+            listed = set(p for p in self.file_system.list_files(self.folder) if fcs_uuid(p) is not None)
+            indexed = set(path for path, _ in self.fcs.values())
+            for paths in self.raws.values():
+                indexed.update(paths)
+
+            for path in indexed - listed:
+                self._remove(path)
+            for path in listed - indexed:
+                self._add(path)
+
+            for key, (path, mtime) in list(self.fcs.items()):
+                try:
+                    changed = self.file_system.mtime(path) != mtime
+                except (IOError, OSError):
+                    continue
+                if changed:
+                    self._add(path)
+
+    def invalidate(self):
+        """
+        Marks the index for the full rescan on the next lookup, e.g. after the watcher lost the events
+        :return: None
+        """
+        self._stale = True
+
+    def _add(self, path):
+        key = fcs_uuid(path)
+        if key is None:
+            return
+        try:
+            mtime = self.file_system.mtime(path)
+        except (IOError, OSError):
+            return
+
+        if path.lower().endswith(".fcs"):
+            self.fcs[key] = (path, mtime)
+            heapq.heappush(self._heap, (-mtime, key))
+            # the Changed events of the .fcs being written leave many outdated entries
+            if len(self._heap) > 4 * len(self.fcs) + 64:
+                self._heap = [(-m, k) for k, (_, m) in self.fcs.items()]
+                heapq.heapify(self._heap)
+        else:
+            self.raws.setdefault(key, {})[path] = mtime
+
+    def _remove(self, path):
+        key = fcs_uuid(path)
+        if key is None:
+            return
+
+        if path.lower().endswith(".fcs"):
+            if key in self.fcs and self.fcs[key][0] == path:
+                del self.fcs[key]
+        elif key in self.raws:
+            self.raws[key].pop(path, None)
+            if not self.raws[key]:
+                del self.raws[key]
+
+    def on_created(self, path):
+        with self._lock:
+            self._add(path)
+
+    def on_changed(self, path):
+        with self._lock:
+            self._add(path)
+
+    def on_deleted(self, path):
+        with self._lock:
+            self._remove(path)
+
+    def on_renamed(self, old_path, new_path):
+        with self._lock:
+            self._remove(old_path)
+            self._add(new_path)
+
+    def _newest_uuid(self):
+        """
+        :return str: UUID of the newest .fcs, the outdated heap entries are dropped on the way
+        """
+        while self._heap:
+            negative_mtime, key = self._heap[0]
+            if key in self.fcs and self.fcs[key][1] == -negative_mtime:
+                return key
+            heapq.heappop(self._heap)
+        return None
+
+    def latest(self):
+        """
+        Finds the newest .fcs and the .raw files of the same UUID
+        :return: tuple (path of the .fcs, list of the .raw paths from the newest), (None, []) without any .fcs
+        """
+        with self._lock:
+            if self._stale:
+                self.rescan()
+            elif self.watcher is None:
+                self.refresh()
+
+            for attempt in range(2):
+                key = self._newest_uuid()
+                if key is None:
+                    return None, []
+
+                fcs_path = self.fcs[key][0]
+                raws = self.raws.get(key, {})
+                if self.file_system.exists(fcs_path) and all(self.file_system.exists(r) for r in raws):
+                    return fcs_path, sorted(raws, key=lambda r: raws[r], reverse=True)
+
+                # the files were moved without the event
+                self.rescan()
+
+            return None, []
+
+
+_INDICES = {}
+
+
+def autosave_index(folder):
+    """
+    Index of the folder shared by all the PathManagers, so the folder is listed only once per session
+    :param str folder: path to the Zen autosave folder
+    :return AutosaveIndex: index of the folder
+    """
+    if folder not in _INDICES:
+        _INDICES[folder] = AutosaveIndex(folder)
+    return _INDICES[folder]
@@ -1,5 +1,22 @@
-from System.Diagnostics import Process
 import json
+import math
+import os
+import socket
+import threading
+import time
+
+try:
+    from System.Diagnostics import Process
+except ImportError:
+    # outside of ZEN the plain-Python stand-in of the .NET Process is used, e.g. on Linux
+    try:
+        from process_standin import Process
+    except ImportError:
+        from ZeissAPI.process_standin import Process
+
+
+# prefix of the stdout line with the measurement points, the same as data_processing.main_processor.RESULT_MARKER
+RESULT_MARKER = "@@MEASUREMENT_POINTS@@ "
 
 
 def log(msg):
@@ -15,16 +32,285 @@ def log(msg):
         f.write(msg + "\n")
 
 
+def parse_result(lines):
+    """
+    Finds the measurement points printed by main_processor with --emit_points=True
+    :param list lines: lines of the output
+    :return dict: measurement points or None if they were not printed
+    """
+    for line in reversed(lines):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return None
+
+
+class AnalysisJob:
+
+    """
+    Analysis running in a separate Python process. The stdout and stderr are drained concurrently by the events of the
+    process, so the process never blocks on a full pipe, and every line can be streamed to the on_line callback. The
+    job is polled or waited for, and cancelled when it runs longer than the timeout.
+
+    param proc: System.Diagnostics.Process (or its stand-in) with the StartInfo filled
+    param str saving_path: JSON with the measurement points, read when the points were not printed
+    param float timeout: time limit of the analysis in seconds, None without the limit
+    param on_line: optional function (stream name, line) called for every line of the output
+    """
+    def __init__(self, proc, saving_path=None, timeout=None, on_line=None):
+
+        self.proc = proc
+        self.saving_path = saving_path
+        self.timeout = timeout
+        self.on_line = on_line
+
+        self.output = []
+        self.errors = []
+        self.cancelled = False
+        self.timed_out = False
+        self.started = None
+        self._lock = threading.Lock()
+
+        self.proc.OutputDataReceived += self._on_output
+        self.proc.ErrorDataReceived += self._on_error
+
+    def start(self):
+        """
+        Starts the process and the concurrent reading of its output
+        :return AnalysisJob: self
+        """
+        self.proc.Start()
+        self.started = time.time()
+        self.proc.BeginOutputReadLine()
+        self.proc.BeginErrorReadLine()
+        return self
+
+    def _on_output(self, sender, args):
+        # None marks the end of the stream
+        if args.Data is None:
+            return
+        with self._lock:
+            self.output.append(args.Data)
+        if self.on_line is not None:
+            self.on_line("stdout", args.Data)
+
+    def _on_error(self, sender, args):
+        if args.Data is None:
+            return
+        with self._lock:
+            self.errors.append(args.Data)
+        if self.on_line is not None:
+            self.on_line("stderr", args.Data)
+
+    def _remaining(self):
+        if self.timeout is None:
+            return None
+        return max(self.timeout - (time.time() - self.started), 0)
+
+    def poll(self):
+        """
+        Checks the state of the job without blocking, the job exceeding its timeout is cancelled
+        :return str: "running", "finished", "failed", "cancelled" or "timed out"
+        """
+        if not self.proc.HasExited:
+            if self._remaining() == 0:
+                self.cancel(timed_out=True)
+            else:
+                return "running"
+
+        if self.timed_out:
+            return "timed out"
+        if self.cancelled:
+            return "cancelled"
+        return "finished" if self.proc.ExitCode == 0 else "failed"
+
+    def wait(self, timeout=None):
+        """
+        Waits for the end of the job, the job exceeding its own timeout is cancelled
+        :param float timeout: time in seconds to wait in this call, None waits up to the job timeout
+        :return bool: True if the process exited
+        """
+        remaining = self._remaining()
+        if timeout is not None:
+            remaining = timeout if remaining is None else min(timeout, remaining)
+
+        if remaining is None:
+            self.proc.WaitForExit()
+            return True
+
+        # rounded up, so the job timeout has passed when the wait times out
+        if not self.proc.WaitForExit(int(math.ceil(remaining * 1000))):
+            if self._remaining() == 0:
+                self.cancel(timed_out=True)
+            return False
+
+        # the second call waits until the output events are processed
+        self.proc.WaitForExit()
+        return True
+
+    def cancel(self, timed_out=False):
+        """
+        Kills the process
+        :param bool timed_out: the job is cancelled because of its timeout
+        :return: None
+        """
+        self.cancelled = True
+        self.timed_out = timed_out
+        if not self.proc.HasExited:
+            self.proc.Kill()
+        self.proc.WaitForExit()
+
+    def result(self):
+        """
+        Measurement points of the finished job, taken from the output, or from the saving_path when not printed
+        :return dict: measurement points or None
+        """
+        with self._lock:
+            points = parse_result(self.output)
+
+        if points is None and self.saving_path and not self.cancelled and os.path.isfile(self.saving_path):
+            with open(self.saving_path, "r") as f:
+                points = json.load(f)
+        return points
+
+
+class AnalysisServerClient:
+
+    """
+    Thin client of the data_processing.analysis_server. Sends the main_processor arguments as one JSON line and reads
+    one JSON line with the response.
+
+    param str host: address of the analysis server
+    param int port: port of the analysis server
+    param float timeout: socket timeout in seconds
+    """
+    def __init__(self, host, port, timeout=600):
+
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+
+    def _send(self, request):
+        """
+        Sends the request and returns the decoded response
+        :param dict request: request for the server
+        :return dict: response of the server
+        """
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if chunk.endswith(b"\n"):
+                    break
+        finally:
+            sock.close()
+
+        return json.loads(b"".join(chunks).decode("utf-8"))
+
+    def is_available(self):
+        """
+        Checks if the analysis server is running
+        :return bool: True if the server answered the ping
+        """
+        try:
+            return self._send({"command": "ping"})["status"] == "ok"
+        except (socket.error, ValueError):
+            return False
+
+    def analyze(self, **kwargs):
+        """
+        Runs the analysis on the server
+        :param dict kwargs: dictionary of the arguments for main_processor
+        :return dict: response of the server with status, output and error
+        """
+        return self._send({"command": "analyze", "args": kwargs})
+
+
+class PendingAnalysis:
+
+    """
+    Analysis submitted to the PythonAnalysisRunner and collected later. With the watch-folder ingestion the result of
+    data_processing.watch_folder is waited for only until the deadline counted from the submission, so the time of the
+    stage moves and acquisitions done in between is not added to the wait. Otherwise the process is started at once, or
+    the request is sent to the analysis server from a background thread.
+
+    param PythonAnalysisRunner runner: runner running the analysis
+    param dict kwargs: dictionary of the arguments for Python initialization
+    """
+    def __init__(self, runner, kwargs):
+
+        self.runner = runner
+        self.kwargs = kwargs
+
+        self.input_mtime = None
+        self.deadline = None
+        self.job = None
+        self.thread = None
+        self.server_result = (False, None)
+
+    def start(self):
+        """
+        Starts the analysis, or only notes the deadline when the watch-folder result is expected
+        :return PendingAnalysis: self
+        """
+        config = self.runner.config
+        if config.get("watch_folder_ingestion"):
+            self.input_mtime = self.runner.ingested_inputs_mtime(**self.kwargs)
+            if self.input_mtime is not None:
+                self.deadline = time.time() + float(config.get("watch_folder_timeout_s", 60))
+                return self
+
+        if self.runner.server_client is not None:
+            self.thread = threading.Thread(target=self._run_on_server)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.job = self.runner.start(**self.kwargs)
+        return self
+
+    def _run_on_server(self):
+        self.server_result = self.runner._run_on_server(**self.kwargs)
+
+    def result(self):
+        """
+        Waits for the analysis
+        :return dict: measurement points streamed by the analysis, None if they have to be read from the saving_path
+        """
+        if self.deadline is not None:
+            if self.runner.wait_for_ingested_result(self.kwargs["saving_path"], self.input_mtime, self.deadline):
+                return None
+            return self.runner.run_now(**self.kwargs)
+
+        if self.thread is not None:
+            self.thread.join()
+            handled, points = self.server_result
+            if handled:
+                return points
+            return self.runner.run_process(**self.kwargs)
+
+        return self.runner.finish_process(self.job, **self.kwargs)
+
 
 class PythonAnalysisRunner:
 
     """
     Class responsible for the correct initialization of the main_processor Python script and loading correct arguments.
+    If "analysis_server_port" is set in the config and the analysis server is running, the analysis is sent to the
+    server, otherwise a new Python process with main_processor is started. If "watch_folder_ingestion" is set, the
+    overview and FCS results written by data_processing.watch_folder are used when they appear within
+    "watch_folder_timeout_s" seconds from the submission, otherwise the analysis is started here. The process is killed
+    after "analysis_timeout_s" seconds.
 
     param str config_path: path to the localization of the config folder
+    param process_factory: function returning a new Process, by default System.Diagnostics.Process
 
     """
-    def __init__(self, config_path):
+    def __init__(self, config_path, process_factory=None):
 
         with open(config_path, "r") as f:
             self.config = json.load(f)
@@ -32,6 +318,13 @@ class PythonAnalysisRunner:
         self.python = self.config["python_exe"] #path to the virtual environment
         self.script = self.config["python_script"] #path to the python script - main_processor
         self.project = self.config["python_project_root"] #root of the main_processor localization
+        self.timeout = self.config.get("analysis_timeout_s", 600) #time limit of the analysis process in seconds
+        self.process_factory = process_factory or Process
+
+        self.server_client = None
+        if self.config.get("analysis_server_port"):
+            self.server_client = AnalysisServerClient(self.config.get("analysis_server_host", "127.0.0.1"),
+                                                      self.config["analysis_server_port"])
 
 
     def _make_args(self, **kwargs):
@@ -43,36 +336,161 @@ class PythonAnalysisRunner:
         args = []
         for k, v in kwargs.items():
             if v is not None:
-                args.append("--{}={}".format(k, v))
+                arg = "--{}={}".format(k, v)
+                # paths with spaces stay one argument of the command line
+                args.append('"{}"'.format(arg) if " " in arg else arg)
         return args
 
     def run(self, **kwargs):
         """
-        Function for Python initialization
+        Function for running the analysis, on the analysis server if available, otherwise in a new Python process
         :param dict kwargs: dictionary of the arguments for Python initialization
-        :return: None
+        :return dict: measurement points streamed by the analysis, None if they have to be read from the saving_path
         """
-        log("Started run of python!")
-        
-        proc = Process()
+        return self.submit(**kwargs).result()
+
+    def submit(self, **kwargs):
+        """
+        Function for starting the analysis without waiting for its result, so the macro can move the stage and acquire
+        the next image meanwhile
+        :param dict kwargs: dictionary of the arguments for Python initialization
+        :return PendingAnalysis: analysis collected with its result() when the points are needed
+        """
+        return PendingAnalysis(self, kwargs).start()
+
+    def run_now(self, **kwargs):
+        """
+        Function for running the analysis here, without looking for the watch-folder result
+        :param dict kwargs: dictionary of the arguments for Python initialization
+        :return dict: measurement points streamed by the analysis, None if they have to be read from the saving_path
+        """
+        if self.server_client is not None:
+            handled, points = self._run_on_server(**kwargs)
+            if handled:
+                return points
+
+        return self.run_process(**kwargs)
+
+    @staticmethod
+    def ingested_inputs_mtime(**kwargs):
+        """
+        Function for finding the files analysed by the watch-folder ingestion, the overview images and the FCS .raw
+        files
+        :param dict kwargs: dictionary of the arguments for the analysis
+        :return float: last modification time of the analysed files, None if the analysis is not ingested
+        """
+        is_fcs = str(kwargs.get("is_FCS")) == "True"
+        if kwargs.get("type") != "overview" and not is_fcs:
+            return None
+
+        file_path = kwargs["file_path"]
+        if is_fcs:
+            folder = os.path.dirname(file_path)
+            inputs = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(".raw")]
+        else:
+            inputs = [file_path] if os.path.isfile(file_path) else []
+
+        if not inputs:
+            return None
+
+        return max(os.path.getmtime(f) for f in inputs)
+
+    @staticmethod
+    def wait_for_ingested_result(saving_path, input_mtime, deadline):
+        """
+        Function for waiting for the result of the watch-folder ingestion, which analyses the overview images and the
+        FCS .raw files as soon as they are saved. The processors write the JSON to a temporary file and rename it, so
+        the file under the saving_path is always complete.
+        :param str saving_path: JSON with the measurement points written by the ingestion
+        :param float input_mtime: last modification time of the analysed files
+        :param float deadline: time.time() after which the result is not waited for anymore
+        :return bool: True if the result newer than the analysed files was found
+        """
+        while True:
+            if os.path.isfile(saving_path) and os.path.getmtime(saving_path) >= input_mtime:
+                log("Using the watch-folder result: {}".format(saving_path))
+                return True
+            if time.time() >= deadline:
+                break
+            time.sleep(0.05)
+
+        log("Watch-folder result not found in time, running the analysis: {}".format(saving_path))
+        return False
+
+    def _run_on_server(self, **kwargs):
+        """
+        Function for sending the analysis to the analysis server
+        :param dict kwargs: dictionary of the arguments for the analysis
+        :return tuple: (True if the server handled the request, False if the process fallback is needed,
+                        measurement points or None)
+        """
+        kwargs = dict(kwargs, emit_points=True)
+        try:
+            response = self.server_client.analyze(**kwargs)
+        except (socket.error, ValueError) as e:
+            log("Analysis server not available ({}), starting python process".format(e))
+            return False, None
+
+        output = response.get("output", "").splitlines()
+        log("\n".join(line for line in output if not line.startswith(RESULT_MARKER)))
+        if response.get("status") != "ok":
+            log("Analysis server error: {}".format(response.get("error")))
+            return True, None
+
+        return True, parse_result(output)
+
+    def start(self, on_line=None, **kwargs):
+        """
+        Function for starting the analysis in a new Python process without waiting for its end, the measurement points
+        are printed by main_processor and streamed back with the output
+        :param on_line: optional function (stream name, line) called for every line of the output
+        :param dict kwargs: dictionary of the arguments for Python initialization
+        :return AnalysisJob: started job, to be polled, waited for or cancelled
+        """
+        proc = self.process_factory()
         proc.StartInfo.FileName = self.python
         proc.StartInfo.WorkingDirectory = self.project
         proc.StartInfo.UseShellExecute = False
         proc.StartInfo.RedirectStandardOutput = True
         proc.StartInfo.RedirectStandardError = True
+        proc.StartInfo.CreateNoWindow = True
         env = proc.StartInfo.EnvironmentVariables
         env["PYTHONPATH"] = self.project
 
-        args = [self.script] + self._make_args(**kwargs)
-        
+        args = [self.script] + self._make_args(**dict(kwargs, emit_points=True))
+
         log("Runner arguments:{}".format(args))
-        
+
         proc.StartInfo.Arguments = " ".join(args)
 
-        proc.Start()
-        out = proc.StandardOutput.ReadToEnd()
-        err = proc.StandardError.ReadToEnd()
-        proc.WaitForExit()
+        job = AnalysisJob(proc, kwargs.get("saving_path"), self.timeout, on_line)
+        return job.start()
+
+    def run_process(self, **kwargs):
+        """
+        Function for running the analysis in a new Python process and waiting for its end
+        :param dict kwargs: dictionary of the arguments for Python initialization
+        :return dict: measurement points, None if the analysis failed or was cancelled
+        """
+        log("Started run of python!")
+
+        return self.finish_process(self.start(**kwargs), **kwargs)
+
+    def finish_process(self, job, **kwargs):
+        """
+        Function for waiting for the end of the analysis started in a new Python process
+        :param AnalysisJob job: job started by start()
+        :param dict kwargs: dictionary of the arguments of the job
+        :return dict: measurement points, None if the analysis failed or was cancelled
+        """
+        job.wait()
+
+        log("\n".join(line for line in job.output if not line.startswith(RESULT_MARKER)))
+        log("\n".join(job.errors))
+
+        state = job.poll()
+        if state != "finished":
+            log("Python analysis {} (exit code {}): {}".format(state, job.proc.ExitCode, kwargs.get("file_path")))
+            return None
 
-        log(out)
-        log(err)
+        return job.result()
@@ -1,6 +1,8 @@
 ﻿from System.IO import Directory, Path, File
 import json
 
+from autosave_index import autosave_index
+
 
 def log(msg):
     """
@@ -106,28 +108,16 @@ class PathManager:
 
     def get_latest_fcs_and_raws(self):
         """
-        Finds the latest .fcs file in the Zen autosave folder, matches the corresponding .raw files by uuid and returns
-        list of paths.
+        Finds the latest .fcs file in the Zen autosave folder and the corresponding .raw files with the same uuid, using
+        the incremental index of the folder instead of listing it.
+        :return: list of paths, the .fcs first, empty if there is no .fcs with the .raw files
         """
-        files = Directory.GetFiles(self.zeiss_temp)
-        fcs_files = [f for f in files if f.lower().endswith(".fcs")]
-        raw_files = [f for f in files if f.lower().endswith(".raw")]
+        newest_fcs, matching_raws = autosave_index(self.zeiss_temp).latest()
 
-        if len(fcs_files) == 0 or len(raw_files) == 0:
+        if newest_fcs is None or len(matching_raws) == 0:
             log("No FCS or .raw in folder: {}".format(self.zeiss_temp))
             return []
 
-        fcs_files.sort(key=lambda f: File.GetLastWriteTime(f), reverse=True)
-        raw_files.sort(key=lambda f: File.GetLastWriteTime(f), reverse=True)
-
-        newest_fcs = fcs_files[0]
-
-        fcs_name = Path.GetFileNameWithoutExtension(newest_fcs)
-
-        matching_raws = [r for r in raw_files if Path.GetFileName(r).startswith(fcs_name)]
-
         log("Found {} RAW with this UUID.".format(len(matching_raws)))
 
-        all_paths = [newest_fcs] + matching_raws
-
-        return all_paths
+        return [newest_fcs] + matching_raws
@@ -0,0 +1,125 @@
+import os
+import shlex
+import subprocess
+import threading
+
+"""
+Plain-Python stand-in for System.Diagnostics.Process, with the subset of its API used by the PythonAnalysisRunner:
+StartInfo, Start, the OutputDataReceived and ErrorDataReceived events with BeginOutputReadLine and
+BeginErrorReadLine, HasExited, WaitForExit, Kill and ExitCode. It lets the runner run outside of ZEN, e.g. on Linux.
+"""
+
+
+class DataReceivedEventArgs(object):
+    """
+    Line of the output, None at the end of the stream, as in .NET.
+    """
+
+    def __init__(self, data):
+        self.Data = data
+
+
+class _Event(object):
+    """
+    .NET-like event supporting the += and -= of the handlers.
+    """
+
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self, sender, args):
+        for handler in list(self.handlers):
+            handler(sender, args)
+
+
+class ProcessStartInfo(object):
+
+    def __init__(self):
+        self.FileName = ""
+        self.Arguments = ""
+        self.WorkingDirectory = None
+        self.UseShellExecute = False
+        self.RedirectStandardOutput = False
+        self.RedirectStandardError = False
+        self.CreateNoWindow = True
+        self.EnvironmentVariables = dict(os.environ)
+
+
+class Process(object):
+    """
+    Process started with the subprocess module, the redirected streams are drained by the reader threads.
+    """
+
+    def __init__(self):
+        self.StartInfo = ProcessStartInfo()
+        self.OutputDataReceived = _Event()
+        self.ErrorDataReceived = _Event()
+        self._popen = None
+        self._readers = []
+
+    def Start(self):
+        info = self.StartInfo
+        pipe = subprocess.PIPE
+        self._popen = subprocess.Popen([info.FileName] + shlex.split(info.Arguments), cwd=info.WorkingDirectory,
+                                       env=info.EnvironmentVariables,
+                                       stdout=pipe if info.RedirectStandardOutput else None,
+                                       stderr=pipe if info.RedirectStandardError else None,
+                                       universal_newlines=True, bufsize=1)
+        return True
+
+    def _read_lines(self, stream, event):
+        for line in iter(stream.readline, ""):
+            event.fire(self, DataReceivedEventArgs(line.rstrip("\r\n")))
+        stream.close()
+        event.fire(self, DataReceivedEventArgs(None))
+
+    def _begin_read(self, stream, event):
+        reader = threading.Thread(target=self._read_lines, args=(stream, event))
+        reader.daemon = True
+        reader.start()
+        self._readers.append(reader)
+
+    def BeginOutputReadLine(self):
+        self._begin_read(self._popen.stdout, self.OutputDataReceived)
+
+    def BeginErrorReadLine(self):
+        self._begin_read(self._popen.stderr, self.ErrorDataReceived)
+
+    @property
+    def Id(self):
+        return self._popen.pid
+
+    @property
+    def HasExited(self):
+        return self._popen.poll() is not None
+
+    @property
+    def ExitCode(self):
+        return self._popen.returncode
+
+    def WaitForExit(self, milliseconds=None):
+        """
+        :param int milliseconds: time limit, None waits until the exit and the end of the redirected streams
+        :return: bool, True if the process exited
+        """
+        try:
+            self._popen.wait(None if milliseconds is None else milliseconds / 1000.0)
+        except subprocess.TimeoutExpired:
+            return False
+
+        if milliseconds is None:
+            for reader in self._readers:
+                reader.join()
+        return True
+
+    def Kill(self):
+        if not self.HasExited:
+            self._popen.kill()
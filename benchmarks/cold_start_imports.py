@@ -0,0 +1,90 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+"""
+Cold-start benchmark of the imports needed by every analysis profile in config/preprocessing_config.json. Each
+measurement runs in a fresh interpreter, the same way the PythonAnalysisRunner starts main_processor.
+
+Run from the project root: python benchmarks/cold_start_imports.py --repeats=5
+"""
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# measured inside the child process: processor import and the lookup of the analyzer class
+CHILD_CODE = """
+import json, sys, time
+t0 = time.perf_counter()
+from data_processing.processor.zeiss_image_processor import ZeissImageProcessor
+from data_processing.image_analysis.analysis_registry import get_image_analysis_type
+t1 = time.perf_counter()
+analyzer = get_image_analysis_type(sys.argv[1])
+t2 = time.perf_counter()
+print(json.dumps({'processor_s': t1 - t0, 'analyzer_s': t2 - t1, 'found': analyzer is not None,
+                  'modules': len(sys.modules)}))
+"""
+
+
+def measure_profile(chosen_analysis, repeats):
+    """
+    Measures the import times of one analyzer in fresh interpreters.
+    :param str chosen_analysis: name of the analyzer class
+    :param int repeats: number of fresh interpreters
+    :return: dict with the median times in seconds and the number of loaded modules
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", CHILD_CODE, chosen_analysis], cwd=PROJECT_ROOT, env=env,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    return {
+        "processor_s": statistics.median(r["processor_s"] for r in runs),
+        "analyzer_s": statistics.median(r["analyzer_s"] for r in runs),
+        "total_s": statistics.median(r["processor_s"] + r["analyzer_s"] for r in runs),
+        "modules": runs[-1]["modules"],
+        "found": runs[-1]["found"],
+    }
+
+
+def run_benchmark(repeats=5, config_path=os.path.join(PROJECT_ROOT, "config", "preprocessing_config.json")):
+    """
+    Measures the cold-start import time for every profile of the preprocessing config.
+    :param int repeats: number of fresh interpreters per profile
+    :param str config_path: path to preprocessing_config.json
+    :return: dict {profile name: measured times}
+    """
+    with open(config_path, "r") as f:
+        profiles = json.load(f)
+
+    # the entries without an analyzer are not analysis profiles, as in the analysis_server warm-up
+    return {name: dict(measure_profile(profile["chosen_analysis"], repeats), chosen_analysis=profile["chosen_analysis"])
+            for name, profile in profiles.items() if isinstance(profile, dict) and profile.get("chosen_analysis")}
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, PROJECT_ROOT)
+    from utils import parse_args_to_dict
+
+    args = parse_args_to_dict()
+    results = run_benchmark(int(args.get("repeats", 5)))
+
+    print("{:<20} {:<22} {:>12} {:>12} {:>10} {:>8}".format("profile", "analysis", "processor s", "analyzer s",
+                                                           "total s", "modules"))
+    for name, res in results.items():
+        if "error" in res:
+            print("{:<20} {:<22} {}".format(name, res["chosen_analysis"], res["error"]))
+            continue
+        print("{:<20} {:<22} {:>12.3f} {:>12.3f} {:>10.3f} {:>8}".format(
+            name, res["chosen_analysis"], res["processor_s"], res["analyzer_s"], res["total_s"], res["modules"]))
+
+    if "output" in args:
+        with open(args["output"], "w") as f:
+            json.dump(results, f, indent=2)
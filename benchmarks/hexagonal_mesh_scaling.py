@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+"""
+Scaling benchmark of the HexagonalMesh edge extraction and clustering on synthetic hexagonal meshes of growing node
+count. The per-edge Python loops used before are timed as a reference up to --max_loop_nodes.
+
+Run from the project root: python benchmarks/hexagonal_mesh_scaling.py --sizes=1000,10000,100000 --repeats=3
+"""
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_mesh_nodes(n_nodes, spacing=20.0, jitter=0.5, seed=0):
+    """
+    Nodes of the honeycomb mesh (vertices of the hexagons) with a small position noise.
+    :param int n_nodes: approximate number of nodes
+    :return: ndarray (N, 2) of node positions in pixels
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_nodes / 2)))
+
+    i, j = np.meshgrid(np.arange(side), np.arange(side), indexing='ij')
+    a1 = np.array([1.5, np.sqrt(3) / 2]) * spacing
+    a2 = np.array([0, np.sqrt(3)]) * spacing
+    lattice = i.reshape(-1, 1) * a1 + j.reshape(-1, 1) * a2
+
+    # two nodes in the unit cell of the honeycomb
+    nodes = np.concatenate([lattice, lattice + np.array([spacing, 0])])[:n_nodes]
+
+    return nodes + rng.normal(0, jitter, nodes.shape)
+
+
+def loop_edges_and_lengths(points, triangles):
+    """
+    Reference: the per-triangle and per-edge loops replaced by the array implementation.
+    """
+    edges = set()
+    for triangle in triangles:
+        for i in range(3):
+            edges.add(tuple(sorted([triangle[i], triangle[(i + 1) % 3]])))
+
+    return [np.linalg.norm(points[e[0]] - points[e[1]]) for e in edges]
+
+
+def measure(n_nodes, repeats, with_loops):
+    """
+    Times the stages of find_midpoints_and_centroids for one mesh size.
+    :return: dict with the median times in seconds
+    """
+    from scipy.spatial import Delaunay
+    from data_processing.image_analysis.hexagonal_mesh import HexagonalMesh
+
+    # the measured methods do not use the image, so the analyzer is not initialized
+    mesh = HexagonalMesh.__new__(HexagonalMesh)
+    points = synthetic_mesh_nodes(n_nodes)
+
+    times = {"edges_s": [], "clustering_s": [], "total_s": [], "loops_s": []}
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        edges = mesh.get_delaunay_edges(points)
+        t1 = time.perf_counter()
+        mesh.filter_edges_by_distance(points, edges, remove_outliers=True)
+        t2 = time.perf_counter()
+        mesh.find_midpoints_and_centroids(points)
+        t3 = time.perf_counter()
+
+        times["edges_s"].append(t1 - t0)
+        times["clustering_s"].append(t2 - t1)
+        times["total_s"].append(t3 - t2)
+
+        if with_loops:
+            triangles = Delaunay(points).simplices
+            t4 = time.perf_counter()
+            loop_edges_and_lengths(points, triangles)
+            times["loops_s"].append(time.perf_counter() - t4)
+
+    result = {k: float(np.median(v)) for k, v in times.items() if v}
+    result["nodes"] = len(points)
+    result["edges"] = len(edges)
+    return result
+
+
+def run_benchmark(sizes=(1000, 10000, 100000), repeats=3, max_loop_nodes=20000):
+    """
+    :return: list of dicts with the measured times, one per mesh size
+    """
+    return [measure(n, repeats, n <= max_loop_nodes) for n in sizes]
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, PROJECT_ROOT)
+    from utils import parse_args_to_dict
+
+    args = parse_args_to_dict()
+    sizes = [int(n) for n in str(args.get("sizes", "1000,10000,100000")).split(",")]
+    results = run_benchmark(sizes, int(args.get("repeats", 3)), int(args.get("max_loop_nodes", 20000)))
+
+    print("{:>10} {:>10} {:>10} {:>14} {:>10} {:>14}".format("nodes", "edges", "edges s", "clustering s", "total s",
+                                                             "old loops s"))
+    for res in results:
+        loops = "{:>14.4f}".format(res["loops_s"]) if "loops_s" in res else "{:>14}".format("-")
+        print("{:>10} {:>10} {:>10.4f} {:>14.4f} {:>10.4f} {}".format(res["nodes"], res["edges"], res["edges_s"],
+                                                                      res["clustering_s"], res["total_s"], loops))
+
+    if "output" in args:
+        with open(args["output"], "w") as f:
+            json.dump(results, f, indent=2)
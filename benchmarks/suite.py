@@ -0,0 +1,270 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+"""
+Benchmark suite of the analyzers and readers on synthetic data, so it runs without the microscope. Every benchmark
+times its stages at several data sizes, the results are stored per commit in benchmarks/results, so a change can be
+compared with the run of an earlier commit.
+
+Run from the project root:
+python benchmarks/suite.py --only=circles,raw_reader --repeats=5
+python benchmarks/suite.py --compare=benchmarks/results/<commit>.json
+"""
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+
+
+def time_stage(func, repeats):
+    """
+    Runs the function once to warm up and then times it.
+    :param func: callable without arguments
+    :param int repeats: number of the timed runs
+    :return: dict with the median and minimal time in seconds
+    """
+    func()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {"median_s": statistics.median(times), "min_s": min(times)}
+
+
+def analyzer(name, image, metadata, **analysis_details):
+    """
+    :return: initialized analyzer of the registry
+    """
+    from data_processing.image_analysis.analysis_registry import get_image_analysis_type
+
+    return get_image_analysis_type(name)(image=image, metadata=metadata, **analysis_details)
+
+
+def bench_circles(size, repeats, workdir):
+    """
+    Circles on the rings and discs images of size x size pixels with one object per 128 x 128 pixels.
+    """
+    from benchmarks.synthetic_data import guv_image, synthetic_metadata
+
+    n_objects = max(1, (size // 128) ** 2)
+    stages = {}
+    for kind in ["ring", "disc"]:
+        image = guv_image(size, n_objects, kind=kind)
+        obj = analyzer("Circles", image, synthetic_metadata(image.shape))
+        stages[kind + "s"] = time_stage(obj.get_measurement_points, repeats)
+    return stages
+
+
+def bench_hexagonal_mesh(size, repeats, workdir):
+    """
+    HexagonalMesh on the mesh image of size x size pixels.
+    """
+    from benchmarks.synthetic_data import mesh_image, synthetic_metadata
+
+    image = mesh_image(size)
+    obj = analyzer("HexagonalMesh", image, synthetic_metadata(image.shape))
+    nodes = obj.get_mesh_nodes()
+
+    return {
+        "mesh_nodes": time_stage(obj.get_mesh_nodes, repeats),
+        "midpoints_and_centroids": time_stage(lambda: obj.find_midpoints_and_centroids(nodes), repeats),
+        "measurement_points": time_stage(obj.get_measurement_points, repeats),
+    }
+
+
+def bench_cellpose(size, repeats, workdir):
+    """
+    Cellpose_algorithm on the discs image of size x size pixels on the CPU.
+    """
+    from benchmarks.synthetic_data import guv_image, synthetic_metadata
+
+    image = guv_image(size, max(1, (size // 128) ** 2), kind="disc")
+    obj = analyzer("Cellpose_algorithm", image, synthetic_metadata(image.shape), gpu=False, objects_diameter=10)
+    return {"measurement_points": time_stage(obj.get_measurement_points, repeats)}
+
+
+def bench_z_scan(n_planes, repeats, workdir):
+    """
+    Max_intensity_Z_Scan on the stack of n_planes planes of 256 x 256 pixels: reduction of the planes while reading,
+    the profile of the whole stack and the focus with the peak fit.
+    """
+    from benchmarks.synthetic_data import focus_stack, synthetic_metadata
+    from data_processing.image_analysis.z_scan_max_intensity import FOCUS_METRICS
+
+    stack = focus_stack(n_planes, 256)
+    metadata = dict(synthetic_metadata(stack.shape[1:]), stack_shape=stack.shape)
+    reducer = FOCUS_METRICS["variance"]
+
+    full = analyzer("Max_intensity_Z_Scan", stack, metadata, focus_metric="variance")
+    profile = np.array([reducer(plane) for plane in stack])
+    streamed = analyzer("Max_intensity_Z_Scan", profile, metadata, peak_fit="gaussian")
+
+    return {
+        "reduce_planes": time_stage(lambda: [reducer(plane) for plane in stack], repeats),
+        "stack_profile": time_stage(full.get_intensity_profile, repeats),
+        "peak_fit_points": time_stage(streamed.get_measurement_points, repeats),
+    }
+
+
+def bench_pixel_stage_converter(n_points, repeats, workdir):
+    """
+    PixelStageConverter on n_points points of the 2048 x 2048 image, per-point and vectorized.
+    """
+    from benchmarks.synthetic_data import synthetic_metadata
+    from data_processing.image_analysis.pixel_stage_converter import PixelStageConverter, z_normal
+
+    rng = np.random.default_rng(0)
+    converter = PixelStageConverter(synthetic_metadata((2048, 2048)), (2048, 2048))
+    pixels = rng.uniform(0, 2048, (n_points, 2))
+    points = [{"position": p.tolist(), "radius": 5.0} for p in pixels]
+
+    return {
+        "convert_points": time_stage(lambda: converter.convert_points(points, "normal", z_normal), repeats),
+        "convert_points_array": time_stage(lambda: converter.convert_points_array(pixels, "normal", z_normal),
+                                           repeats),
+    }
+
+
+def bench_raw_reader(n_photons, repeats, workdir):
+    """
+    ConfoCor3 .raw reader on the Poisson photon stream of n_photons photons.
+    """
+    from benchmarks.synthetic_data import write_confocor3_raw
+    from IO.read_raw_corr_file import ConfoCor3RawFile, read_confo_cor3
+    from data_processing.processor.zeiss_FCS_processor import raw_file_intensity
+
+    path = write_confocor3_raw(os.path.join(workdir, "P1_{}.raw".format(n_photons)), n_photons)
+
+    return {
+        "read_confo_cor3": time_stage(lambda: read_confo_cor3(path), repeats),
+        "last_arrival_time": time_stage(lambda: ConfoCor3RawFile(path).last_arrival_time, repeats),
+        "raw_file_intensity": time_stage(lambda: raw_file_intensity(path), repeats),
+    }
+
+
+def bench_czi_metadata(n_tiles, repeats, workdir):
+    """
+    Streaming parser of the CZI metadata XML with n_tiles tile regions.
+    """
+    from benchmarks.synthetic_data import czi_metadata_xml
+    from IO.czi_metadata import parse_czi_metadata
+
+    xml = czi_metadata_xml(n_tiles)
+    return {"parse_czi_metadata": time_stage(lambda: parse_czi_metadata(xml), repeats)}
+
+
+# name: (benchmark function, default sizes, unit of the size)
+BENCHMARKS = {
+    "circles": (bench_circles, [512, 1024, 2048], "px"),
+    "hexagonal_mesh": (bench_hexagonal_mesh, [512, 1024, 2048], "px"),
+    "cellpose": (bench_cellpose, [256, 512], "px"),
+    "z_scan": (bench_z_scan, [16, 64, 256], "planes"),
+    "pixel_stage_converter": (bench_pixel_stage_converter, [100, 10000, 1000000], "points"),
+    "raw_reader": (bench_raw_reader, [100000, 1000000, 10000000], "photons"),
+    "czi_metadata": (bench_czi_metadata, [10, 1000, 10000], "tiles"),
+}
+
+
+def git_commit():
+    """
+    :return: str short hash of the current commit, 'unknown' outside of the git repository
+    """
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                             text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def run_suite(names=None, sizes=None, repeats=3):
+    """
+    Runs the benchmarks, a benchmark whose dependencies are missing is reported as skipped.
+    :param list names: names of the benchmarks, by default all of them
+    :param list sizes: data sizes used instead of the defaults
+    :param int repeats: number of the timed runs of every stage
+    :return: dict with the environment and the list of the results
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names or list(BENCHMARKS):
+            func, default_sizes, unit = BENCHMARKS[name]
+            for size in sizes or default_sizes:
+                try:
+                    stages = func(size, repeats, workdir)
+                except ImportError as e:
+                    print("[WARNING] Skipping {}: {}".format(name, e))
+                    break
+                for stage, times in stages.items():
+                    results.append(dict(times, benchmark=name, stage=stage, size=size, unit=unit))
+                    print("{:<22} {:<26} {:>10} {:<7} {:>10.4f} s".format(name, stage, size, unit,
+                                                                         times["median_s"]))
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=1.2):
+    """
+    Prints the ratio of the current and the baseline median times.
+    :param dict current: result of run_suite
+    :param dict baseline: result of run_suite of the earlier commit
+    :param float threshold: ratio above which the stage is reported as a regression
+    :return: list of the regressed (benchmark, stage, size)
+    """
+    old = {(r["benchmark"], r["stage"], r["size"]): r["median_s"] for r in baseline["results"]}
+
+    print("\nCompared with {} ({})".format(baseline["commit"], baseline["date"]))
+    regressions = []
+    for r in current["results"]:
+        key = (r["benchmark"], r["stage"], r["size"])
+        if key not in old or old[key] == 0:
+            continue
+        ratio = r["median_s"] / old[key]
+        flag = ""
+        if ratio > threshold:
+            flag = "REGRESSION"
+            regressions.append(key)
+        print("{:<22} {:<26} {:>10} {:>10.4f} {:>10.4f} {:>7.2f}x {}".format(*key, old[key], r["median_s"], ratio,
+                                                                            flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, PROJECT_ROOT)
+    from utils import parse_args_to_dict
+
+    args = parse_args_to_dict()
+    names = args["only"].split(",") if "only" in args else None
+    sizes = [int(n) for n in str(args["sizes"]).split(",")] if "sizes" in args else None
+
+    suite_results = run_suite(names, sizes, int(args.get("repeats", 3)))
+
+    output = args.get("output", os.path.join(RESULTS_FOLDER, "{}.json".format(suite_results["commit"])))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(suite_results, f, indent=2)
+    print("Saved the results to {}".format(output))
+
+    if "compare" in args:
+        with open(args["compare"], "r") as f:
+            baseline_results = json.load(f)
+        if compare(suite_results, baseline_results, float(args.get("threshold", 1.2))):
+            sys.exit(1)
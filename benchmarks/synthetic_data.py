@@ -0,0 +1,156 @@
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.hexagonal_mesh_scaling import synthetic_mesh_nodes
+
+"""
+Synthetic inputs for the benchmarks, so they run without the microscope: fluorescent GUV-like rings and discs,
+hexagonal meshes, Z-stacks with a focal peak, Poisson photon streams in the ConfoCor3 .raw layout and the CZI metadata
+XML of tiled experiments.
+"""
+
+PIXEL_SIZE_M = 0.2e-6
+
+
+def synthetic_metadata(image_shape, z_step_m=1e-6, center_mode=True):
+    """
+    Metadata in the form returned by the CziFileReader.
+    :param tuple image_shape: (H, W) of the image
+    :return: dict of metadata
+    """
+    return {
+        'scaling_um_per_pixel': {'X': PIXEL_SIZE_M, 'Y': PIXEL_SIZE_M, 'Z': z_step_m},
+        'channels': [{'id': 'Channel:0', 'name': 'Ch1', 'emission_nm': 520.0, 'excitation_nm': 488.0}],
+        'stage_position': {'x': 1000.0, 'y': 2000.0, 'z': 100.0},
+        'z_scan': {'is_activated': True, 'is_center_mode': center_mode, 'is_interval_kept': False},
+        'tiles': [],
+        'image_shape': tuple(image_shape),
+    }
+
+
+def guv_image(size, n_objects, kind='ring', radius_px=(10, 40), noise=0.05, seed=0):
+    """
+    Fluorescence image of the GUV-like objects: bright rings (membrane stain) or filled discs (lumen stain).
+    :param int size: edge of the square image in pixels
+    :param int n_objects: number of the objects
+    :param str kind: 'ring' or 'disc'
+    :param tuple radius_px: range of the radii in pixels
+    :return: uint16 ndarray (size, size)
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size), dtype=np.float32)
+
+    radii = rng.uniform(radius_px[0], radius_px[1], n_objects)
+    centers = rng.uniform(radius_px[1], size - radius_px[1], (n_objects, 2))
+
+    for (cy, cx), r in zip(centers, radii):
+        r_out = int(np.ceil(r + 3))
+        y0, y1 = max(int(cy) - r_out, 0), min(int(cy) + r_out + 1, size)
+        x0, x1 = max(int(cx) - r_out, 0), min(int(cx) + r_out + 1, size)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        distance = np.sqrt((yy - cy) ** 2 + (xx - cx) ** 2)
+
+        if kind == 'ring':
+            profile = np.exp(-0.5 * ((distance - r) / 1.5) ** 2)
+        else:
+            profile = 1 / (1 + np.exp(distance - r))
+        image[y0:y1, x0:x1] = np.maximum(image[y0:y1, x0:x1], profile)
+
+    image += rng.normal(0, noise, image.shape)
+    return (np.clip(image, 0, 1) * 4000).astype(np.uint16)
+
+
+def mesh_image(size, spacing_px=20.0, seed=0):
+    """
+    Fluorescence image of the hexagonal mesh with bright nodes.
+    :param int size: edge of the square image in pixels
+    :param float spacing_px: distance between the neighbouring nodes in pixels
+    :return: uint8 ndarray (size, size)
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = int(2 * (size / (spacing_px * 1.5)) * (size / (spacing_px * np.sqrt(3)))) + 1
+    nodes = synthetic_mesh_nodes(n_nodes, spacing_px, seed=seed)
+    nodes = nodes[(nodes[:, 0] < size) & (nodes[:, 1] < size)]
+
+    image = np.zeros((size, size), dtype=np.float32)
+    rows, cols = np.clip(nodes[:, 1].astype(int), 0, size - 1), np.clip(nodes[:, 0].astype(int), 0, size - 1)
+    image[rows, cols] = 1.0
+
+    # the nodes are spread to spots of a few pixels
+    image = ndimage.gaussian_filter(image, 2.0)
+    image /= image.max() or 1
+
+    image += rng.normal(0, 0.03, image.shape)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+
+def focus_stack(n_planes, size, focus_index=None, seed=0):
+    """
+    Z-stack of the GUV image blurred away from the focal plane, the intensity and contrast peak at focus_index.
+    :param int n_planes: number of the Z planes
+    :param int size: edge of the square planes in pixels
+    :param float focus_index: Z index of the focus, by default slightly off the middle plane
+    :return: uint16 ndarray (n_planes, size, size)
+    """
+    rng = np.random.default_rng(seed)
+    focus_index = n_planes / 2 + 0.3 if focus_index is None else focus_index
+    in_focus = guv_image(size, max(1, size // 64), kind='ring', seed=seed).astype(np.float32)
+
+    stack = np.empty((n_planes, size, size), dtype=np.uint16)
+    for z in range(n_planes):
+        weight = np.exp(-0.5 * ((z - focus_index) / (n_planes / 8)) ** 2)
+        plane = in_focus * weight + in_focus.mean() * (1 - weight) + rng.normal(0, 20, in_focus.shape)
+        stack[z] = np.clip(plane, 0, 65535).astype(np.uint16)
+
+    return stack
+
+
+def write_confocor3_raw(path, n_photons, count_rate_hz=50e3, sync_rate_hz=20e6, channel=1, seed=0):
+    """
+    Writes a Poisson photon stream in the ConfoCor3 .raw layout: 64 bytes of the header text ending with the channel
+    number, 16 uint32 (identifier, settings with the sync rate as the 4th entry, reserved) and the uint32 intervals
+    between the photons in sync units.
+    :param str path: path of the .raw file
+    :param int n_photons: number of the photons
+    :return: str path
+    """
+    rng = np.random.default_rng(seed)
+    intervals = rng.exponential(sync_rate_hz / count_rate_hz, n_photons)
+    intervals = np.clip(np.round(intervals), 1, np.iinfo(np.uint32).max).astype(np.uint32)
+
+    header_text = "Carl Zeiss ConfoCor3 - raw data file - channel {}".format(channel).ljust(64)[:63] + str(channel)
+    header = np.zeros(16, dtype=np.uint32)
+    header[4 + 3] = int(sync_rate_hz)
+
+    with open(path, 'wb') as f:
+        f.write(header_text.encode('ascii'))
+        header.tofile(f)
+        intervals.tofile(f)
+
+    return path
+
+
+def czi_metadata_xml(n_tiles, n_channels=2, seed=0):
+    """
+    Metadata XML of a tiled CZI experiment with the elements read by IO.czi_metadata.
+    :param int n_tiles: number of the SingleTileRegion elements
+    :return: str XML
+    """
+    rng = np.random.default_rng(seed)
+    distances = "".join('<Distance Id="{}"><Value>{}</Value></Distance>'.format(axis, value)
+                        for axis, value in [("X", PIXEL_SIZE_M), ("Y", PIXEL_SIZE_M), ("Z", 1e-6)])
+    channels = "".join('<Channel Id="Channel:{0}"><Name>Ch{0}</Name><EmissionWavelength>{1}</EmissionWavelength>'
+                       '<ExcitationWavelength>{2}</ExcitationWavelength></Channel>'.format(i, 520 + 60 * i,
+                                                                                          488 + 50 * i)
+                       for i in range(n_channels))
+    positions = rng.uniform(0, 10000, (n_tiles, 3))
+    tiles = "".join('<SingleTileRegion Name="P{}"><X>{:.3f}</X><Y>{:.3f}</Y><Z>{:.3f}</Z><IsUsedForAcquisition>true'
+                    '</IsUsedForAcquisition></SingleTileRegion>'.format(i + 1, *p) for i, p in enumerate(positions))
+
+    return ('<ImageDocument><Metadata><Scaling><Items>{}</Items></Scaling>'
+            '<Information><Image><Dimensions><Channels>{}</Channels><S><Scenes><Scene><Positions>'
+            '<Position X="1000" Y="2000" Z="100"/></Positions></Scene></Scenes></S></Dimensions></Image></Information>'
+            '<Experiment><ExperimentBlocks><AcquisitionBlock><SubDimensionSetups><ZStackSetup IsActivated="true">'
+            '<IsCenterMode>true</IsCenterMode><IsIntervalKept>false</IsIntervalKept></ZStackSetup>'
+            '</SubDimensionSetups><TileRegions>{}</TileRegions></AcquisitionBlock></ExperimentBlocks></Experiment>'
+            '</Metadata></ImageDocument>').format(distances, channels, tiles)
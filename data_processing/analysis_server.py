@@ -0,0 +1,155 @@
+import io
+import json
+import os
+import socketserver
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+import data_processing.image_analysis
+from data_processing.image_analysis.analysis_registry import get_image_analysis_type, get_available_analysis
+from data_processing.main_processor import run_analysis, load_preprocessing_config, PREPROCESSING_CONFIG_PATH
+from utils import parse_args_to_dict
+
+"""
+Long-lived analysis server. It keeps the Python interpreter, the imported analysis libraries and the preprocessing
+config warm between the calls of the PythonAnalysisRunner, which otherwise starts a new main_processor process for
+every overview, reanalysis_xy and reanalysis_z step.
+
+Protocol: the client opens a TCP connection on localhost and sends one JSON line, e.g.
+{"command": "analyze", "args": {"file_path": ..., "analysis_arguments": ..., "type": ..., "saving_path": ...,
+"is_FCS": ...}}. The server answers with one JSON line {"status": "ok" | "error", "output": ..., "error": ...}.
+The other commands are "ping" and "shutdown".
+
+Start from the project root: python -m data_processing.analysis_server --config=config/path_config.json
+"""
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 50555
+
+
+class AnalysisRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single request: reads one JSON line and writes back one JSON line.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line.decode("utf-8"))
+            response = self.server.dispatch(request)
+        except Exception as e:
+            response = {"status": "error", "output": "", "error": "{}: {}".format(type(e).__name__, e)}
+
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class AnalysisServer(socketserver.TCPServer):
+    """
+    TCP server running main_processor analyses in a single warm process. Requests are handled one at a time, so the
+    analyses never compete for the GPU or memory.
+
+    :param str host: address to listen on, only local addresses are expected
+    :param int port: port to listen on
+    :param str preprocessing_config_path: path to preprocessing_config.json
+    """
+    allow_reuse_address = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, preprocessing_config_path=PREPROCESSING_CONFIG_PATH):
+        self.preprocessing_config_path = preprocessing_config_path
+        self.stop_requested = False
+        self._config_mtime = None
+        self._preprocessing_config = None
+
+        super().__init__((host, port), AnalysisRequestHandler)
+
+        self.warm_up()
+
+    @property
+    def preprocessing_config(self):
+        """
+        Preprocessing config, re-read only when the file was modified since the last request.
+        :return: dict of the analysis profiles
+        """
+        mtime = os.path.getmtime(self.preprocessing_config_path)
+        if self._preprocessing_config is None or mtime != self._config_mtime:
+            self._preprocessing_config = load_preprocessing_config(self.preprocessing_config_path)
+            self._config_mtime = mtime
+        return self._preprocessing_config
+
+    def warm_up(self):
+        """
+        Imports the analyzers used by the profiles in preprocessing_config.json and lets them load their models, so
+        the first request does not pay for the imports.
+        :return: None
+        """
+        for profile in self.preprocessing_config.values():
+            name = profile.get("chosen_analysis")
+            if not name:
+                continue
+
+            analyzer = get_image_analysis_type(name)
+            if analyzer is None:
+                print("[WARNING] Unknown analysis {}, available: {}".format(name, get_available_analysis()))
+            elif hasattr(analyzer, "warm_up"):
+                analyzer.warm_up(**{k: v for k, v in profile.items() if k not in ["analysis_channel", "chosen_analysis"]})
+
+        print("Analysis server warmed up, available analysis: {}".format(get_available_analysis()))
+
+    def dispatch(self, request):
+        """
+        Executes the command from the request.
+        :param dict request: decoded JSON request
+        :return: dict response
+        """
+        command = request.get("command", "analyze")
+
+        if command == "ping":
+            return {"status": "ok", "output": "pong", "error": ""}
+
+        if command == "shutdown":
+            self.stop_requested = True
+            return {"status": "ok", "output": "shutting down", "error": ""}
+
+        if command != "analyze":
+            return {"status": "error", "output": "", "error": "Unknown command: {}".format(command)}
+
+        command_args = {k: str(v) for k, v in request["args"].items() if v is not None}
+
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output), redirect_stderr(output):
+                print("[INFO] Parsed arguments: {}".format(command_args))
+                run_analysis(command_args, self.preprocessing_config)
+        except Exception:
+            return {"status": "error", "output": output.getvalue(), "error": traceback.format_exc()}
+
+        return {"status": "ok", "output": output.getvalue(), "error": ""}
+
+    def serve_until_shutdown(self):
+        """
+        Handles the requests until the shutdown command is received.
+        :return: None
+        """
+        while not self.stop_requested:
+            self.handle_request()
+
+
+if __name__ == '__main__':
+
+    args = parse_args_to_dict()
+
+    host = args.get("host", DEFAULT_HOST)
+    port = args.get("port", DEFAULT_PORT)
+
+    if "config" in args:
+        with open(args["config"], "r") as f:
+            path_config = json.load(f)
+        host = path_config.get("analysis_server_host", host)
+        port = path_config.get("analysis_server_port", port)
+
+    with AnalysisServer(host, int(port)) as server:
+        print("Analysis server listening on {}:{}".format(host, port))
+        server.serve_until_shutdown()
@@ -0,0 +1,169 @@
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from data_processing.main_processor import load_preprocessing_config, PREPROCESSING_CONFIG_PATH
+from data_processing.processor.zeiss_image_processor import ZeissImageProcessor
+from utils import parse_args_to_dict
+
+"""
+Batch analysis of many CZI files with one analysis profile, e.g. re-analysis of a finished session or of all the
+positions of an overview. The files are analysed in a process pool, every file gets its own JSON in the format of
+ZeissImageProcessor.save_measurement_points and all the points are also written to one combined JSON.
+
+Run from the project root:
+python -m data_processing.batch_processor --input=path/to/folder --analysis_arguments=Cellpose --output_dir=results
+The input is a folder, a glob pattern (e.g. "data/*/overview*.czi") or a manifest: .txt with one path per line or
+.json with a list of paths.
+"""
+
+COMBINED_FILE_NAME = 'measurement_points_combined.json'
+
+
+def collect_czi_files(input_path):
+    """
+    Lists the CZI files given by the folder, the glob pattern or the manifest.
+    :param str input_path: folder, glob pattern or .txt/.json manifest
+    :return: sorted list of file paths
+    """
+    if os.path.isdir(input_path):
+        files = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.lower().endswith('.czi')]
+
+    elif os.path.isfile(input_path) and input_path.lower().endswith('.json'):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            files = json.load(f)
+
+    elif os.path.isfile(input_path) and input_path.lower().endswith('.txt'):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            files = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    else:
+        files = glob.glob(input_path, recursive=True)
+
+    return sorted(f for f in files if os.path.isfile(f))
+
+
+def analyze_file(file_path, analysis_profile, saving_path, columnar=False):
+    """
+    Analyses one file and saves its measurement points, module level function so it can run in the worker processes.
+    :param str file_path: path to the CZI file
+    :param dict analysis_profile: profile from preprocessing_config.json
+    :param str saving_path: path of the JSON with the measurement points
+    :param bool columnar: also save the points in the columnar .npz form
+    :return: dict with the file path, saving path, number of points, analysis time and the error if any
+    """
+    start = time.perf_counter()
+    try:
+        obj = ZeissImageProcessor(file_path, **analysis_profile)
+        obj.save_measurement_points(saving_path, columnar)
+        return {'file_path': file_path, 'saving_path': saving_path, 'n_points': len(obj.measurement_points),
+                'time_s': time.perf_counter() - start, 'error': None}
+    except Exception:
+        return {'file_path': file_path, 'saving_path': None, 'n_points': 0, 'time_s': time.perf_counter() - start,
+                'error': traceback.format_exc()}
+
+
+def run_batch(files, analysis_profile, output_dir, n_workers=None, combined_path=None, columnar=False):
+    """
+    Analyses the files in a process pool and writes the per-file and the combined measurement points.
+    :param list files: paths to the CZI files
+    :param dict analysis_profile: profile from preprocessing_config.json
+    :param str output_dir: folder for the per-file JSONs
+    :param int n_workers: number of processes, None uses one per CPU, 1 analyses in this process
+    :param str combined_path: path of the combined JSON, by default in the output_dir
+    :param bool columnar: also save the per-file points in the columnar .npz form
+    :return: dict summary of the run
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    combined_path = combined_path or os.path.join(output_dir, COMBINED_FILE_NAME)
+
+    # the files with the same name from different folders must not overwrite each other
+    saving_paths = {}
+    for file_path in files:
+        name = Path(file_path).stem
+        saving_path = os.path.join(output_dir, name + '.json')
+        suffix = 1
+        while saving_path in saving_paths.values():
+            saving_path = os.path.join(output_dir, '{}_{}.json'.format(name, suffix))
+            suffix += 1
+        saving_paths[file_path] = saving_path
+
+    # the files are analysed whole, the ROI of the reanalysis is not a ZeissImageProcessor argument
+    analysis_profile = dict(analysis_profile)
+    analysis_profile.pop('roi_size_um', None)
+
+    start = time.perf_counter()
+    results = {}
+
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1 or len(files) < 2:
+        for file_path in files:
+            results[file_path] = analyze_file(file_path, analysis_profile, saving_paths[file_path], columnar)
+            print_result(results[file_path])
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(files))) as executor:
+            futures = [executor.submit(analyze_file, f, analysis_profile, saving_paths[f], columnar) for f in files]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['file_path']] = result
+                print_result(result)
+
+    # merged in the order of the files, so the combined JSON does not depend on the completion order
+    results = [results[file_path] for file_path in files]
+
+    combined = {}
+    for result in results:
+        if result['error'] is None:
+            with open(result['saving_path'], 'r', encoding='utf-8') as f:
+                combined.update(json.load(f))
+
+    with open(combined_path, 'w', encoding='utf-8') as f:
+        json.dump(combined, f, indent=2, ensure_ascii=False)
+
+    elapsed = time.perf_counter() - start
+    failed = [r['file_path'] for r in results if r['error'] is not None]
+
+    return {
+        'files': len(files),
+        'failed': failed,
+        'points': len(combined),
+        'time_s': elapsed,
+        'files_per_s': len(files) / elapsed if elapsed > 0 else 0.0,
+        'combined_path': combined_path,
+    }
+
+
+def print_result(result):
+    """
+    Prints the outcome of one file analysis.
+    :param dict result: dict returned by analyze_file
+    :return: None
+    """
+    name = os.path.basename(result['file_path'])
+    if result['error'] is None:
+        print("{}: {} points in {:.2f} s".format(name, result['n_points'], result['time_s']))
+    else:
+        print("[ERROR] {} failed after {:.2f} s:\n{}".format(name, result['time_s'], result['error']))
+
+
+if __name__ == '__main__':
+
+    args = parse_args_to_dict()
+
+    preprocessing_config = load_preprocessing_config(args.get('preprocessing_config', PREPROCESSING_CONFIG_PATH))
+    analysis_profile = preprocessing_config[args['analysis_arguments']]
+
+    files = collect_czi_files(args['input'])
+    print("Found {} CZI files for the {} analysis".format(len(files), args['analysis_arguments']))
+
+    summary = run_batch(files, analysis_profile, args.get('output_dir', 'batch_results'),
+                        int(args['workers']) if 'workers' in args else None, args.get('combined_path'),
+                        str(args.get('columnar', False)) == 'True')
+
+    print("\nAnalysed {} files ({} failed), {} points in {:.2f} s, {:.2f} files/s".format(
+        summary['files'], len(summary['failed']), summary['points'], summary['time_s'], summary['files_per_s']))
+    print("Combined measurement points: {}".format(summary['combined_path']))
@@ -1,13 +1,11 @@
-import pkgutil
-import importlib
-import sys
+from data_processing.image_analysis.analysis_registry import register_lazy
 
 """
-Loads all of the existing Python algorhitms to the register
+Registers the existing Python algorhitms by name, the modules are imported on the first use of the algorithm
 """
 
 
-package = sys.modules[__name__]
-
-for loader, module_name, is_pkg in pkgutil.walk_packages(package.__path__, package.__name__ + "."):
-    importlib.import_module(module_name)
+register_lazy("Cellpose_algorithm", __name__ + ".cellpose")
+register_lazy("Circles", __name__ + ".circles")
+register_lazy("HexagonalMesh", __name__ + ".hexagonal_mesh")
+register_lazy("Max_intensity_Z_Scan", __name__ + ".z_scan_max_intensity")
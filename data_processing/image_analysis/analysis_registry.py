@@ -1,16 +1,44 @@
+import importlib
+import pkgutil
+
 """
-The dictionary with the name of the algorithms available in this folder.
+The dictionary with the name of the algorithms available in this folder. The algorithms are registered by name in
+the package __init__ and their modules are imported only on the first lookup, so using one analyzer does not import
+the dependencies of all the others.
 """
 
 
 _REGISTRY = {}
+_LAZY_REGISTRY = {}
 
 def register_class(cls):
     _REGISTRY[cls.__name__] = cls
     return cls
 
+def register_lazy(name, module_name):
+    """
+    Registers the name of the analyzer class and the module defining it, without importing the module.
+    :param str name: name of the analyzer class
+    :param str module_name: full name of the module with the class
+    :return: None
+    """
+    _LAZY_REGISTRY[name] = module_name
+
+def _import_all_analyzers():
+    """
+    Imports every module of the image_analysis package, so analyzers added without register_lazy are found too.
+    :return: None
+    """
+    package = importlib.import_module(__name__.rsplit(".", 1)[0])
+    for loader, module_name, is_pkg in pkgutil.walk_packages(package.__path__, package.__name__ + "."):
+        importlib.import_module(module_name)
+
 def get_image_analysis_type(name):
+    if name not in _REGISTRY and name in _LAZY_REGISTRY:
+        importlib.import_module(_LAZY_REGISTRY[name])
+    if name not in _REGISTRY:
+        _import_all_analyzers()
     return _REGISTRY.get(name)
 
 def get_available_analysis():
-    return list(_REGISTRY.keys())
+    return list(dict.fromkeys(list(_LAZY_REGISTRY.keys()) + list(_REGISTRY.keys())))
@@ -1,12 +1,42 @@
 from cellpose import models
 import pandas as pd
-from skimage.measure import regionprops_table
 import numpy as np
 import torch
 
 from data_processing.image_analysis.base_image_analyzer import ImageAnalysisTemplate
 from data_processing.image_analysis.analysis_registry import register_class
 from data_processing.image_analysis.pixel_stage_converter import z_normal
+from data_processing.image_analysis.tiling import iter_tiles, in_core
+from data_processing.image_analysis.region_statistics import region_statistics, region_solidity
+
+
+# Process-wide cache of the loaded Cellpose models, keyed by (model_type, device)
+_MODEL_CACHE = {}
+# Objects diameter in um estimated by Cellpose in the current session, keyed by model_type
+_SESSION_DIAMETERS_UM = {}
+
+SEGMENTATION_KEYS = ["objects_diameter", "circ_thr", "ecc_thr", "sol_thr", "model_type", "gpu", "n_threads",
+                     "reuse_diameter", "tile_size", "tile_overlap"]
+
+
+def get_cellpose_model(model_type='cyto', gpu=True, n_threads=None):
+    """
+    Returns the Cellpose model from the process-wide cache, the weights are loaded only on the first call.
+    :param str model_type: Cellpose model type
+    :param bool gpu: use the GPU if available, False forces the CPU
+    :param int n_threads: number of torch CPU threads, None keeps the torch default
+    :return: cellpose.models.Cellpose
+    """
+    if n_threads is not None:
+        torch.set_num_threads(int(n_threads))
+
+    device = torch.device('cuda') if gpu and torch.cuda.is_available() else torch.device('cpu')
+    key = (model_type, str(device))
+
+    if key not in _MODEL_CACHE:
+        _MODEL_CACHE[key] = models.Cellpose(model_type=model_type, gpu=device.type == 'cuda', device=device)
+
+    return _MODEL_CACHE[key]
 
 
 @register_class
@@ -16,6 +46,23 @@ class Cellpose_algorithm(ImageAnalysisTemplate):
     circularity, solidity and eccentricity.
     """
 
+    @classmethod
+    def warm_up(cls, model_type='cyto', gpu=True, n_threads=None, **analysis_details):
+        """
+        Loads the Cellpose model to the cache, used by the analysis server before the first request.
+        :return: None
+        """
+        get_cellpose_model(model_type, gpu, n_threads)
+
+    @classmethod
+    def reads_tiles(cls, tile_size=None, **analysis_details):
+        """
+        With the tile_size the image is segmented tile by tile, so the reader decodes only the tiles instead of
+        loading the whole overview.
+        :return: bool
+        """
+        return tile_size is not None
+
     @staticmethod
     def filter_cellpose_masks(df, circ_thr=0.65, ecc_thr=0.5, sol_thr=0.85):
         """
@@ -35,47 +82,160 @@ class Cellpose_algorithm(ImageAnalysisTemplate):
 
         return df_filtered
 
-    def image_segmentation(self, objects_diameter=None, circ_thr=0.65, ecc_thr=0.5, sol_thr=0.85):
+    def _mean_scale_um(self):
+        """
+        :return: float mean X, Y pixel size in um
+        """
+        scaling = self.metadata["scaling_um_per_pixel"]
+        return np.mean([scaling['X'] * 10 ** (6), scaling['Y'] * 10 ** (6)])
+
+    def pixel_diameter(self, objects_diameter=None, model_type='cyto', reuse_diameter=False):
+        """
+        Object diameter in pixels passed to the Cellpose model eval.
+        :param objects_diameter: float size in um, None lets Cellpose estimate it
+        :param str model_type: Cellpose model type, key of the session diameter
+        :param bool reuse_diameter: use the diameter estimated earlier in this session when objects_diameter is None
+        :return: int diameter in pixels or None
+        """
+        if objects_diameter is None and reuse_diameter:
+            objects_diameter = _SESSION_DIAMETERS_UM.get(model_type)
+
+        if objects_diameter is None:
+            return None
+
+        return int(np.round(objects_diameter / self._mean_scale_um(), 0))
+
+    def remember_diameter(self, diameter_px, model_type='cyto'):
+        """
+        Stores the diameter estimated by Cellpose for the later images of the session.
+        :param diameter_px: float diameter in pixels
+        :param str model_type: Cellpose model type
+        :return: None
+        """
+        _SESSION_DIAMETERS_UM[model_type] = float(diameter_px * self._mean_scale_um())
+
+    @staticmethod
+    def shape_table(mask, circ_thr=0.65, ecc_thr=0.5, origin=(0, 0), core=None):
+        """
+        Measures all the objects of the mask at once, the solidity needs the convex hull of every object, so it is
+        computed only for the objects passing the circularity and eccentricity thresholds and NaN for the others.
+        :param mask: ndarray label image returned by Cellpose
+        :param tuple origin: (y0, x0) of the mask in the image coordinates
+        :param tuple core: optional (y_start, y_stop, x_start, x_stop), only the objects with the centroid in it are kept
+        :return: pandas df with the unfiltered objects properties in the image coordinates
+        """
+        stats = region_statistics(mask)
+
+        props_table = pd.DataFrame({k: stats[k] for k in ['label', 'area', 'centroid-0', 'centroid-1', 'perimeter',
+                                                          'eccentricity']})
+        props_table['centroid-0'] += origin[0]
+        props_table['centroid-1'] += origin[1]
+
+        if core is not None:
+            props_table = props_table.loc[in_core(props_table['centroid-0'], props_table['centroid-1'], core)].copy()
+
+        candidates = ((4 * np.pi * props_table['area'] / (props_table['perimeter'] ** 2) > circ_thr) &
+                      (props_table['eccentricity'] < ecc_thr))
+
+        props_table['solidity'] = np.nan
+        props_table.loc[candidates, 'solidity'] = region_solidity(mask, props_table.loc[candidates, 'label'].values)
+
+        return props_table
+
+    def masks_properties(self, mask, circ_thr=0.65, ecc_thr=0.5, sol_thr=0.85):
+        """
+        Measures and filters the objects of the Cellpose mask.
+        :param mask: ndarray label image returned by Cellpose
+        :return: pandas df with objects center positions and their properties
+        """
+        props_table = self.shape_table(mask, circ_thr, ecc_thr)
+
+        return self.filter_cellpose_masks(props_table, circ_thr, ecc_thr, sol_thr)
+
+    def tiled_segmentation(self, model, object_pixel_diameter, tile_size, tile_overlap=None, model_type='cyto',
+                           circ_thr=0.65, ecc_thr=0.5):
+        """
+        Segments the image tile by tile, the peak memory is bounded by the tile size instead of the image size. The
+        image read with the CziRegionImage is decoded tile by tile as well. The tiles are segmented one after another,
+        the eval of the model dominates the time and one model instance does not run its evals in parallel.
+        :param model: Cellpose model
+        :param object_pixel_diameter: int diameter in pixels, None lets Cellpose estimate it on the first tile
+        :param int tile_size: tile edge in pixels
+        :param int tile_overlap: overlap of the neighbouring tiles in pixels, by default twice the objects diameter
+        :param str model_type: Cellpose model type
+        :param circ_thr: float minimal circularity, the solidity is computed only for the objects above it
+        :param ecc_thr: float maximal eccentricity, the solidity is computed only for the objects below it
+        :return: pandas df with the unfiltered objects properties, labels are unique in the whole image
+        """
+        tiles = list(iter_tiles(self.image.shape[:2], tile_size, tile_overlap or 0))
+
+        # slices and masks of the first tile segmented while estimating the diameter
+        first_tile = (None, None)
+        if object_pixel_diameter is None:
+            tile_slices = tiles[0][0]
+            masks, flows, styles, diam_mean = model.eval([self.image[tile_slices]], diameter=None, channels=[0, 0])
+            self.remember_diameter(np.mean(diam_mean), model_type)
+            object_pixel_diameter = int(np.round(np.mean(diam_mean), 0))
+            first_tile = (tile_slices, masks[0])
+
+        if tile_overlap is None:
+            tiles = list(iter_tiles(self.image.shape[:2], tile_size, min(2 * object_pixel_diameter, tile_size - 1)))
+
+        tables = []
+        for tile_slices, origin, core in tiles:
+            # the first tile starts at the image corner for any overlap, its masks are not segmented again
+            if tile_slices == first_tile[0]:
+                masks = first_tile[1]
+            else:
+                masks = model.eval([self.image[tile_slices]], diameter=object_pixel_diameter, channels=[0, 0])[0][0]
+            tables.append(self.shape_table(masks, circ_thr, ecc_thr, origin, core))
+
+        props_table = pd.concat(tables, ignore_index=True)
+        props_table['label'] = np.arange(1, len(props_table) + 1)
+
+        return props_table
+
+    def image_segmentation(self, objects_diameter=None, circ_thr=0.65, ecc_thr=0.5, sol_thr=0.85, model_type='cyto',
+                           gpu=True, n_threads=None, reuse_diameter=False, tile_size=None, tile_overlap=None):
         """
         Initializing Cellpose algorithm.
         :param objects_diameter: float size in um, passed to Cellpose model eval
         :param circ_thr: float minimal circularity filtering threshold
         :param ecc_thr: float maximal eccentricity filtering threshold
         :param sol_thr: float maximal solidity filtering threshold
+        :param model_type: str Cellpose model type
+        :param gpu: bool use the GPU if available, False forces the CPU
+        :param n_threads: int number of torch CPU threads
+        :param reuse_diameter: bool reuse the diameter estimated earlier in this session
+        :param tile_size: int tile edge in pixels, images larger than the tile are segmented tile by tile
+        :param tile_overlap: int overlap of the tiles in pixels, should exceed the objects diameter
         :return: pandas df with objects center positions and their properties
         """
-        model = models.Cellpose(model_type='cyto', gpu=True)
+        model = get_cellpose_model(model_type, gpu, n_threads)
 
-        scaling = self.metadata["scaling_um_per_pixel"]
-
-        if objects_diameter is None:
-
-            object_pixel_diameter = None
-
-        else:
-            object_pixel_diameter = int(
-                np.round(objects_diameter / np.mean([scaling['X'] * 10 ** (6), scaling['Y'] * 10 ** (6)]), 0))
+        object_pixel_diameter = self.pixel_diameter(objects_diameter, model_type, reuse_diameter)
 
-        masks, flows, styles, diam_mean = model.eval([self.image], diameter=object_pixel_diameter, channels=[0, 0])
+        if tile_size is not None and max(self.image.shape[:2]) > tile_size:
+            props_table = self.tiled_segmentation(model, object_pixel_diameter, tile_size, tile_overlap, model_type,
+                                                  circ_thr, ecc_thr)
+            return self.filter_cellpose_masks(props_table, circ_thr, ecc_thr, sol_thr)
 
-        props_table = pd.DataFrame(regionprops_table(masks[0], properties=(
-            'label', 'area', 'centroid', 'perimeter', 'eccentricity', 'solidity')))
+        masks, flows, styles, diam_mean = model.eval([np.asarray(self.image)], diameter=object_pixel_diameter,
+                                                     channels=[0, 0])
 
-        filtered_props_table = self.filter_cellpose_masks(props_table, circ_thr, ecc_thr, sol_thr)
+        if object_pixel_diameter is None:
+            self.remember_diameter(np.mean(diam_mean), model_type)
 
-        return filtered_props_table
+        return self.masks_properties(masks[0], circ_thr, ecc_thr, sol_thr)
 
-    def get_measurement_points(self):
+    def points_from_properties(self, objects_df):
         """
-        Utilizes methods above for image segmentation and obtains o
+        Converts the filtered objects to the measurement points.
+        :param objects_df: pandas df returned by masks_properties
         :return: lists of dictionaries with the founded objects properties and their positions in the pixels coordinates
         and in the stage coordinates in um.
         """
-        objects_df = self.image_segmentation(**{k: v for k, v in self.analysis_details.items() if
-                                                k in ["objects_diameter", "circ_thr", "ecc_thr", "sol_thr"]})
-
-        scaling = self.metadata["scaling_um_per_pixel"]
-        mean_scale = np.mean([scaling["X"] * 10 ** (6), scaling["Y"] * 10 ** (6)])
+        mean_scale = self._mean_scale_um()
 
         objects_df["area"] = objects_df["area"] * (mean_scale ** 2)
         objects_df["radius"] = np.sqrt(objects_df["area"] / np.pi)
@@ -90,3 +250,50 @@ class Cellpose_algorithm(ImageAnalysisTemplate):
                                                                  z_strategy=z_normal)
 
         return measurement_points, transformed_points
+
+    def get_measurement_points(self):
+        """
+        Utilizes methods above for image segmentation and obtains o
+        :return: lists of dictionaries with the founded objects properties and their positions in the pixels coordinates
+        and in the stage coordinates in um.
+        """
+        objects_df = self.image_segmentation(**{k: v for k, v in self.analysis_details.items() if
+                                                k in SEGMENTATION_KEYS})
+
+        return self.points_from_properties(objects_df)
+
+    @classmethod
+    def get_batch_measurement_points(cls, images, metadata, **analysis_details):
+        """
+        Segments many images, e.g. the tiles of the overview grid, in one Cellpose model eval call.
+        :param list images: list of 2D ndarrays
+        :param metadata: metadata dict shared by all images or list of metadata dicts, one per image
+        :param analysis_details: arguments of the Cellpose profile, as in preprocessing_config.json
+        :return: list of (measurement_points, transformed_points) tuples, one per image
+        """
+        if isinstance(metadata, dict):
+            metadata = [metadata] * len(images)
+
+        analyzers = [cls(image, md, **analysis_details) for image, md in zip(images, metadata)]
+
+        details = {k: v for k, v in analysis_details.items() if k in SEGMENTATION_KEYS}
+        model_type = details.get('model_type', 'cyto')
+
+        model = get_cellpose_model(model_type, details.get('gpu', True), details.get('n_threads'))
+
+        diameters = [a.pixel_diameter(details.get('objects_diameter'), model_type, details.get('reuse_diameter', False))
+                     for a in analyzers]
+        estimate = any(d is None for d in diameters)
+
+        masks, flows, styles, diams = model.eval(images, diameter=None if estimate else diameters, channels=[0, 0])
+
+        if estimate:
+            analyzers[0].remember_diameter(np.mean(diams), model_type)
+
+        results = []
+        for analyzer, mask in zip(analyzers, masks):
+            objects_df = analyzer.masks_properties(mask, details.get('circ_thr', 0.65), details.get('ecc_thr', 0.5),
+                                                   details.get('sol_thr', 0.85))
+            results.append(analyzer.points_from_properties(objects_df))
+
+        return results
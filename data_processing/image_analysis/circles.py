@@ -1,70 +1,42 @@
-from collections import defaultdict
 import cv2
 import numpy as np
 
 from data_processing.image_analysis.base_image_analyzer import ImageAnalysisTemplate
 from data_processing.image_analysis.analysis_registry import register_class
 from data_processing.image_analysis.pixel_stage_converter import z_normal
+from data_processing.image_analysis.region_statistics import fill_holes, label_image, region_statistics
 
 
 @register_class
 class Circles(ImageAnalysisTemplate):
     """
     Class for detecting circular objects using Otsu thresholding
-    and contour-based shape analysis.
+    and shape analysis of the labeled objects.
     """
 
     @staticmethod
-    def _classify_contours_by_area(contours, hierarchy, top_n=None):
+    def get_centers_and_radii(for_objects_finding, min_fit_ratio):
         """
-        Classify external contours by area and return them sorted in descending order.
-        :return: list of external contours sorted by area
+        Compute centers and radii of the objects fitting a circular shape, the objects are the regions enclosed by
+        the outer boundaries of the foreground, like the external contours, measured all at once. The fit ratio is
+        computed from the area enclosed by the contour, the open fragments without any interior pixel, e.g. the
+        Canny edges not closed into a ring, are dropped as by the contour area.
+        :return: dictionary mapping object labels to center position, radius,
+                 and fit ratio in pixel coordinates, sorted by the object area in descending order
         """
-        # Map parent indices to their child contours
-        parent_children_map = defaultdict(list)
-        external_contours = []
-        # Identify external contours and collect their largest internal
-        for i in range(len(contours)):
-            if hierarchy[0][i][3] == -1:  # External contour has no parent
-                ext_contour = contours[i]
-                area = cv2.contourArea(ext_contour)
-                internal_contours = parent_children_map.get(i, [])
-                # Find the largest internal contour if any
-                largest_internal = None
-                if internal_contours:
-                    largest_internal = max(internal_contours, key=lambda c: cv2.contourArea(c))
-                external_contours.append((area, ext_contour, largest_internal))
-        # Sort by external contour area (descending)
-        external_contours.sort(reverse=True, key=lambda x: x[0])
-        # Apply top_n limit
-        if top_n is not None:
-            external_contours = external_contours[:top_n]
-        # Return tuples (external_contour, largest_internal_contour)
-        return [(ext) for (_, ext, largest_internal) in external_contours]
+        labels = fill_holes(label_image(for_objects_finding))
+        stats = region_statistics(labels)
 
-    @staticmethod
-    def get_contour_centers_and_radii(contours, min_fit_ratio):
-        """
-        Compute centers and radii of contours fitting a circular shape.
-        :return: dictionary mapping contour indices to center position, radius,
-                 and fit ratio in pixel coordinates
-        """
-        results = {}
-        for idx, cnt in enumerate(contours):
-            M = cv2.moments(cnt)
-            if M["m00"] != 0:
-                cx = int(M["m10"] / M["m00"])
-                cy = int(M["m01"] / M["m00"])
-
-                (x, y), radius = cv2.minEnclosingCircle(cnt)
-                cnt_area = cv2.contourArea(cnt)
-                circle_area = np.pi * (radius ** 2)
+        order = np.argsort(-stats['area'], kind='stable')
+        order = order[(stats['interior_area'][order] > 0) & (stats['contour_fit_ratio'][order] >= min_fit_ratio)]
 
-                # area ratio
-                fit_ratio = cnt_area / circle_area if circle_area > 0 else 0
-
-                if fit_ratio >= min_fit_ratio:
-                    results[idx] = {"center": (cx, cy), "radius": int(radius), "fit ratio": fit_ratio}
+        results = {}
+        for idx in order:
+            results[int(stats['label'][idx])] = {
+                "center": (int(stats['centroid-1'][idx]), int(stats['centroid-0'][idx])),
+                "radius": int(stats['enclosing_radius'][idx]),
+                "fit ratio": float(stats['contour_fit_ratio'][idx])
+            }
 
         return results
 
@@ -115,13 +87,8 @@ class Circles(ImageAnalysisTemplate):
                 print(f"OpenCV2 problem: {e}")
                 for_contours_finding = np.zeros_like(self.image, dtype=np.uint8)
 
-        found_contours, hierarchy = cv2.findContours(np.array(for_contours_finding, dtype=np.uint8), cv2.RETR_CCOMP,
-                                                     cv2.CHAIN_APPROX_SIMPLE)
-
-        classified_external = self._classify_contours_by_area(found_contours, hierarchy)
-
-        center_radius_dict = self.get_contour_centers_and_radii(classified_external,
-                                                                self.analysis_details.get('min_fit_ratio', 0.2))
+        center_radius_dict = self.get_centers_and_radii(np.array(for_contours_finding, dtype=np.uint8),
+                                                        self.analysis_details.get('min_fit_ratio', 0.2))
 
         measurement_point = self.filter_by_size(center_radius_dict, **{k: v for k, v in self.analysis_details.items() if
                                                                        k in ["min_size_um", "max_size_um"]})
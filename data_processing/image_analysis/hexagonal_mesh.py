@@ -48,35 +48,33 @@ class HexagonalMesh(ImageAnalysisTemplate):
         tri = Delaunay(points)
         triangles = tri.simplices
 
-        edges = set()
-        for triangle in triangles:
-            for i in range(3):
-                edge = tuple(sorted([triangle[i], triangle[(i + 1) % 3]]))
-                edges.add(edge)
+        # all three edges of every triangle with the smaller index first
+        edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+        edges.sort(axis=1)
 
-        return np.array(list(edges))
+        # every edge encoded as one integer, so the duplicates shared by two triangles are removed by 1D unique
+        n_points = np.int64(len(points))
+        keys = np.unique(edges[:, 0].astype(np.int64) * n_points + edges[:, 1])
+
+        return np.stack([keys // n_points, keys % n_points], axis=1)
 
     def filter_edges_by_distance(self, points, edges, n_clusters=3, remove_outliers=False):
         """
         Group edges by length using clustering, optionally removing long-distance outliers.
         :return: lists of edges grouped by distance, cluster centers, and edge cluster labels
         """
-        # Calculating average distances
-        edge_distances = []
-        for edge in edges:
-            dist = np.linalg.norm(points[edge[0]] - points[edge[1]])
-            edge_distances.append(dist)
+        edges = np.asarray(edges).reshape(-1, 2)
 
-        edge_distances = np.array(edge_distances).reshape(-1, 1)
-        edges = np.array(edges)
+        # Calculating edge lengths
+        edge_distances = np.linalg.norm(points[edges[:, 0]] - points[edges[:, 1]], axis=1).reshape(-1, 1)
 
-        if remove_outliers:
+        if remove_outliers and len(edge_distances) > 0:
             # Calculating IQR and upper limit
             q75, q25 = np.percentile(edge_distances, [75, 25])
             iqr = q75 - q25
             upper_bound = q75 + 1.5 * iqr
             # Creating a mask for outlayers
-            mask = (edge_distances <= upper_bound).flatten()
+            mask = edge_distances[:, 0] <= upper_bound
             edge_distances = edge_distances[mask]
             edges = edges[mask]
 
@@ -90,15 +88,9 @@ class HexagonalMesh(ImageAnalysisTemplate):
         else:
             return [], np.array([]), np.array([])
 
-        # Grouping edges into clasters
-        clustered_edges = [[] for _ in range(n_clusters)]
-        for i, edge in enumerate(edges):
-            cluster_idx = cluster_labels[i]
-            clustered_edges[cluster_idx].append(edge)
-
-        # sorting clasters according to the distances
+        # Grouping edges into clasters sorted according to the distances
         sorted_indices = np.argsort(cluster_centers.flatten())
-        clustered_edges = [clustered_edges[i] for i in sorted_indices]
+        clustered_edges = [edges[cluster_labels == i] for i in sorted_indices]
         cluster_centers = cluster_centers[sorted_indices]
 
         return clustered_edges, cluster_centers, cluster_labels
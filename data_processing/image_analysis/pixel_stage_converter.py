@@ -2,7 +2,41 @@ import numpy as np
 import copy
 import re
 
+from data_processing.tracing import span
 
+
+def _stage_value(value):
+    """
+    :return: float stage coordinate, NaN for the missing one
+    """
+    return np.nan if value is None else float(value)
+
+
+def vectorized(array_strategy):
+    """
+    Decorator declaring the vectorized form of the z-strategy. The array form takes the (N, 2|3) pixel array instead
+    of a single point and returns the (N,) array of stage Z positions, for the PixelStageConverter methods it takes
+    only the pixel array.
+    :param array_strategy: vectorized form of the decorated z-strategy
+    :return: decorator
+    """
+    def decorator(strategy):
+        strategy.vectorized = array_strategy
+        return strategy
+    return decorator
+
+
+def _z_no_transform_array(px, stage_pos, scaling, tiles):
+    return np.full(len(px), _stage_value(stage_pos["z"]))
+
+
+def _z_normal_array(px, stage_pos, scaling, tiles):
+    if px.shape[1] < 3:
+        return np.full(len(px), _stage_value(stage_pos["z"]))
+    return _stage_value(stage_pos["z"]) + px[:, 2] * scaling["Z"] * 1e6
+
+
+@vectorized(_z_no_transform_array)
 def z_no_transform(px, stage_pos, scaling, tiles):
     """
     Return Z position without applying any transformation.
@@ -11,6 +45,7 @@ def z_no_transform(px, stage_pos, scaling, tiles):
     return stage_pos["z"]
 
 
+@vectorized(_z_normal_array)
 def z_normal(px, stage_pos, scaling, tiles):
     """
     Return Z position adjusted by pixel Z offset and scaling.
@@ -32,7 +67,9 @@ class PixelStageConverter:
     """
     def __init__(self, metadata, image_shape):
         self.metadata = metadata
-        self.image_shape = self._normalize_image_shape(image_shape)
+        # for the image cropped to the region of interest the stage position refers to the center of the full image
+        self.image_shape = self._normalize_image_shape(metadata.get("image_shape", image_shape))
+        self.roi_offset = self._roi_offset()
         self.tiles_lookup = self._build_tiles_lookup()
 
 
@@ -49,6 +86,16 @@ class PixelStageConverter:
         else:
             raise ValueError(f"Unexpected image shape: {shape}")
 
+    def _roi_offset(self):
+        """
+        Offset of the region of interest read by the CziFileReader in the full image.
+        :return: tuple (x, y) in pixels
+        """
+        roi = self.metadata.get("roi")
+        if roi is None:
+            return 0, 0
+        return roi["x"], roi["y"]
+
     # -----------------------------
     # tile index → z lookup
     # -----------------------------
@@ -79,8 +126,8 @@ class PixelStageConverter:
         H, W = self.image_shape
 
         if mode == "normal":
-            x = stage["x"] + (px[0] - H / 2 + 0.5) * scaling["X"] * 1e6
-            y = stage["y"] + (px[1] - W / 2 + 0.5) * scaling["Y"] * 1e6
+            x = stage["x"] + (px[0] + self.roi_offset[0] - H / 2 + 0.5) * scaling["X"] * 1e6
+            y = stage["y"] + (px[1] + self.roi_offset[1] - W / 2 + 0.5) * scaling["Y"] * 1e6
             return x, y
 
         if mode == "center":
@@ -88,6 +135,48 @@ class PixelStageConverter:
 
         raise ValueError("XY mode must be 'normal' or 'center'.")
 
+    def convert_xy_array(self, px, mode="normal"):
+        """
+        Vectorized convert_xy.
+        :param px: ndarray (N, 2|3) of pixel coordinates
+        :return: ndarray (N, 2) of stage X, Y in um
+        """
+        stage = self.metadata["stage_position"]
+        scaling = self.metadata["scaling_um_per_pixel"]
+        H, W = self.image_shape
+
+        if mode == "normal":
+            xy = np.empty((len(px), 2))
+            xy[:, 0] = _stage_value(stage["x"]) + (px[:, 0] + self.roi_offset[0] - H / 2 + 0.5) * scaling["X"] * 1e6
+            xy[:, 1] = _stage_value(stage["y"]) + (px[:, 1] + self.roi_offset[1] - W / 2 + 0.5) * scaling["Y"] * 1e6
+            return xy
+
+        if mode == "center":
+            return np.tile([_stage_value(stage["x"]), _stage_value(stage["y"])], (len(px), 1))
+
+        raise ValueError("XY mode must be 'normal' or 'center'.")
+
+    def _convert_z_auto_array(self, px):
+        """
+        Vectorized convert_z_auto.
+        :param px: ndarray (N, 2|3) of pixel coordinates
+        :return: ndarray (N,) of stage Z in um
+        """
+        stage = self.metadata["stage_position"]
+        scaling = self.metadata["scaling_um_per_pixel"]
+        stage_z = _stage_value(stage["z"])
+
+        if px.shape[1] < 3:
+            return np.full(len(px), stage_z)
+
+        z_scan = self.metadata.get("z_scan")
+        if z_scan and "is_center_mode" in z_scan and z_scan['is_activated']:
+            return stage_z + px[:, 2] * scaling["Z"] * 1e6
+
+        return np.fromiter((_stage_value(self.tiles_lookup.get(int(idx), stage["z"])) for idx in px[:, 2]),
+                           dtype=float, count=len(px))
+
+    @vectorized(_convert_z_auto_array)
     def convert_z_auto(self, px):
         """
         Automatically choosing the strategy based on metadata to convert pixel Z to stage Z based on Z-scan or tiles.
@@ -123,6 +212,55 @@ class PixelStageConverter:
         return z_strategy(px, stage, scaling, self.tiles_lookup)
 
 
+    def convert_z_array(self, px, z_strategy):
+        """
+        Converts pixel Z of all points with the vectorized form of the strategy, the strategies without it are called
+        point by point.
+        :param px: ndarray (N, 2|3) of pixel coordinates
+        :return: ndarray (N,) of stage Z in um
+        """
+        if not callable(z_strategy):
+            raise ValueError("z_strategy must be callable")
+
+        stage = self.metadata["stage_position"]
+        scaling = self.metadata["scaling_um_per_pixel"]
+
+        array_strategy = getattr(z_strategy, "vectorized", None)
+        if array_strategy is not None:
+            # if z_strategy is PixelStageConverter method
+            if getattr(z_strategy, "__self__", None) is not None:
+                return array_strategy(z_strategy.__self__, px)
+            return array_strategy(px, stage, scaling, self.tiles_lookup)
+
+        z = np.empty(len(px))
+        for i, point in enumerate(px):
+            try:
+                value = z_strategy(point)
+            except TypeError:
+                value = z_strategy(point, stage, scaling, self.tiles_lookup)
+            z[i] = _stage_value(value)
+        return z
+
+    def convert_points_array(self, px, xy_mode="normal", z_strategy=None):
+        """
+        Vectorized converter of the pixel coordinates to the stage coordinates.
+        :param px: array-like (N, 2|3) of pixel coordinates
+        :return: ndarray (N, 3) of stage coordinates in um, NaN for the missing stage coordinates
+        """
+        if z_strategy is None:
+            raise ValueError("z_strategy must be provided.")
+
+        px = np.asarray(px, dtype=float)
+        if px.ndim == 1:
+            # single point or empty list
+            px = px.reshape(1, -1) if px.size else px.reshape(0, 2)
+
+        stage_points = np.empty((len(px), 3))
+        stage_points[:, :2] = self.convert_xy_array(px, xy_mode)
+        stage_points[:, 2] = self.convert_z_array(px, z_strategy)
+
+        return stage_points
+
     def convert_points(self, points, xy_mode="normal", z_strategy=None):
         """
         Main method, a converter of a list of points from pixel coordinates to stage coordinates.
@@ -131,22 +269,16 @@ class PixelStageConverter:
         if z_strategy is None:
             raise ValueError("z_strategy must be provided.")
 
-        result = copy.deepcopy(points)
-        for p in result:
-            px = np.array(p["position"], dtype=float)
-            x, y = self.convert_xy(px, xy_mode)
+        if len(points) == 0:
+            return []
 
-            # if z_strategy is PixelStageConverter method
-            if callable(z_strategy):
-                try:
-                    z = z_strategy(px)
-                except TypeError:
-                    z = z_strategy(px, self.metadata["stage_position"], self.metadata["scaling_um_per_pixel"],
-                                   self.tiles_lookup)
-            else:
-                raise ValueError("z_strategy must be callable")
+        with span('convert_points', points=len(points)):
+            stage_points = self.convert_points_array([p["position"] for p in points], xy_mode, z_strategy)
 
-            p["position"] = [x, y, z]
+            result = []
+            for p, position in zip(points, stage_points.tolist()):
+                entry = copy.copy(p)
+                entry["position"] = [None if v != v else v for v in position]
+                result.append(entry)
 
         return result
-
@@ -0,0 +1,240 @@
+import cv2
+import numpy as np
+
+"""
+Statistics of all the objects of a label image computed at once from the bincount moments, instead of measuring the
+contours or regions one by one. Used by Circles for the contour-like objects and by Cellpose_algorithm for the shape
+filtering of the masks.
+
+Compared with the external contours measured by cv2 before, the area is the pixel count of the object with its holes
+filled, instead of the area of the contour polygon through the boundary pixel centers, the radius is the distance of
+the farthest pixel center from the centroid, instead of the minimal enclosing circle of the contour, and the fit ratio
+is the area over the circle enclosing the whole pixels, so it never exceeds 1. An object lying in the hole of a ring
+stays a separate object, as with the contours, but its pixels are not counted in the area of the ring.
+
+The pixel count gives the open one pixel wide fragments, e.g. of the Canny edges, an area the contour polygon does not
+have, so the contour-like objects are scored with contour_fit_ratio: the area reduced by the half of the perimeter,
+the area of the polygon through the boundary pixel centers, and the objects without any interior_area pixel are open
+fragments.
+"""
+
+# the farthest point of a pixel square from its center
+_HALF_PIXEL_DIAGONAL = np.sqrt(2) / 2
+
+# weights of the boundary pixel codes, the same as in skimage.measure.perimeter with the 4-connectivity
+_PERIMETER_WEIGHTS = np.zeros(50)
+_PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+_PERIMETER_WEIGHTS[[21, 33]] = np.sqrt(2)
+_PERIMETER_WEIGHTS[[13, 23]] = (1 + np.sqrt(2)) / 2
+
+
+def _bounding_boxes(labels, n_labels):
+    """
+    :return: ndarray (n_labels + 1, 4) of (row start, row stop, column start, column stop) of every label
+    """
+    rr, cc = np.nonzero(labels)
+    lab = labels[rr, cc]
+
+    boxes = np.zeros((n_labels + 1, 4), dtype=np.int64)
+    boxes[:, 0] = boxes[:, 2] = np.iinfo(np.int64).max
+    np.minimum.at(boxes[:, 0], lab, rr)
+    np.maximum.at(boxes[:, 1], lab, rr + 1)
+    np.minimum.at(boxes[:, 2], lab, cc)
+    np.maximum.at(boxes[:, 3], lab, cc + 1)
+    return boxes
+
+
+def fill_holes(labels):
+    """
+    Fills the holes of every object with its label, so the objects cover the area enclosed by their outer boundary, as
+    the external contours do. A hole with other objects inside is filled around them, the inner objects keep their
+    labels.
+    :param labels: 2D int ndarray, 0 for the background
+    :return: int32 ndarray of labels with the holes filled
+    """
+    labels = np.array(labels, dtype=np.int32)
+    n_labels = int(labels.max()) if labels.size else 0
+    if n_labels == 0:
+        return labels
+
+    # the background is 4-connected when the foreground is 8-connected
+    n_background, background, hole_stats, _ = cv2.connectedComponentsWithStats((labels == 0).astype(np.uint8),
+                                                                                  connectivity=4)
+
+    border = np.unique(np.concatenate([background[0], background[-1], background[:, 0], background[:, -1]]))
+    is_hole = np.ones(n_background, dtype=bool)
+    is_hole[border] = False
+    is_hole[0] = False
+    if not is_hole.any():
+        return labels
+
+    # (hole, object) pairs of the 4-neighbouring pixels
+    pairs = []
+    for a, b in [((slice(1, None), slice(None)), (slice(None, -1), slice(None))),
+                 ((slice(None), slice(1, None)), (slice(None), slice(None, -1)))]:
+        for hole_side, object_side in [(a, b), (b, a)]:
+            holes, objects = background[hole_side], labels[object_side]
+            touching = is_hole[holes] & (objects > 0)
+            pairs.append(np.stack([holes[touching], objects[touching]]))
+    holes, objects = np.unique(np.concatenate(pairs, axis=1), axis=1)
+
+    # the hole belongs to the object enclosing its bounding box, the objects inside the hole lie within it
+    boxes = _bounding_boxes(labels, n_labels)[objects]
+    x, y, w, h = (hole_stats[holes, i] for i in range(4))
+    encloses = (boxes[:, 0] <= y) & (boxes[:, 1] >= y + h) & (boxes[:, 2] <= x) & (boxes[:, 3] >= x + w)
+    holes, objects, boxes = holes[encloses], objects[encloses], boxes[encloses]
+
+    # the innermost enclosing object, when the boxes of more objects enclose the hole
+    box_area = (boxes[:, 1] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 2])
+    order = np.lexsort((-box_area, holes))
+    fill = np.zeros(n_background, dtype=np.int32)
+    fill[holes[order]] = objects[order]
+
+    filled = fill[background]
+    labels[filled > 0] = filled[filled > 0]
+    return labels
+
+
+def label_image(binary, connectivity=8):
+    """
+    Labels the connected objects of the binary image.
+    :param binary: 2D ndarray, non-zero for the foreground
+    :param int connectivity: 4 or 8
+    :return: int32 ndarray with 0 for the background and 1..N for the objects
+    """
+    n_labels, labels = cv2.connectedComponents((np.asarray(binary) > 0).astype(np.uint8), connectivity=connectivity)
+    return labels
+
+
+def _perimeter(labels, n_labels):
+    """
+    Perimeter of every object, each object is measured only against the pixels of other labels and the image border,
+    which gives the skimage regionprops perimeter also for the touching objects.
+    :return: ndarray (n_labels + 1,) of perimeters in pixels
+    """
+    padded = np.pad(labels, 1)
+    center = padded[1:-1, 1:-1]
+
+    def same(dy, dx):
+        return padded[1 + dy:padded.shape[0] - 1 + dy, 1 + dx:padded.shape[1] - 1 + dx] == center
+
+    cross = [same(-1, 0), same(1, 0), same(0, -1), same(0, 1)]
+    border = (center > 0) & ~(cross[0] & cross[1] & cross[2] & cross[3])
+
+    # the border pixels of the same object in the neighbourhood of every border pixel
+    padded_border = np.pad(border, 1)
+
+    def border_neighbour(dy, dx):
+        return padded_border[1 + dy:padded_border.shape[0] - 1 + dy, 1 + dx:padded_border.shape[1] - 1 + dx] & \
+            same(dy, dx)
+
+    code = border.astype(np.int64)
+    for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        code += 2 * border_neighbour(dy, dx)
+    for dy, dx in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
+        code += 10 * border_neighbour(dy, dx)
+
+    return np.bincount(center[border], weights=_PERIMETER_WEIGHTS[code[border]], minlength=n_labels + 1)
+
+
+def region_statistics(labels, with_perimeter=True):
+    """
+    Computes the statistics of all the objects of the label image in one pass.
+    :param labels: 2D int ndarray, 0 for the background
+    :param bool with_perimeter: compute the perimeter and circularity
+    :return: dict of ndarrays, one entry per object present in the image: label, area, centroid-0 (row),
+             centroid-1 (column), equivalent_radius, enclosing_radius (farthest pixel center from the centroid),
+             fit_ratio (area over the circle enclosing the pixels), eccentricity, interior_area (pixels with all the
+             4 neighbours in the object) and optionally perimeter, circularity and contour_fit_ratio (fit_ratio of the
+             area reduced by the half of the perimeter)
+    """
+    labels = np.asarray(labels)
+    n_labels = int(labels.max()) if labels.size else 0
+
+    rr, cc = np.nonzero(labels)
+    lab = labels[rr, cc]
+
+    area = np.bincount(lab, minlength=n_labels + 1).astype(float)
+    present = np.flatnonzero(area)
+    present = present[present > 0]
+    safe_area = np.where(area > 0, area, 1)
+
+    row = np.bincount(lab, weights=rr, minlength=n_labels + 1) / safe_area
+    col = np.bincount(lab, weights=cc, minlength=n_labels + 1) / safe_area
+
+    dr = rr - row[lab]
+    dc = cc - col[lab]
+
+    # central moments normalized by the area
+    mu20 = np.bincount(lab, weights=dr * dr, minlength=n_labels + 1) / safe_area
+    mu02 = np.bincount(lab, weights=dc * dc, minlength=n_labels + 1) / safe_area
+    mu11 = np.bincount(lab, weights=dr * dc, minlength=n_labels + 1) / safe_area
+
+    common = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    l1 = (mu20 + mu02) / 2 + common
+    l2 = (mu20 + mu02) / 2 - common
+    eccentricity = np.where(l1 > 0, np.sqrt(np.clip(1 - l2 / np.where(l1 > 0, l1, 1), 0, 1)), 0)
+
+    # the pixels not on the boundary, none for the open one pixel wide fragments
+    padded = np.pad(labels, 1)
+    center = padded[1:-1, 1:-1]
+    interior = (center > 0) & (padded[:-2, 1:-1] == center) & (padded[2:, 1:-1] == center) & \
+        (padded[1:-1, :-2] == center) & (padded[1:-1, 2:] == center)
+    interior_area = np.bincount(center[interior], minlength=n_labels + 1).astype(float)
+
+    # the farthest pixel center from the centroid
+    enclosing_radius = np.zeros(n_labels + 1)
+    np.maximum.at(enclosing_radius, lab, dr * dr + dc * dc)
+    enclosing_radius = np.sqrt(enclosing_radius)
+
+    # the circle extended by the half of the pixel diagonal encloses the whole pixels, so the ratio is at most 1
+    equivalent_radius = np.sqrt(area / np.pi)
+    enclosing_circle_area = np.pi * (enclosing_radius + _HALF_PIXEL_DIAGONAL) ** 2
+    fit_ratio = area / enclosing_circle_area
+
+    stats = {
+        'label': present,
+        'area': area[present],
+        'centroid-0': row[present],
+        'centroid-1': col[present],
+        'equivalent_radius': equivalent_radius[present],
+        'enclosing_radius': enclosing_radius[present],
+        'fit_ratio': fit_ratio[present],
+        'eccentricity': eccentricity[present],
+        'interior_area': interior_area[present],
+    }
+
+    if with_perimeter:
+        perimeter = _perimeter(labels, n_labels)[present]
+        stats['perimeter'] = perimeter
+        stats['circularity'] = np.where(perimeter > 0, 4 * np.pi * stats['area'] / np.where(perimeter > 0,
+                                                                                            perimeter, 1) ** 2, 0)
+        stats['contour_fit_ratio'] = np.maximum(stats['area'] - perimeter / 2, 0) / enclosing_circle_area[present]
+
+    return stats
+
+
+def region_solidity(labels, label_ids):
+    """
+    Solidity of the chosen objects, the convex hull is computed per object, so it should be called only for the
+    objects left after the cheaper filters.
+    :param labels: 2D int ndarray, 0 for the background
+    :param label_ids: labels of the objects
+    :return: ndarray of the solidity, one per label id
+    """
+    # imported here, so the analyzers not computing the solidity do not pay for the scipy and skimage imports
+    from scipy import ndimage
+    from skimage.morphology import convex_hull_image
+
+    labels = np.asarray(labels)
+    slices = ndimage.find_objects(labels)
+
+    solidity = np.zeros(len(label_ids))
+    for i, label_id in enumerate(label_ids):
+        bbox = slices[int(label_id) - 1]
+        if bbox is None:
+            continue
+        mask = labels[bbox] == label_id
+        solidity[i] = mask.sum() / convex_hull_image(mask).sum()
+
+    return solidity
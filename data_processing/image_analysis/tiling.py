@@ -0,0 +1,60 @@
+import numpy as np
+
+"""
+Helpers for splitting large images into overlapping tiles. Every tile owns a core region, the cores of all tiles
+partition the image, so an object is assigned to exactly one tile by the position of its centroid.
+"""
+
+
+def _axis_tiles(length, tile_size, overlap):
+    """
+    Computes tile and core bounds along one axis.
+    :param int length: length of the axis in pixels
+    :param int tile_size: tile length in pixels
+    :param int overlap: overlap of the neighbouring tiles in pixels
+    :return: list of tuples (start, stop, core_start, core_stop)
+    """
+    if tile_size >= length:
+        return [(0, length, 0, length)]
+
+    step = tile_size - overlap
+    if step <= 0:
+        raise ValueError("Tile overlap ({}) must be smaller than the tile size ({})".format(overlap, tile_size))
+
+    starts = list(range(0, length - tile_size, step)) + [length - tile_size]
+    stops = [s + tile_size for s in starts]
+
+    # the core boundary between the neighbouring tiles lies in the middle of their overlap
+    boundaries = [0] + [(starts[i + 1] + stops[i]) // 2 for i in range(len(starts) - 1)] + [length]
+
+    return [(starts[i], stops[i], boundaries[i], boundaries[i + 1]) for i in range(len(starts))]
+
+
+def iter_tiles(shape, tile_size, overlap):
+    """
+    Generates the overlapping tiles of an image.
+    :param tuple shape: (H, W) shape of the image
+    :param int tile_size: tile edge in pixels
+    :param int overlap: overlap of the neighbouring tiles in pixels, should exceed the objects diameter
+    :return: generator of tuples (tile_slices, origin, core) where tile_slices index the image, origin is (y0, x0) of
+             the tile and core is (y_start, y_stop, x_start, x_stop) in image coordinates
+    """
+    rows = _axis_tiles(shape[0], int(tile_size), int(overlap))
+    cols = _axis_tiles(shape[1], int(tile_size), int(overlap))
+
+    for y0, y1, cy0, cy1 in rows:
+        for x0, x1, cx0, cx1 in cols:
+            yield (slice(y0, y1), slice(x0, x1)), (y0, x0), (cy0, cy1, cx0, cx1)
+
+
+def in_core(rows, cols, core):
+    """
+    Checks which centroids lie in the core region of the tile.
+    :param rows: ndarray of centroid rows in image coordinates
+    :param cols: ndarray of centroid columns in image coordinates
+    :param tuple core: (y_start, y_stop, x_start, x_stop)
+    :return: boolean ndarray
+    """
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    return (rows >= core[0]) & (rows < core[1]) & (cols >= core[2]) & (cols < core[3])
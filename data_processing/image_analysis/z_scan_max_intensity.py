@@ -4,19 +4,128 @@ from data_processing.image_analysis.base_image_analyzer import ImageAnalysisTemp
 from data_processing.image_analysis.analysis_registry import register_class
 
 
+def intensity_sum(plane):
+    """
+    :return: float, summed intensity of the plane
+    """
+    return float(np.sum(plane, dtype=np.float64))
+
+
+def intensity_variance(plane):
+    """
+    :return: float, variance of the plane intensity, higher for the sharper planes
+    """
+    return float(np.var(plane, dtype=np.float64))
+
+
+def gradient_energy(plane):
+    """
+    :return: float, summed squared differences of the neighbouring pixels, higher for the sharper planes
+    """
+    plane = np.asarray(plane, dtype=np.float64)
+    return float(np.sum(np.diff(plane, axis=0) ** 2) + np.sum(np.diff(plane, axis=1) ** 2))
+
+
+FOCUS_METRICS = {"sum": intensity_sum, "variance": intensity_variance, "gradient": gradient_energy}
+
+
+def refine_peak(profile, method="parabolic", window=5):
+    """
+    Refines the maximum of the Z profile below the plane spacing by the least squares fit of the parabola to the
+    profile (parabolic) or to its logarithm (gaussian) around the maximal plane.
+    :param profile: ndarray (Z,) of the focus metric
+    :param str method: 'parabolic' or 'gaussian'
+    :param int window: number of planes used for the fit, at least 3
+    :return: tuple (fractional Z index, confidence), the confidence is the R^2 of the fit and 0 when the maximum is
+             not bracketed by the profile, then the integer index is returned
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    peak = int(np.argmax(profile))
+
+    half = max(int(window), 3) // 2
+    start, stop = max(peak - half, 0), min(peak + half + 1, len(profile))
+
+    # the focus at the first or last plane may lie outside of the scanned range
+    if peak == 0 or peak == len(profile) - 1 or stop - start < 3:
+        return float(peak), 0.0
+
+    z = np.arange(start, stop, dtype=np.float64) - peak
+    values = profile[start:stop]
+
+    if method == "gaussian":
+        if np.any(values <= 0):
+            return float(peak), 0.0
+        values = np.log(values)
+    elif method != "parabolic":
+        raise ValueError("Peak fit must be 'parabolic' or 'gaussian', got {}".format(method))
+
+    a, b, c = np.polyfit(z, values, 2)
+
+    # no maximum in the window
+    if a >= 0:
+        return float(peak), 0.0
+
+    offset = float(np.clip(-b / (2 * a), z[0], z[-1]))
+
+    residual = np.sum((values - np.polyval([a, b, c], z)) ** 2)
+    total = np.sum((values - values.mean()) ** 2)
+    confidence = float(1 - residual / total) if total > 0 else 0.0
+
+    return peak + offset, max(confidence, 0.0)
+
+
 @register_class
 class Max_intensity_Z_Scan(ImageAnalysisTemplate):
     """
-     CLass for finding the measurement points at maximum intensity along Z axis.
+     CLass for finding the measurement points at maximum intensity along Z axis. By default the CziFileReader reduces
+     every plane to the focus metric as it is decoded, so the image is the 1D Z profile instead of the whole stack.
      """
 
+    @classmethod
+    def plane_reducer(cls, focus_metric="sum", streaming=True, **analysis_details):
+        """
+        Focus metric applied by the CziFileReader to each decoded plane, None reads the whole stack.
+        :param str focus_metric: name of the metric in FOCUS_METRICS
+        :param bool streaming: reduce the planes while reading
+        :return: callable or None
+        """
+        return FOCUS_METRICS[focus_metric] if streaming else None
+
+    @property
+    def stack_shape(self):
+        """
+        :return: tuple (Z, H, W) of the Z-stack, also when only its profile was read
+        """
+        return tuple(self.metadata.get("stack_shape", self.image.shape))
+
+    def get_intensity_profile(self):
+        """
+        Focus metric of every Z slice.
+        :return: ndarray (Z,)
+        """
+        if self.image.ndim == 1:
+            return self.image
+
+        metric = FOCUS_METRICS[self.analysis_details.get("focus_metric", "sum")]
+        return np.array([metric(plane) for plane in self.image])
+
     def get_max_intensity(self):
         """
         Find the index along Z axis with maximum summed intensity.
         :return: int, index of Z slice with maximum intensity
         """
-        z_sums = np.sum(self.image, axis=tuple(range(1, self.image.ndim)))
-        return np.argmax(z_sums)
+        return np.argmax(self.get_intensity_profile())
+
+    def get_focus_index(self):
+        """
+        Find the Z index of the focus, refined below the Z step when the peak_fit is set in the analysis details.
+        :return: tuple (Z index, confidence), the confidence is None without the refinement
+        """
+        peak_fit = self.analysis_details.get("peak_fit")
+        if peak_fit is None:
+            return self.get_max_intensity(), None
+
+        return refine_peak(self.get_intensity_profile(), peak_fit, self.analysis_details.get("peak_fit_window", 5))
 
     def get_measurement_points(self):
         """
@@ -25,13 +134,15 @@ class Max_intensity_Z_Scan(ImageAnalysisTemplate):
                  in the pixels coordinates and in the stage coordinates in um
         """
 
-        max_z_index = self.get_max_intensity()
+        max_z_index, confidence = self.get_focus_index()
 
-        x, y = self.image.shape[1] / 2 - 1, self.image.shape[2] / 2 - 1
+        stack_shape = self.stack_shape
+
+        x, y = stack_shape[1] / 2 - 1, stack_shape[2] / 2 - 1
 
         if self.metadata['z_scan']['is_center_mode']:
 
-            z_dim = self.image.shape[0]
+            z_dim = stack_shape[0]
 
             center = np.round(z_dim / 2 + 0.5)
 
@@ -43,6 +154,9 @@ class Max_intensity_Z_Scan(ImageAnalysisTemplate):
 
             measurement_points = [{'position': [x, y, max_z_index]}]
 
+        if confidence is not None:
+            measurement_points[0]['focus_confidence'] = confidence
+
         transformed_points = self.pixel_converter.convert_points(measurement_points, xy_mode="center",
                                                                  z_strategy=self.pixel_converter.convert_z_auto)
 
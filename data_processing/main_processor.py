@@ -2,54 +2,157 @@ import json
 import os
 from data_processing.processor.zeiss_image_processor import ZeissImageProcessor
 from data_processing.processor.zeiss_FCS_processor import ZeissFCSProcessor
+from data_processing.tracing import TRACER, TRACE_FILE_NAME, span
 from utils import visualize_points, parse_args_to_dict, choose_the_closest_point
 from pathlib import Path
 
 """
 Script initialized by the PythonRunner, takes the argumets from PythonRunner and initializes objects: ZeissFCSProcessor
-or ZeissImageProcessor and saves the results of the analysis to JSON files.
+or ZeissImageProcessor and saves the results of the analysis to JSON files. The same analysis is served by the
+long-lived analysis_server, which calls run_analysis for every request.
 """
 
-with open('config/preprocessing_config.json', 'r') as file:
-    preprocessing_config = json.load(file)
+PREPROCESSING_CONFIG_PATH = 'config/preprocessing_config.json'
+FCS_CONFIG_PATH = 'config/fcs_config.json'
 
-print("Started main_processor")
+# prefix of the stdout line with the measurement points, the same as ZeissAPI.execute_python.RESULT_MARKER
+RESULT_MARKER = '@@MEASUREMENT_POINTS@@ '
 
-command_args = parse_args_to_dict()
 
-print("[INFO] Parsed arguments: {}".format(command_args))
+def load_preprocessing_config(path=PREPROCESSING_CONFIG_PATH):
+    """
+    Reads the JSON with the analysis profiles.
+    :param str path: path to the preprocessing_config.json
+    :return: dict of the analysis profiles
+    """
+    with open(path, 'r') as file:
+        return json.load(file)
 
-if command_args['is_FCS'] == 'True':
 
-    print('Analyzing FCS')
+def load_fcs_config(path=FCS_CONFIG_PATH):
+    """
+    Reads the JSON with the options of the ZeissFCSProcessor, kept apart from the analysis profiles.
+    :param str path: path to the fcs_config.json
+    :return: dict of the options, empty when the file does not exist
+    """
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
 
-    folder_path = os.path.dirname(command_args['file_path'])
 
-    print(folder_path)
+def trace_path_for(command_args):
+    """
+    Trace file of the analysis, by default trace.jsonl next to the saving_path, --trace_path=None disables the tracing.
+    :param dict command_args: arguments in the form produced by parse_args_to_dict
+    :return: str path or None
+    """
+    trace_path = command_args.get('trace_path')
+    if trace_path is None:
+        return os.path.join(os.path.dirname(os.path.abspath(command_args['saving_path'])), TRACE_FILE_NAME)
+    return None if str(trace_path) == 'None' else trace_path
 
-    obj = ZeissFCSProcessor(folder_path)
 
-    print(command_args['saving_path'])
+def fcs_options(command_args, fcs_config):
+    """
+    Options of the ZeissFCSProcessor from fcs_config.json, overridden by the --n_workers and --intensity_target
+    arguments.
+    :param dict command_args: arguments in the form produced by parse_args_to_dict
+    :param dict fcs_config: options from fcs_config.json
+    :return: dict with n_workers, None for the default of the ZeissFCSProcessor, and intensity_target
+    """
+    options = dict(fcs_config)
+    for key in ['n_workers', 'intensity_target']:
+        if command_args.get(key) is not None:
+            options[key] = command_args[key]
 
-    obj.save_measurement_points(command_args['saving_path'])
+    n_workers = options.get('n_workers')
+    intensity_target = options.get('intensity_target')
 
-else:
+    return {'n_workers': None if n_workers in (None, 'None') else int(n_workers),
+            'intensity_target': None if intensity_target in (None, 'None') else float(intensity_target)}
 
-    print("Analyzing Image")
 
-    analysis_type = preprocessing_config[command_args['analysis_arguments']]
+def run_analysis(command_args, preprocessing_config):
+    """
+    Runs a single FCS or image analysis and saves its results to the saving_path, the stages of the analysis are
+    traced to the trace_path_for file.
+    :param dict command_args: arguments in the form produced by parse_args_to_dict
+    :param dict preprocessing_config: analysis profiles from preprocessing_config.json
+    :return: None
+    """
+    with TRACER.invocation(trace_path_for(command_args), type=command_args.get('type'),
+                           file_path=command_args.get('file_path'), is_FCS=str(command_args.get('is_FCS')),
+                           analysis=command_args.get('analysis_arguments')):
+        _run_analysis(command_args, preprocessing_config)
 
-    obj = ZeissImageProcessor(command_args['file_path'], **analysis_type)
 
-    if command_args['type'] == 'reanalysis_xy' and len(obj.measurement_points) > 1:
-        print("Found multiple objects after reanalysis: {}".format(len(obj.measurement_points)))
-        closest_point = choose_the_closest_point(obj.measurement_points, obj.metadata["stage_position"])
-        obj.measurement_points = [closest_point]
+def _run_analysis(command_args, preprocessing_config):
+    """
+    Body of run_analysis, runs inside the traced invocation.
+    """
+    # --columnar=True also writes the points in the columnar .npz form, the JSON stays for the ZEN macro
+    columnar = str(command_args.get('columnar', False)) == 'True'
+    # --emit_points=True prints the points as one marked line, so the runner gets them without reading the JSON
+    emit_points = str(command_args.get('emit_points', False)) == 'True'
 
-    obj.save_measurement_points(command_args['saving_path'])
+    if str(command_args['is_FCS']) == 'True':
 
-    # For xy reanalysis shows the image with the mark of the new measuring position
-    if command_args['type'] != 'reanalysis_z':
-        visualize_points(obj, Path(command_args['saving_path']).with_suffix(".png"))
+        print('Analyzing FCS')
 
-    print("Finished overview analysis for: {}".format(command_args['file_path']))
+        folder_path = os.path.dirname(command_args['file_path'])
+
+        print(folder_path)
+
+        obj = ZeissFCSProcessor(folder_path, **fcs_options(command_args, load_fcs_config()))
+
+        print(command_args['saving_path'])
+
+        data = obj.save_measurement_points(command_args['saving_path'], columnar)
+
+    else:
+
+        print("Analyzing Image")
+
+        analysis_type = dict(preprocessing_config[command_args['analysis_arguments']])
+
+        # the reanalysis images are taken at the expected object position, so only the window around it is read
+        roi_size_um = analysis_type.pop('roi_size_um', None)
+        if command_args['type'] in ['reanalysis_xy', 'reanalysis_z'] and roi_size_um is not None:
+            analysis_type['roi_um'] = (None, None, roi_size_um, roi_size_um)
+
+        obj = ZeissImageProcessor(command_args['file_path'], **analysis_type)
+
+        if command_args['type'] == 'reanalysis_xy' and len(obj.measurement_points) > 1:
+            print("Found multiple objects after reanalysis: {}".format(len(obj.measurement_points)))
+            closest_point = choose_the_closest_point(obj.measurement_points, obj.metadata["stage_position"])
+            if closest_point is None:
+                print("[WARNING] None of the objects has the XY position, no point is saved")
+                obj.measurement_points = []
+            else:
+                obj.measurement_points = [closest_point]
+
+        data = obj.save_measurement_points(command_args['saving_path'], columnar)
+
+        # For xy reanalysis shows the image with the mark of the new measuring position
+        if command_args['type'] != 'reanalysis_z':
+            with span('render_png'):
+                visualize_points(obj, Path(command_args['saving_path']).with_suffix(".png"))
+
+        print("Finished overview analysis for: {}".format(command_args['file_path']))
+
+    if emit_points:
+        print(RESULT_MARKER + json.dumps(data), flush=True)
+
+
+if __name__ == '__main__':
+
+    preprocessing_config = load_preprocessing_config()
+
+    print("Started main_processor")
+
+    command_args = parse_args_to_dict()
+
+    print("[INFO] Parsed arguments: {}".format(command_args))
+
+    run_analysis(command_args, preprocessing_config)
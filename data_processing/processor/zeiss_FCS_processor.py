@@ -1,10 +1,32 @@
 import os
+import time
 import numpy as np
 import json
-from IO.read_raw_corr_file import read_confo_cor3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from IO.read_raw_corr_file import ConfoCor3RawFile
+from IO.measurement_points_table import save_measurement_points_table
+from data_processing.tracing import span
 import re
 from datetime import datetime
 
+# threads ranking the .raw files, the reading is bound by the disk, so a few threads overlap it without the CPU cost
+DEFAULT_N_WORKERS = 4
+
+
+def raw_file_intensity(raw_path):
+    """
+    Mean photon intensity of the .raw file from the photon count and the last arrival time.
+    :param str raw_path: path to the .raw file
+    :return: tuple (raw_path, mean intensity [photons/s], reading time [s])
+    """
+    start = time.perf_counter()
+
+    raw_file = ConfoCor3RawFile(raw_path)
+    duration_s = raw_file.last_arrival_time / raw_file.sync_rate
+    mean_intensity = raw_file.n_photons / duration_s if duration_s > 0 else 0.0
+
+    return raw_path, mean_intensity, time.perf_counter() - start
+
 
 class ZeissFCSProcessor:
     """
@@ -13,13 +35,17 @@ class ZeissFCSProcessor:
     the corresponding stage positions.
     """
 
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, n_workers=DEFAULT_N_WORKERS, intensity_target=None):
         """
         Initialize the FCS processor.
 
         :param folder_path: Path to the folder containing .raw files and FCS_points.json
+        :param n_workers: number of threads ranking the files, 1 ranks them one by one, None uses DEFAULT_N_WORKERS
+        :param intensity_target: optional intensity [photons/s], the ranking stops at the first file exceeding it
         """
         self.folder_path = folder_path
+        self.n_workers = n_workers or DEFAULT_N_WORKERS
+        self.intensity_target = intensity_target
 
         # Collects all .raw files from the folder
         self.raw_files = [
@@ -36,45 +62,54 @@ class ZeissFCSProcessor:
         if not self.raw_files:
             print("No .raw files found in:", folder_path)
 
-    def mean_intensity_from_photon_data(self, photon_data):
+    def _ranked_files(self):
         """
-        Calculate mean photon intensity (photons per second)
-        from photon arrival time data.
-
-        :param photon_data: Dictionary containing photon timing data
-        :return: Mean photon intensity [photons/s]
+        Generates the intensities of the .raw files in the order they are computed, in a thread pool when more than
+        one worker is used. The sum of the memory-mapped records releases the GIL, so the threads read the files in
+        parallel without starting the processes, which would re-import the pipeline on Windows.
+        :return: generator of (raw_path, mean intensity, reading time) tuples, None intensity for unreadable files
         """
-        ph_sync = photon_data["ph_sync"]  # photon tick times
-        sync_rate = photon_data["TTResult_SyncRate"]  # clock frequency [Hz]
-
-        # Convert ticks to seconds
-        time_s = ph_sync / sync_rate
-
-        # Compute histogram of photon arrivals in time bins
-        bin_width = 0.1  # seconds
-        bins = np.arange(0, time_s[-1] + bin_width, bin_width)
-        counts, _ = np.histogram(time_s, bins=bins)
-
-        # Mean photon rate (counts per second)
-        return np.mean(counts / bin_width)
+        n_workers = self.n_workers
+
+        if n_workers == 1 or len(self.raw_files) < 2:
+            for raw_path in self.raw_files:
+                try:
+                    yield raw_file_intensity(raw_path)
+                except Exception as e:
+                    print("Error reading file:", raw_path, ":", str(e))
+            return
+
+        with ThreadPoolExecutor(max_workers=min(n_workers, len(self.raw_files))) as executor:
+            futures = {executor.submit(raw_file_intensity, raw_path): raw_path for raw_path in self.raw_files}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        print("Error reading file:", futures[future], ":", str(e))
+            finally:
+                # the files not yet started are skipped after the early exit
+                for future in futures:
+                    future.cancel()
 
     def find_highest_intensity_file(self):
         """
         Process all .raw files, compute their mean intensity,
-        and return the file with the highest intensity.
+        and return the file with the highest intensity. With the intensity_target the first file exceeding it is
+        returned without waiting for the others.
 
         :return: (best_file_path, max_intensity)
         """
         results = []
 
-        for raw_path in self.raw_files:
-            try:
-                ph_data = read_confo_cor3(raw_path)
-                mean_intensity = self.mean_intensity_from_photon_data(ph_data)
-                results.append((raw_path, mean_intensity))
-                print(os.path.basename(raw_path), ":", round(mean_intensity, 2))
-            except Exception as e:
-                print("Error reading file:", raw_path, ":", str(e))
+        for raw_path, mean_intensity, elapsed in self._ranked_files():
+            results.append((raw_path, mean_intensity))
+            print(os.path.basename(raw_path), ":", round(mean_intensity, 2), "photons/s, read in",
+                  round(elapsed, 3), "s")
+
+            if self.intensity_target is not None and mean_intensity >= self.intensity_target:
+                print("Intensity target", self.intensity_target, "photons/s reached, skipping the remaining files")
+                break
 
         if not results:
             print("No valid photon data found.")
@@ -93,7 +128,8 @@ class ZeissFCSProcessor:
         Connects chosen file with the position from FCS_points.json
         """
 
-        best_file, max_intensity = self.find_highest_intensity_file()
+        with span('rank_raw_files', files=len(self.raw_files)):
+            best_file, max_intensity = self.find_highest_intensity_file()
 
         pattern = r"P(\d+)"
 
@@ -117,15 +153,29 @@ class ZeissFCSProcessor:
 
         return measurement_points
 
-    def save_measurement_points(self, saving_path):
-        """Saves measurement_points dict to a JSON file."""
+    def save_measurement_points(self, saving_path, columnar=False):
+        """
+        Saves measurement_points dict to a JSON file.
+        :param str saving_path: path of the JSON file
+        :param bool columnar: also save the points in the columnar .npz form next to the JSON
+        :return: dict of the saved measurement points
+        """
 
         data = self.get_measurement_points()
 
-        with open(saving_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with span('save_json'):
+            # written under the final name at once, the macro and the runner never read a partial file
+            tmp_path = saving_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, saving_path)
+
+        if columnar:
+            with span('save_columnar'):
+                save_measurement_points_table(data, os.path.splitext(saving_path)[0] + ".npz")
 
         print("Saved measurement points to:", saving_path)
+        return data
 
 
 
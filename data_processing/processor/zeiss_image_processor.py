@@ -2,6 +2,7 @@ import os
 import numpy as np
 
 from IO.read_czi_file import CziFileReader
+from IO.measurement_points_table import save_measurement_points_table
 
 import json
 import copy
@@ -9,6 +10,9 @@ import uuid
 from datetime import datetime
 import data_processing.image_analysis
 from data_processing.image_analysis.analysis_registry import get_image_analysis_type, get_available_analysis
+from data_processing.spatial_index import suppress_duplicates
+from data_processing.tracing import span
+from utils import choose_the_closest_point
 
 
 class ZeissImageProcessor:
@@ -16,32 +20,71 @@ class ZeissImageProcessor:
     Processes Zeiss .czi files, by reading them, calling for the segmentation algorithm from image_analysis and saving
     the results as JSON files.
     """
-    def __init__(self, czi_file_path, analysis_channel=1, chosen_analysis='FluorescentGUV', **analysis_details):
+    def __init__(self, czi_file_path, analysis_channel=1, chosen_analysis='FluorescentGUV', roi=None, roi_um=None,
+                 metadata_cache=None, coarse_zoom=None, refine_window_um=None, duplicate_radius_um=None,
+                 **analysis_details):
 
-        # reading the image and metadata from .czi file with the CziFileReader and choosing the channel for analysis
+        # reading the image and metadata from .czi file with the CziFileReader and choosing the channel for analysis,
+        # with the roi given only this region of the image is read, with the coarse_zoom the objects are found on the
+        # downsampled image and refined in the full resolution windows around them
         self.czi_file_path = czi_file_path
         self.analysis_channel = analysis_channel
+        self.analysis_details = analysis_details
 
-        czi_obj = CziFileReader(self.czi_file_path, self.analysis_channel)
+        strategy_class = self.get_analysis_class(chosen_analysis)
+
+        # analyzers working on one value per plane, like the Z-scan focus, let the reader reduce the planes on the fly
+        plane_reducer = None
+        if hasattr(strategy_class, 'plane_reducer'):
+            plane_reducer = strategy_class.plane_reducer(**analysis_details)
+
+        # analyzers segmenting tile by tile let the reader decode only the tiles instead of the whole image
+        load_image = not (hasattr(strategy_class, 'reads_tiles') and strategy_class.reads_tiles(**analysis_details))
+
+        with span('read_czi'):
+            czi_obj = CziFileReader(self.czi_file_path, self.analysis_channel, roi=roi, roi_um=roi_um,
+                                    metadata_cache=metadata_cache, plane_reducer=plane_reducer,
+                                    zoom=coarse_zoom or 1.0, load_image=load_image)
         self.image_to_analyze = czi_obj.czi_file
         self.metadata = czi_obj.metadata
 
         # calling for the segmentation algorithm and initializing it
-        self.image_analyzer = self.get_analysis_type(chosen_analysis, **analysis_details)
-        self.measurement_points, self.not_scaled_points = self.get_measurement_points()
+        with span('segmentation', analysis=chosen_analysis):
+            self.image_analyzer = self.get_analysis_type(chosen_analysis, **analysis_details)
+            self.measurement_points, self.not_scaled_points = self.get_measurement_points()
 
-    def get_analysis_type(self, chosen_analysis, **kwargs):
+        if coarse_zoom is not None and coarse_zoom != 1:
+            with span('refine', points=len(self.measurement_points)):
+                self.measurement_points = self.refine_measurement_points(czi_obj, strategy_class, refine_window_um)
+
+        # the detections of the same object, e.g. two candidates refined to one object, are measured once
+        if duplicate_radius_um is not None:
+            with span('suppress_duplicates'):
+                self.measurement_points = suppress_duplicates(self.measurement_points, duplicate_radius_um)
+
+    @staticmethod
+    def get_analysis_class(chosen_analysis):
         """
-        Method for initialization of the segmentation algorithm
+        Looks up the class of the segmentation algorithm.
         :param chosen_analysis: name of the class in image_analysis folder for segmentation
-        :param kwargs: additional arguments for the analyzing script like:
-        :return: initialized object of the segmentation class
+        :return: class of the segmentation algorithm
         """
         strategy_class = get_image_analysis_type(chosen_analysis)
         if not strategy_class:
             raise ValueError(
                 f"Unknown analysis type: {chosen_analysis}, please choose from {get_available_analysis()}")
 
+        return strategy_class
+
+    def get_analysis_type(self, chosen_analysis, **kwargs):
+        """
+        Method for initialization of the segmentation algorithm
+        :param chosen_analysis: name of the class in image_analysis folder for segmentation
+        :param kwargs: additional arguments for the analyzing script like:
+        :return: initialized object of the segmentation class
+        """
+        strategy_class = self.get_analysis_class(chosen_analysis)
+
         return strategy_class(
             image=self.image_to_analyze,
             metadata=self.metadata, **kwargs)
@@ -57,12 +100,63 @@ class ZeissImageProcessor:
         return measurement_points, points
 
 
-    def save_measurement_points(self, filename):
+    def refine_window(self, point, refine_window_um=None):
+        """
+        Edge of the full resolution window around the candidate, so the window contains the whole object also when
+        its coarse position is off by the object radius.
+        :param dict point: candidate found on the downsampled image, with the radius in um when the analysis gives it
+        :param refine_window_um: fixed edge of the window in um, None derives it from the radius
+        :return: float edge of the window in um
+        """
+        if refine_window_um is not None:
+            return refine_window_um
+
+        scaling = self.metadata["scaling_um_per_pixel"]
+        margin_um = 8 * max(scaling["X"], scaling["Y"]) * 1e6
+
+        radius_um = point.get("radius")
+        if radius_um is None or not np.isfinite(radius_um):
+            return 4 * margin_um
+        return 4 * radius_um + 2 * margin_um
+
+    def refine_measurement_points(self, czi_obj, strategy_class, refine_window_um=None):
+        """
+        Repeats the analysis in the full resolution window around every point found on the downsampled image and
+        keeps the refined point closest to it, the points not found again keep their coarse position.
+        :param CziFileReader czi_obj: reader of the downsampled image
+        :param strategy_class: class of the segmentation algorithm
+        :param refine_window_um: edge of the window in um, by default twice the diameter of the candidate extended by
+                                 8 pixels of the downsampled image on every side
+        :return: list of dictionaries with the refined positions in stage coordinates
+        """
+        rois_um = [(p["position"][0], p["position"][1]) + (self.refine_window(p, refine_window_um),) * 2
+                   for p in self.measurement_points]
+
+        refined_points = []
+        for point, (image, metadata) in zip(self.measurement_points, czi_obj.iter_regions(rois_um)):
+            analyzer = strategy_class(image=image, metadata=metadata, **self.analysis_details)
+            _, found_points = analyzer.get_measurement_points()
+
+            position = point["position"]
+            closest_point = choose_the_closest_point(found_points, {'x': position[0], 'y': position[1],
+                                                                    'z': position[2]})
+
+            # also when none of the found objects has the XY position
+            if closest_point is None:
+                refined_points.append(dict(point, refined=False))
+                continue
+
+            refined_points.append(dict(closest_point, refined=True))
+
+        return refined_points
+
+    def save_measurement_points(self, filename, columnar=False):
         """
         Function responsible for saving the positions and properties of the found objects in the stage coordinates in
         the JSON file.
         :param filename: saving path of the JSON file
-        :return: None
+        :param bool columnar: also save the points in the columnar .npz form next to the JSON
+        :return: dict {point id: point} saved in the JSON
         """
         data = {}
 
@@ -73,8 +167,18 @@ class ZeissImageProcessor:
             entry["timestamp"] = datetime.utcnow().isoformat() + "Z"
             data[point_id] = entry
 
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with span('save_json', points=len(data)):
+            # written under the final name at once, the macro and the runner never read a partial file
+            tmp_path = filename + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, filename)
+
+        if columnar:
+            with span('save_columnar'):
+                save_measurement_points_table(data, os.path.splitext(filename)[0] + ".npz")
+
+        return data
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+import glob
+import json
+import os
+import uuid
+
+import numpy as np
+
+from data_processing.spatial_index import PointIndex
+from utils import parse_args_to_dict
+
+"""
+Session-level merge of the measurement points of the overview tiles. Every tile is analysed on its own, so an object
+in the overlap of the neighbouring tiles is found in both of them. The points of all the tiles, already in the stage
+coordinates, are put into one PointIndex and the detections of different tiles closer than match_radius_um and of a
+similar radius are merged into one object. The closest detections are matched first and an object gets at most one
+detection of every tile, so the neighbouring objects are not chained together through the overlaps. Every object gets
+an id derived from its first member, so the id does not change when the merge is repeated on the same tile results.
+
+Run from the project root:
+python -m data_processing.session_merge --input=path/to/temp --output=global_objects.json --match_radius_um=5
+"""
+
+# namespace of the uuid5 ids of the merged objects
+SESSION_NAMESPACE = uuid.UUID('6f1c1f5e-3d0a-4c1e-9a57-2f3d8a2b7c41')
+
+
+def collect_tile_files(input_path):
+    """
+    :param str input_path: folder with the measurement points JSONs or a glob pattern
+    :return: sorted list of the JSON files
+    """
+    if os.path.isdir(input_path):
+        return sorted(os.path.join(input_path, f) for f in os.listdir(input_path) if f.lower().endswith('.json'))
+    return sorted(f for f in glob.glob(input_path, recursive=True) if os.path.isfile(f))
+
+
+def load_tile_points(files):
+    """
+    Reads the measurement points of the tiles.
+    :param list files: measurement points JSONs, one per tile
+    :return: list of the points with the "tile_file" and "tile_point_id" added
+    """
+    points = []
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for point_id, entry in data.items():
+            points.append(dict(entry, tile_file=file, tile_point_id=point_id))
+    return points
+
+
+def _same_object_filter(tiles, radii, radius_tolerance):
+    """
+    :return: function for PointIndex.clusters accepting the pairs from different tiles with a similar radius
+    """
+    def pair_filter(pairs, distances):
+        first, second = pairs[:, 0], pairs[:, 1]
+        mask = tiles[first] != tiles[second]
+
+        if radius_tolerance is not None:
+            r1, r2 = radii[first], radii[second]
+            known = np.isfinite(r1) & np.isfinite(r2)
+            similar = np.abs(r1 - r2) <= radius_tolerance * np.maximum(r1, r2)
+            mask &= ~known | similar
+
+        return mask
+
+    return pair_filter
+
+
+def merge_tile_points(points, match_radius_um=5.0, radius_tolerance=0.5, prefer='radius'):
+    """
+    Merges the detections of the same object found in different tiles.
+    :param list points: points returned by load_tile_points
+    :param float match_radius_um: largest distance between the detections of the same object in um
+    :param float radius_tolerance: largest relative difference of the radii of the same object, None ignores radii
+    :param str prefer: property deciding which detection gives the position, the largest one is kept, the objects cut
+                       by the tile border look smaller, so by default the detection with the largest radius is used
+    :return: dict {object id: point} with "detections", "members" and "tiles" of the merged detections
+    """
+    if len(points) == 0:
+        return {}
+
+    tile_names, tiles = np.unique([p['tile_file'] for p in points], return_inverse=True)
+    values = np.array([np.nan if p.get(prefer) is None else float(p[prefer]) for p in points])
+    radii = values if prefer == 'radius' else \
+        np.array([np.nan if p.get('radius') is None else float(p['radius']) for p in points])
+
+    index = PointIndex(points, use_z=False)
+    labels = index.clusters(match_radius_um, _same_object_filter(tiles, radii, radius_tolerance), groups=tiles)
+
+    # the points without the position stay as separate objects
+    unindexed = labels < 0
+    labels[unindexed] = labels.max() + 1 + np.arange(unindexed.sum())
+
+    keys = np.array(['{}|{}'.format(p['tile_file'], p['tile_point_id']) for p in points])
+
+    # representative: the largest prefer value in the cluster; id: the smallest member key
+    order = np.lexsort((-np.where(np.isfinite(values), values, -np.inf), labels))
+    _, first = np.unique(labels[order], return_index=True)
+    representatives = order[first]
+
+    order = np.lexsort((keys, labels))
+    cluster_labels, starts = np.unique(labels[order], return_index=True)
+    members = np.split(order, starts[1:])
+
+    # the objects are listed in the order of their first detection
+    first_detection = np.array([m.min() for m in members])
+
+    merged = {}
+    for c in np.argsort(first_detection):
+        member_indices = members[c]
+        representative = points[representatives[c]]
+
+        object_id = str(uuid.uuid5(SESSION_NAMESPACE, keys[member_indices[0]]))
+        entry = {k: v for k, v in representative.items() if k not in ('tile_file', 'tile_point_id')}
+        entry['detections'] = len(member_indices)
+        entry['members'] = [points[i]['tile_point_id'] for i in member_indices]
+        entry['tiles'] = sorted({tile_names[tiles[i]] for i in member_indices})
+        merged[object_id] = entry
+
+    return merged
+
+
+def merge_session(files, saving_path, match_radius_um=5.0, radius_tolerance=0.5):
+    """
+    Merges the tile results and saves the global object list in the measurement points JSON format.
+    :param list files: measurement points JSONs of the tiles
+    :param str saving_path: path of the global object list
+    :return: dict {object id: point}
+    """
+    # the global list of a previous merge may be in the same folder as the tiles
+    files = [f for f in files if os.path.abspath(f) != os.path.abspath(saving_path)]
+
+    points = load_tile_points(files)
+    merged = merge_tile_points(points, match_radius_um, radius_tolerance)
+
+    with open(saving_path, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=2, ensure_ascii=False)
+
+    print("Merged {} detections from {} tiles into {} objects".format(len(points), len(files), len(merged)))
+    return merged
+
+
+if __name__ == '__main__':
+
+    args = parse_args_to_dict()
+
+    tolerance = args.get('radius_tolerance', 0.5)
+    merge_session(collect_tile_files(args['input']), args.get('output', 'global_objects.json'),
+                  float(args.get('match_radius_um', 5.0)), None if tolerance == 'None' else float(tolerance))
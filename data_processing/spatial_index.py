@@ -0,0 +1,203 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+"""
+Spatial index of the measurement points in the stage coordinates, built on the scipy cKDTree. Used to find the point
+closest to the stage positions, the points in a radius and to merge the detections of the same object, in
+O(N log M) instead of comparing every position with every point.
+"""
+
+
+def points_to_array(measurement_points):
+    """
+    :param list measurement_points: dictionaries with the "position" [x, y, z] in um, None for the unknown coordinate
+    :return: float ndarray (N, 3), NaN for the unknown coordinates
+    """
+    positions = [(list(p["position"] or []) + [None] * 3)[:3] for p in measurement_points]
+    return np.array([[np.nan if c is None else c for c in position] for position in positions],
+                    dtype=float).reshape(-1, 3)
+
+
+def _exclusive_clusters(n, pairs, distances, groups):
+    """
+    Union-find over the pairs in the order of their distance, skipping the pairs which would join two points of the
+    same group.
+    :param int n: number of the points
+    :param pairs: ndarray (P, 2) of the point indices
+    :param distances: ndarray (P,) of the pair distances
+    :param groups: ndarray (N,) of the group of every point
+    :return: ndarray (N,) of the consecutive cluster labels
+    """
+    parent = list(range(n))
+    cluster_groups = [{g} for g in np.asarray(groups).tolist()]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for first, second in pairs[np.argsort(distances, kind='stable')].tolist():
+        a, b = find(first), find(second)
+        if a == b or not cluster_groups[a].isdisjoint(cluster_groups[b]):
+            continue
+        if len(cluster_groups[a]) < len(cluster_groups[b]):
+            a, b = b, a
+        parent[b] = a
+        cluster_groups[a] |= cluster_groups[b]
+
+    _, labels = np.unique([find(i) for i in range(n)], return_inverse=True)
+    return labels.reshape(-1)
+
+
+class PointIndex:
+    """
+    KD-tree over the measurement points. The Z coordinate is used only when it is known for every point, the points
+    without the XY position are left out of the index.
+
+    :param list measurement_points: dictionaries with the "position" [x, y, z] in stage coordinates (um)
+    :param bool use_z: use the Z coordinate, when known for all the points
+    """
+
+    def __init__(self, measurement_points, use_z=True):
+        self.measurement_points = list(measurement_points)
+        positions = points_to_array(self.measurement_points)
+
+        self.dims = 3 if use_z and len(positions) and np.isfinite(positions[:, 2]).all() else 2
+
+        # indices of the indexed points in the measurement_points
+        self.indices = np.flatnonzero(np.isfinite(positions[:, :self.dims]).all(axis=1))
+        self.positions = positions[self.indices, :self.dims]
+        self.tree = cKDTree(self.positions) if len(self.indices) else None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _query_positions(self, positions):
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        return positions[:, :self.dims]
+
+    def nearest(self, positions, k=1, max_distance=np.inf):
+        """
+        Finds the closest points to every query position.
+        :param positions: [x, y, z] or (Q, 3) array of the query positions in um
+        :param int k: number of the neighbours
+        :param float max_distance: the neighbours farther away are returned as -1
+        :return: (distances, indices in measurement_points), arrays (Q,) for k=1 or (Q, k)
+        """
+        queries = self._query_positions(positions)
+        if self.tree is None:
+            shape = (len(queries),) if k == 1 else (len(queries), k)
+            return np.full(shape, np.inf), np.full(shape, -1)
+
+        distances, tree_indices = self.tree.query(queries, k=k, distance_upper_bound=max_distance)
+        found = tree_indices < len(self.indices)
+        indices = np.where(found, self.indices[np.minimum(tree_indices, len(self.indices) - 1)], -1)
+        return distances, indices
+
+    def nearest_point(self, position):
+        """
+        :param position: [x, y, z] in um or the stage position dict {'x', 'y', 'z'}
+        :return: dict of the closest measurement point, None for the empty index
+        """
+        if isinstance(position, dict):
+            position = [position['x'], position['y'], position['z']]
+
+        _, indices = self.nearest([np.nan if c is None else c for c in position])
+        return self.measurement_points[indices[0]] if indices[0] >= 0 else None
+
+    def within(self, position, radius):
+        """
+        :param position: [x, y, z] in um
+        :param float radius: radius in um
+        :return: list of the indices in measurement_points of the points closer than the radius
+        """
+        if self.tree is None:
+            return []
+        return sorted(self.indices[self.tree.query_ball_point(self._query_positions(position)[0], radius)].tolist())
+
+    def pairs(self, radius):
+        """
+        :param float radius: radius in um
+        :return: (ndarray (P, 2) of the indices in measurement_points of the pairs closer than the radius,
+                 ndarray (P,) of their distances)
+        """
+        if self.tree is None:
+            return np.zeros((0, 2), dtype=int), np.zeros(0)
+
+        pairs = self.tree.query_pairs(radius, output_type='ndarray').reshape(-1, 2)
+        distances = np.linalg.norm(self.positions[pairs[:, 0]] - self.positions[pairs[:, 1]], axis=1)
+        return self.indices[pairs], distances
+
+    def clusters(self, radius, pair_filter=None, groups=None):
+        """
+        Groups the points connected by the chains of the neighbours closer than the radius.
+        :param float radius: merging radius in um
+        :param pair_filter: optional function (pairs, distances) -> bool mask of the pairs of the same object
+        :param groups: optional ndarray (N,) of the group of every point, e.g. its tile, a cluster never gets two points
+                       of the same group: the pairs are joined from the closest one and a pair joining two clusters
+                       with a common group is skipped, so the chains cannot merge two objects of one group
+        :return: ndarray (N,) of the cluster labels of the measurement_points, -1 for the points out of the index
+        """
+        labels = np.full(len(self.measurement_points), -1)
+        if self.tree is None:
+            return labels
+
+        pairs, distances = self.pairs(radius)
+        if pair_filter is not None:
+            mask = pair_filter(pairs, distances)
+            pairs, distances = pairs[mask], distances[mask]
+
+        n = len(self.measurement_points)
+        if groups is None:
+            graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+            _, all_labels = connected_components(graph, directed=False)
+        else:
+            all_labels = _exclusive_clusters(n, pairs, distances, groups)
+
+        labels[self.indices] = all_labels[self.indices]
+        return labels
+
+    def merge_duplicates(self, radius, prefer="radius"):
+        """
+        Merges the detections closer than the radius, from every cluster the point with the largest value of the
+        prefer property is kept, with the number of the merged detections in "n_merged".
+        :param float radius: merging radius in um
+        :param str prefer: property deciding which detection is kept, the first one is kept without it
+        :return: list of the measurement points without the duplicates, in the order of their first detection
+        """
+        labels = self.clusters(radius)
+
+        kept = {}
+        merged = []
+        for i, (point, label) in enumerate(zip(self.measurement_points, labels)):
+            if label < 0:
+                merged.append(point)
+                continue
+
+            if label not in kept:
+                kept[label] = len(merged)
+                merged.append(dict(point, n_merged=1))
+                continue
+
+            position = kept[label]
+            best = merged[position]
+            n_merged = best["n_merged"] + 1
+            value, best_value = point.get(prefer), best.get(prefer)
+            if value is not None and (best_value is None or value > best_value):
+                best = dict(point)
+            merged[position] = dict(best, n_merged=n_merged)
+
+        return merged
+
+
+def suppress_duplicates(measurement_points, radius, prefer="radius"):
+    """
+    :param list measurement_points: dictionaries with the "position" in um
+    :param float radius: merging radius in um
+    :param str prefer: property deciding which detection is kept
+    :return: list of the measurement points without the detections closer than the radius
+    """
+    return PointIndex(measurement_points).merge_duplicates(radius, prefer)
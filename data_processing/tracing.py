@@ -0,0 +1,258 @@
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+"""
+Lightweight tracing of the processing pipeline: nested spans with the wall and CPU time and the memory of the process.
+Every analysis (one main_processor run or one analysis_server request) is one invocation, its spans are appended as
+JSON lines to the trace file when it finishes, so the trace of a whole session can be summarised per stage.
+
+The memory of a span is the resident memory at its end (rss_mb) and its change over the span (rss_delta_mb). The
+process_peak_rss_mb is the peak of the whole process lifetime (ru_maxrss, PeakWorkingSetSize) read at the end of the
+span, neither counter can be reset per span, so in the analysis_server every span reports the highest peak so far and
+it is not a property of the stage.
+
+A span costs a few clock and memory counter reads, so the tracing is left on in production, it is disabled by passing
+trace_path='None' to main_processor.
+
+Summary of a session: python -m data_processing.tracing --summary=path/to/trace.jsonl
+"""
+
+TRACE_FILE_NAME = "trace.jsonl"
+
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    # own library instances, so the prototypes do not change the shared ctypes.windll ones; without the restype the
+    # 64-bit process handle would be truncated to int
+    _kernel32 = ctypes.WinDLL("kernel32")
+    _kernel32.GetCurrentProcess.argtypes = []
+    _kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+
+    _psapi = ctypes.WinDLL("psapi")
+    _psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(_ProcessMemoryCounters), wintypes.DWORD]
+    _psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+    _PROCESS_HANDLE = _kernel32.GetCurrentProcess()
+
+
+def _memory_mb():
+    """
+    :return: tuple (current, lifetime peak) resident memory of the process in MB, None when not available
+    """
+    if sys.platform == "win32":
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not _psapi.GetProcessMemoryInfo(_PROCESS_HANDLE, ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize / 2 ** 20, counters.PeakWorkingSetSize / 2 ** 20
+
+    try:
+        import resource
+    except ImportError:
+        return None, None
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    try:
+        with open("/proc/self/statm", "r") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        current = None
+    return current, peak
+
+
+class Tracer:
+    """
+    Collects the spans of the current invocation, the spans are nested per thread.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.invocation_id = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def enabled(self):
+        return self.invocation_id is not None
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Measures the enclosed code as a span nested in the currently open span of the thread.
+        :param str name: name of the stage
+        :param attributes: JSON serializable attributes of the span
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack()
+        path = "/".join(stack + [name])
+        stack.append(name)
+
+        memory_start, _ = _memory_mb()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            memory_end, peak = _memory_mb()
+            stack.pop()
+
+            record = {"invocation": self.invocation_id, "span": path, "name": name, "depth": len(stack),
+                      "wall_s": wall, "cpu_s": cpu, "rss_mb": memory_end, "process_peak_rss_mb": peak,
+                      "rss_delta_mb": None if memory_start is None or memory_end is None else memory_end - memory_start}
+            if attributes:
+                record["attributes"] = attributes
+            with self._lock:
+                self.records.append(record)
+
+    @contextmanager
+    def invocation(self, trace_path, name="run_analysis", **attributes):
+        """
+        Traces one analysis as the root span and appends its spans to the trace file at the end.
+        :param str trace_path: path of the JSON lines file, None disables the tracing
+        :param str name: name of the root span
+        :param attributes: attributes of the root span
+        """
+        if trace_path is None or self.enabled:
+            yield
+            return
+
+        self.invocation_id = str(uuid.uuid4())
+        self.records = []
+        started = datetime.now().isoformat(timespec="milliseconds")
+        try:
+            with self.span(name, **attributes):
+                yield
+        finally:
+            records, self.records, self.invocation_id = self.records, [], None
+            for record in records:
+                record["started"] = started
+            self.write(trace_path, records)
+
+    @staticmethod
+    def write(trace_path, records):
+        """
+        Appends the records to the trace file, one JSON line per span.
+        :return: None
+        """
+        try:
+            with open(trace_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+        except OSError as e:
+            print("[WARNING] Could not write the trace to {}: {}".format(trace_path, e))
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """
+    Span of the global tracer, does nothing outside of an invocation.
+    """
+    return TRACER.span(name, **attributes)
+
+
+def traced(name):
+    """
+    Decorator measuring every call of the function as a span.
+    :param str name: name of the stage
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_trace(trace_path):
+    """
+    :param str trace_path: path of the JSON lines file
+    :return: list of the span records
+    """
+    with open(trace_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_trace(records):
+    """
+    Statistics of every span path over the invocations of the session.
+    :param list records: span records
+    :return: dict {span path: dict with count, total, mean, median and max wall time, total CPU time, the highest
+             memory at the span end and the largest memory growth over the span}
+    """
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record["span"], []).append(record)
+
+    summary = {}
+    for path, group in grouped.items():
+        walls = [r["wall_s"] for r in group]
+        rss = [r["rss_mb"] for r in group if r.get("rss_mb") is not None]
+        growths = [r["rss_delta_mb"] for r in group if r.get("rss_delta_mb") is not None]
+        summary[path] = {
+            "count": len(group),
+            "wall_total_s": sum(walls),
+            "wall_mean_s": statistics.mean(walls),
+            "wall_median_s": statistics.median(walls),
+            "wall_max_s": max(walls),
+            "cpu_total_s": sum(r["cpu_s"] for r in group),
+            "rss_max_mb": max(rss) if rss else None,
+            "rss_delta_max_mb": max(growths) if growths else None,
+        }
+    return summary
+
+
+def print_summary(summary):
+    """
+    Prints the summary as a table sorted by the span path.
+    :return: None
+    """
+    def megabytes(value):
+        return "{:>10.1f}".format(value) if value is not None else "{:>10}".format("-")
+
+    print("{:<60} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format("span", "count", "total s", "median s",
+                                                                          "max s", "cpu s", "RSS MB", "+MB"))
+    for path in sorted(summary):
+        s = summary[path]
+        print("{:<60} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {} {}".format(
+            path, s["count"], s["wall_total_s"], s["wall_median_s"], s["wall_max_s"], s["cpu_total_s"],
+            megabytes(s["rss_max_mb"]), megabytes(s["rss_delta_max_mb"])))
+
+
+if __name__ == '__main__':
+    from utils import parse_args_to_dict
+
+    args = parse_args_to_dict()
+    trace_summary = summarize_trace(read_trace(args["summary"]))
+    print_summary(trace_summary)
+
+    if "output" in args:
+        with open(args["output"], "w") as f:
+            json.dump(trace_summary, f, indent=2)
@@ -0,0 +1,296 @@
+import json
+import os
+import re
+import time
+import traceback
+
+from data_processing.main_processor import run_analysis, load_preprocessing_config, PREPROCESSING_CONFIG_PATH
+from utils import parse_args_to_dict
+
+"""
+Watch-folder ingestion: analyses the overview CZI files and the FCS .raw files as soon as ZEN finished writing them,
+so the analysis overlaps with the next stage move instead of waiting for the PythonAnalysisRunner call. The results are
+saved under the names of PathManager.temp_file_path, the runner picks them up when "watch_folder_ingestion" is set in
+path_config.json and runs the analysis itself only when they do not appear in time.
+
+The folders are polled, which works the same on the local and network drives of the ZEN computer. A file is complete
+when its size and modification time did not change for settle_s seconds and it can be opened for reading.
+
+* CZI overviews in image_for_analysis_path, named as by PathManager.overview_image_path, are analysed with the
+  profile given by watch_overview_analysis.
+* RAW files are looked for in the object folders obj_<id> of results_path and of its position subfolders, the only
+  folders where FCS_points.json is written. A folder is analysed with ZeissFCSProcessor once it contains
+  FCS_points.json and all its .raw files are complete, the result is saved as the z reanalysis of the object.
+
+The folders are indexed incrementally by their modification time, which changes when a file is created, moved in or
+deleted: a folder is listed again only after such a change, and an object folder is checked in every poll only while
+its analysis is pending.
+
+Start from the project root: python -m data_processing.watch_folder --config=config/path_config.json
+"""
+
+OVERVIEW_PATTERN = re.compile(r"^(?:(?P<name>.+)_)?(?P<obj_id>[^_]+)_Image_overview\.czi$", re.IGNORECASE)
+OBJECT_FOLDER_PATTERN = re.compile(r"^obj_(?P<obj_id>.+)$")
+FCS_POINTS_FILE = "FCS_points.json"
+
+
+def temp_file_name(obj_id, reanalysis_type=None, name=None):
+    """
+    Name of the JSON with the measurement points, the same as PathManager.temp_file_path gives.
+    :param str obj_id: id of the object or of the overview
+    :param str reanalysis_type: None for the overview, 'xy' or 'z'
+    :param str name: name of the pipeline position
+    :return: str file name
+    """
+    prefix = "{}_".format(name) if name else ""
+    suffix = {None: "measurements_points.json", "xy": "measurements_points_reanalysis_xy.json",
+              "z": "measurements_points_reanalysis_z.json"}[reanalysis_type]
+
+    return "{}{}_{}".format(prefix, obj_id, suffix)
+
+
+class FileStabilityTracker:
+    """
+    Remembers the size and modification time of the files between the polls, to find the ones completely written.
+
+    :param float settle_s: time in seconds the file must stay unchanged
+    """
+
+    def __init__(self, settle_s=0.5):
+        self.settle_s = settle_s
+        self._seen = {}
+
+    def is_complete(self, path, now=None):
+        """
+        :param str path: path to the file
+        :param float now: current time, by default time.monotonic()
+        :return: bool, True when the file did not change for settle_s and can be opened
+        """
+        now = time.monotonic() if now is None else now
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._seen.pop(path, None)
+            return False
+
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self._seen.get(path)
+        if previous is None or previous[0] != signature:
+            self._seen[path] = (signature, now)
+            return False
+
+        if now - previous[1] < self.settle_s:
+            return False
+
+        # ZEN keeps the file locked while writing it
+        try:
+            with open(path, "rb"):
+                pass
+        except OSError:
+            return False
+
+        return True
+
+    def signature(self, path):
+        """
+        :return: (size, mtime_ns) of the file seen in the last poll
+        """
+        return self._seen[path][0]
+
+
+class IngestionService:
+    """
+    Polls the watched folders and runs the analysis of every completely written file once.
+
+    :param dict path_config: content of path_config.json
+    :param str overview_analysis: profile of preprocessing_config.json used for the overview images, None skips them
+    :param str preprocessing_config_path: path to preprocessing_config.json
+    :param float poll_s: time between the polls in seconds
+    :param float settle_s: time in seconds a file must stay unchanged to be treated as complete
+    """
+
+    def __init__(self, path_config, overview_analysis=None, preprocessing_config_path=PREPROCESSING_CONFIG_PATH,
+                 poll_s=0.2, settle_s=0.5):
+        self.overview_folder = path_config["image_for_analysis_path"]
+        self.results_folder = path_config["results_path"]
+        self.measurements_folder = path_config["measuring_points_path"]
+
+        self.overview_analysis = overview_analysis
+        self.preprocessing_config_path = preprocessing_config_path
+        self.poll_s = poll_s
+
+        self.tracker = FileStabilityTracker(settle_s)
+        # signatures of the analysed files or folders, so every version is analysed once
+        self.processed = {}
+        # folder: (mtime_ns, list of the subfolders) of the last listing of the results folder and its subfolders
+        self._listings = {}
+        # object folder: mtime_ns at which nothing was left to analyse in it
+        self._settled = {}
+        self.stop_requested = False
+
+    @staticmethod
+    def _list_files(folder, extension):
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(extension)]
+
+    @staticmethod
+    def _mtime_ns(folder):
+        try:
+            return os.stat(folder).st_mtime_ns
+        except OSError:
+            return None
+
+    def _subfolders(self, folder):
+        """
+        :return: list of the subfolders, listed again only when the modification time of the folder changed
+        """
+        mtime = self._mtime_ns(folder)
+        if mtime is None:
+            self._listings.pop(folder, None)
+            return []
+
+        listing = self._listings.get(folder)
+        if listing is None or listing[0] != mtime:
+            subfolders = [entry.path for entry in os.scandir(folder) if entry.is_dir()]
+            listing = self._listings[folder] = (mtime, subfolders)
+        return listing[1]
+
+    def _object_folders(self):
+        """
+        :return: list of the object folders obj_<id> of the results folder and of its position subfolders
+        """
+        folders = []
+        for folder in self._subfolders(self.results_folder):
+            if OBJECT_FOLDER_PATTERN.match(os.path.basename(folder)):
+                folders.append(folder)
+            else:
+                folders.extend(sub for sub in self._subfolders(folder)
+                               if OBJECT_FOLDER_PATTERN.match(os.path.basename(sub)))
+        return folders
+
+    def _is_up_to_date(self, saving_path, input_mtime):
+        return os.path.isfile(saving_path) and os.path.getmtime(saving_path) >= input_mtime
+
+    def find_overview_jobs(self):
+        """
+        :return: list of the command_args of main_processor for the completed overview images
+        """
+        if self.overview_analysis is None:
+            return []
+
+        jobs = []
+        for path in self._list_files(self.overview_folder, ".czi"):
+            match = OVERVIEW_PATTERN.match(os.path.basename(path))
+            if match is None or not self.tracker.is_complete(path):
+                continue
+
+            signature = self.tracker.signature(path)
+            if self.processed.get(path) == signature:
+                continue
+
+            saving_path = os.path.join(self.measurements_folder, temp_file_name(match.group("obj_id"), None,
+                                                                               match.group("name")))
+            self.processed[path] = signature
+            if self._is_up_to_date(saving_path, os.path.getmtime(path)):
+                continue
+
+            jobs.append({'type': 'overview', 'file_path': path, 'saving_path': saving_path,
+                         'analysis_arguments': self.overview_analysis, 'is_FCS': 'False'})
+        return jobs
+
+    def find_fcs_jobs(self):
+        """
+        :return: list of the command_args of main_processor for the object folders with the completed FCS .raw files
+        """
+        jobs = []
+        for folder in self._object_folders():
+            mtime = self._mtime_ns(folder)
+            if mtime is None or self._settled.get(folder) == mtime:
+                continue
+
+            job = self._fcs_job(folder)
+            if job is not False:
+                # nothing is pending in the folder until a file is added or removed
+                self._settled[folder] = mtime
+            if job:
+                jobs.append(job)
+        return jobs
+
+    def _fcs_job(self, folder):
+        """
+        :param str folder: object folder obj_<id>
+        :return: command_args of main_processor, None if there is nothing to analyse, False while the .raw files are
+                 being written
+        """
+        raw_files = self._list_files(folder, ".raw")
+        if not raw_files or not os.path.isfile(os.path.join(folder, FCS_POINTS_FILE)):
+            return None
+
+        # all files must be checked in every poll, so their stability is tracked
+        complete = [self.tracker.is_complete(path) for path in raw_files]
+        if not all(complete):
+            return False
+
+        signature = tuple(sorted((path,) + self.tracker.signature(path) for path in raw_files))
+        if self.processed.get(folder) == signature:
+            return None
+        self.processed[folder] = signature
+
+        parent = os.path.dirname(folder)
+        same_folder = os.path.normcase(os.path.abspath(parent)) == \
+            os.path.normcase(os.path.abspath(self.results_folder))
+        name = None if same_folder else os.path.basename(parent)
+        obj_id = OBJECT_FOLDER_PATTERN.match(os.path.basename(folder)).group("obj_id")
+        saving_path = os.path.join(self.measurements_folder, temp_file_name(obj_id, "z", name))
+
+        if self._is_up_to_date(saving_path, max(os.path.getmtime(path) for path in raw_files)):
+            return None
+
+        # main_processor analyses the folder of the file_path
+        return {'type': 'reanalysis_z', 'file_path': raw_files[0], 'saving_path': saving_path,
+                'analysis_arguments': None, 'is_FCS': 'True'}
+
+    def poll(self):
+        """
+        Runs one poll of the watched folders and analyses the completed files.
+        :return: int number of the analyses run
+        """
+        jobs = self.find_overview_jobs() + self.find_fcs_jobs()
+
+        for command_args in jobs:
+            start = time.perf_counter()
+            try:
+                run_analysis(command_args, load_preprocessing_config(self.preprocessing_config_path))
+                print("[INFO] Ingested {} in {:.2f} s -> {}".format(command_args['file_path'],
+                                                                  time.perf_counter() - start,
+                                                                  command_args['saving_path']))
+            except Exception:
+                print("[ERROR] Analysis of {} failed:\n{}".format(command_args['file_path'], traceback.format_exc()))
+
+        return len(jobs)
+
+    def serve_forever(self):
+        """
+        Polls the folders until stop_requested is set.
+        :return: None
+        """
+        while not self.stop_requested:
+            self.poll()
+            time.sleep(self.poll_s)
+
+
+if __name__ == '__main__':
+
+    args = parse_args_to_dict()
+
+    with open(args.get("config", "config/path_config.json"), "r") as f:
+        path_config = json.load(f)
+
+    service = IngestionService(path_config,
+                               overview_analysis=args.get("overview_analysis",
+                                                          path_config.get("watch_overview_analysis")),
+                               poll_s=float(args.get("poll_s", 0.2)), settle_s=float(args.get("settle_s", 0.5)))
+
+    print("Watching {} and {}".format(service.overview_folder, service.results_folder))
+    service.serve_forever()
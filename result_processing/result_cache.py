@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+"""
+Cache of the per-file rows of ZeissResultProcessor, so a re-run analyses only the new or changed CZI files. A row is
+valid as long as the size and modification time of the file and the analysis profile do not change. The table is
+stored as a pickled DataFrame, which keeps the list columns (positions, displacement vectors) as they are.
+"""
+
+KEY_COLUMNS = ['file', 'size', 'mtime_ns', 'profile']
+
+
+def profile_key(profile):
+    """
+    :param dict profile: arguments of ZeissImageProcessor used for the analysis
+    :return: str short hash of the profile
+    """
+    return hashlib.sha1(json.dumps(profile, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def file_key(path):
+    """
+    :param str path: path to the file
+    :return: tuple (absolute path, size, mtime_ns)
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+class ResultCache:
+    """
+    On-disk table of the analysis rows, one row per file and analysis profile.
+
+    :param str cache_path: path of the pickled DataFrame
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.table = self._load()
+        self.is_modified = False
+
+    def _load(self):
+        if os.path.isfile(self.cache_path):
+            try:
+                return pd.read_pickle(self.cache_path)
+            except Exception:
+                print("[WARNING] Ignoring unreadable result cache: {}".format(self.cache_path))
+        return pd.DataFrame(columns=KEY_COLUMNS)
+
+    def split(self, files, profile):
+        """
+        Divides the files into the ones with a valid cached row and the ones to analyse.
+        :param list files: paths to the files
+        :param str profile: profile key given by profile_key
+        :return: (DataFrame of the valid cached rows, list of the files to analyse)
+        """
+        keys = pd.DataFrame([file_key(f) + (profile,) for f in files], columns=KEY_COLUMNS)
+        if keys.empty:
+            return self.table.iloc[0:0], []
+
+        valid = keys.merge(self.table, on=KEY_COLUMNS, how='left', indicator=True)
+        is_cached = (valid['_merge'] == 'both').to_numpy()
+
+        cached = valid[is_cached].drop(columns='_merge').reset_index(drop=True)
+        stale = [f for f, hit in zip(files, is_cached) if not hit]
+
+        return cached, stale
+
+    def update(self, rows):
+        """
+        Replaces the rows of the same file and profile with the new ones.
+        :param DataFrame rows: rows with the KEY_COLUMNS
+        :return: None
+        """
+        if rows.empty:
+            return
+
+        replaced = self.table.set_index(['file', 'profile']).index.isin(rows.set_index(['file', 'profile']).index)
+        kept = self.table[~replaced]
+        self.table = rows.copy() if kept.empty else pd.concat([kept, rows], ignore_index=True)
+        self.is_modified = True
+
+    def save(self):
+        """
+        Writes the table to the disk, if any row was added.
+        :return: None
+        """
+        if not self.is_modified:
+            return
+
+        tmp_path = self.cache_path + '.tmp'
+        self.table.to_pickle(tmp_path)
+        os.replace(tmp_path, self.cache_path)
+        self.is_modified = False
@@ -1,22 +1,89 @@
 import os
 import pandas as pd
-import json
-from data_preprocessing.preprocessors.zeiss_image_preprocessor import ZeissImageProcessor
+from concurrent.futures import ProcessPoolExecutor
+from data_processing.processor.zeiss_image_processor import ZeissImageProcessor
+from IO.czi_metadata import CziMetadataCache, read_czi_metadata
+from IO.measurement_points_table import read_measurement_points_folder
+from result_processing.result_cache import ResultCache, file_key, profile_key
 import re
 import numpy as np
-from utils import visualize_points
+from utils import visualize_points, choose_the_closest_point
+
+RESULTS_PROFILE = {'analysis_channel': 0, 'chosen_analysis': 'FluorescentGUV', 'min_size_um': 3.5, 'max_size_um': 20}
+UUID_PATTERN = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-5][0-9a-f]{3}-[089ab][0-9a-f]{3}-[0-9a-f]{12}'
+
+
+def analyze_result_file(file_path, profile, visualization_folder=None, metadata_cache=None):
+    """
+    Analyses one CZI file and extracts the row of the result table, module level function so it can run in the worker
+    processes.
+    :param str file_path: path to the CZI file
+    :param dict profile: arguments of ZeissImageProcessor
+    :param str visualization_folder: folder for the PNG with the found points, None skips the plot
+    :param CziMetadataCache metadata_cache: cache of the metadata
+    :return: dict with the row of the result table
+    """
+    obj = ZeissImageProcessor(file_path, metadata_cache=metadata_cache, **profile)
+
+    obj_properties = ZeissResultProcessor.extract_object_properties(obj)
+    obj_properties['creation date'] = os.path.getmtime(file_path)
+
+    if visualization_folder is not None:
+        visualize_points(obj, os.path.join(visualization_folder, obj_properties['ID']))
+
+    return obj_properties
+
+
+def analyze_result_file_in_worker(file_path, profile, visualization_folder=None, metadata=None):
+    """
+    analyze_result_file for the worker processes, which cannot share the metadata cache of the main process: the
+    metadata known to the main process is passed in and the metadata of the file is returned, to be put into the cache
+    by the main process.
+    :param str file_path: path to the CZI file
+    :param dict profile: arguments of ZeissImageProcessor
+    :param str visualization_folder: folder for the PNG with the found points, None skips the plot
+    :param CziMetadata metadata: cached metadata of the file, None parses it from the file
+    :return: tuple (dict with the row of the result table, CziMetadata of the file)
+    """
+    metadata_cache = CziMetadataCache(None)
+    if metadata is not None:
+        metadata_cache.put(file_path, metadata)
+
+    row = analyze_result_file(file_path, profile, visualization_folder, metadata_cache)
+
+    return row, metadata_cache.get(file_path)
 
 
 class ZeissResultProcessor:
     """
     Work-in-progress class; partially implemented, to be extended later
+
+    The rows of the analysed files are kept in the result cache, a re-run analyses only the new or changed files, in
+    n_workers processes. The displacement vectors depend on the neighbouring rows, so they are not cached but
+    recomputed for the whole record.
+
+    :param str path: folder of the session with image_for_analysis, results and temp
+    :param int n_workers: number of processes, None uses one per CPU, 1 analyses in this process
     """
-    def __init__(self, path):
+    METADATA_CACHE_NAME = 'czi_metadata_cache.json'
+    RESULT_CACHE_NAME = 'result_cache.pkl'
+    VISUALIZATION_FOLDER = './founded_points'
+
+    def __init__(self, path, n_workers=None):
+
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        # metadata of the CZI files is parsed once per file and kept between the sessions
+        self.metadata_cache = CziMetadataCache(os.path.join(path, self.METADATA_CACHE_NAME))
+        self.result_cache = ResultCache(os.path.join(path, self.RESULT_CACHE_NAME))
 
         self.stage_position_record = self.initialize_stage_record(path)
         self.json_files = self.read_temp_folder(path)
         self.results = self.process_results_folder(path)
 
+        self.metadata_cache.save()
+        self.result_cache.save()
+
     @staticmethod
     def get_files_in_folder(path, extension):
         """
@@ -33,83 +100,95 @@ class ZeissResultProcessor:
 
         return files_path
 
-    def initialize_stage_record(self, path):
+    def read_folder_metadata(self, path):
+        """
+        Reads only the metadata of all CZI files in the folder, the files already in the cache are not opened.
+        :param str path: folder with the CZI files
+        :return: dict {file path: CziMetadata}
+        """
+        return {file: read_czi_metadata(file, self.metadata_cache) for file in self.get_files_in_folder(path, 'czi')}
 
-        stage_position_record_list = []
+    def analyze_files(self, files, profile, visualization_folder=None):
+        """
+        Returns the result rows of the files, only the files not in the result cache are analysed.
+        :param list files: paths to the CZI files
+        :param dict profile: arguments of ZeissImageProcessor
+        :param str visualization_folder: folder for the PNGs of the newly analysed files
+        :return: DataFrame with one row per file and the columns of the cache key, the new rows are added to the cache
+        """
+        key = profile_key(profile)
+        cached, stale = self.result_cache.split(files, key)
 
-        ovearview_path = os.path.join(path, 'image_for_analysis')
+        if len(stale) == 0:
+            return cached
 
-        #final_overview_path = os.path.join(path, 'results/ovearview')
+        print("Analysing {} new or changed files, {} taken from the cache".format(len(stale), len(cached)))
 
-        overview_files = self.get_files_in_folder(ovearview_path, 'czi')
-        #final_overview_files = self.get_files_in_folder(final_overview_path, 'czi')
+        if self.n_workers == 1 or len(stale) < 2:
+            rows = [analyze_result_file(f, profile, visualization_folder, self.metadata_cache) for f in stale]
+        else:
+            metadata = [self.metadata_cache.get(f) for f in stale]
+            with ProcessPoolExecutor(max_workers=min(self.n_workers, len(stale))) as executor:
+                results = list(executor.map(analyze_result_file_in_worker, stale, [profile] * len(stale),
+                                            [visualization_folder] * len(stale), metadata))
 
-        files_path = overview_files #+ final_overview_files
+            rows = []
+            for file, (row, file_metadata) in zip(stale, results):
+                rows.append(row)
+                if file_metadata is not None:
+                    self.metadata_cache.put(file, file_metadata)
 
-        for file in files_path:
-            obj = ZeissImageProcessor(file, analysis_channel=0, chosen_analysis='FluorescentGUV')
-            obj_properties = self.extract_object_properties(obj)
-            date = os.path.getmtime(file)
-            obj_properties['creation date'] = date
-            stage_position_record_list.append(obj_properties)
+        new_rows = pd.DataFrame(rows)
+        new_rows['file'], new_rows['size'], new_rows['mtime_ns'] = zip(*[file_key(f) for f in stale])
+        new_rows['profile'] = key
+        self.result_cache.update(new_rows)
 
-        return stage_position_record_list
+        return new_rows if cached.empty else pd.concat([cached, new_rows], ignore_index=True)
 
-    @staticmethod
-    def read_json_file(file_path):
+    def initialize_stage_record(self, path):
+        """
+        Rows of the overview images, only their stage positions enter the displacement vectors, so the images are not
+        decoded, only their metadata is read, from the metadata cache for the files seen before.
+        :param str path: folder of the session
+        :return: DataFrame with one row per overview image
+        """
+        ovearview_path = os.path.join(path, 'image_for_analysis')
+
+        columns = ['ID', 'points found again', 'radius found again', 'stage position', 'creation date', 'file', 'size',
+                   'mtime_ns']
+        rows = []
+        for file, metadata in self.read_folder_metadata(ovearview_path).items():
+            stage_position = metadata.stage_position
+            rows.append([re.findall(UUID_PATTERN, file)[0], None, None,
+                         [stage_position['x'], stage_position['y'], stage_position['z']],
+                         os.path.getmtime(file)] + list(file_key(file)))
 
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        record = pd.DataFrame(rows, columns=columns)
+        record['profile'] = 'metadata'
 
-        df = pd.DataFrame.from_dict(data, orient='index')
-        return df
+        return record
 
     def read_temp_folder(self, path):
         """
         Zwraca listę plików z folderu 'temp' znajdującego się w `path`.
         Jeśli folder nie istnieje – tworzy go i zwraca pustą listę.
+
+        The .npz files are loaded in one call together with the JSON files saved without them, converted to the same
+        columns and dtypes.
         """
         temp_path = os.path.join(path, 'temp')
 
-        files_path = self.get_files_in_folder(temp_path, 'json')
-
-        data_frames = []
-
-        for file in files_path:
-            dat = self.read_json_file(file)
-            data_frames.append(dat)
-
-        final_df = pd.concat(data_frames)
-
-        return final_df
+        return read_measurement_points_folder(temp_path, with_position=True, include_json=True)
 
     @staticmethod
-    def choose_the_closest_point(measurement_points, stage_position):
-
-        stage = np.array([stage_position['x'], stage_position['y'], stage_position['z']])
-
-        # Obliczamy odległość euklidesową dla każdego punktu
-        distances = [
-            np.linalg.norm(np.array(p["position"]) - stage)
-            for p in measurement_points
-        ]
-
-        # Indeks najbliższego punktu
-        closest_idx = int(np.argmin(distances))
-
-        # Zwracamy cały słownik najbliższego punktu
-        return measurement_points[closest_idx]
-
-    def extract_object_properties(self, obj):
+    def extract_object_properties(obj):
         properties_dict = {}
 
-        uuid_pattern = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-5][0-9a-f]{3}-[089ab][0-9a-f]{3}-[0-9a-f]{12}'
-        uuids = re.findall(uuid_pattern, obj.czi_file_path)[0]
+        uuids = re.findall(UUID_PATTERN, obj.czi_file_path)[0]
         stage_position = obj.metadata['stage_position']
 
-        if len(obj.measurement_points) > 0:
-            closest_measurements_point = self.choose_the_closest_point(obj.measurement_points, stage_position)
-        else:
+        closest_measurements_point = choose_the_closest_point(obj.measurement_points, stage_position)
+        if closest_measurements_point is None:
             closest_measurements_point = {'position': None, 'radius': None}
 
         properties_dict['points found again'] = closest_measurements_point['position']
@@ -119,60 +198,42 @@ class ZeissResultProcessor:
 
         return properties_dict
 
-    def calculate_displacement_vectors_numpy(self):
-
+    @staticmethod
+    def update_displacement_vectors(record):
+        """
+        Computes the displacement vectors between the consecutive stage positions, for all rows at once, so the rows
+        next to the added or removed files always get the vectors to their current neighbours.
+        :param DataFrame record: rows with 'stage position' and 'creation date'
+        :return: DataFrame sorted by the creation date with the 'displacement vector' column, zero for the first row
+        """
         position_col, date_col = 'stage position', 'creation date'
 
-        df = pd.DataFrame(self.stage_position_record.copy())
-
-        # Sortowanie
-        df_sorted = df.sort_values(by=date_col).reset_index(drop=True)
+        df_sorted = record.sort_values(by=date_col).reset_index(drop=True)
 
-        # Konwersja pozycji do tablicy NumPy
-        positions = np.array(df_sorted[position_col].tolist())
-
-        # Obliczanie przesunięć
+        positions = np.array(df_sorted[position_col].tolist(), dtype=float).reshape(len(df_sorted), 3)
         displacements = np.zeros_like(positions)
-        displacements[1:] = positions[1:] - positions[:-1]
-
-        # Dodanie do DataFrame
+        displacements[1:] = np.diff(positions, axis=0)
         df_sorted['displacement vector'] = displacements.tolist()
 
         return df_sorted
 
-
     def process_results_folder(self, path):
 
         results_path = os.path.join(path, 'results')
 
         files_path = self.get_files_in_folder(results_path, 'czi')
 
-        obj_properties_list = []
-
-        for file in files_path:
-            date = os.path.getmtime(file)
-
-            obj = ZeissImageProcessor(file, analysis_channel=0, chosen_analysis='FluorescentGUV', min_size_um=3.5, max_size_um=20)
-            obj_properties = self.extract_object_properties(obj)
-
-            obj_properties['creation date'] = date
-
-            self.stage_position_record.append(obj_properties)
-
-            visualize_points(obj, os.path.join('./founded_points', obj_properties['ID']))
-
-            obj_properties_list.append(obj_properties)
-
-        df = pd.DataFrame(obj_properties_list)
-        merged_df = pd.merge(self.json_files, df, left_index=True, right_on='ID')
-
-        self.stage_position_record = self.calculate_displacement_vectors_numpy()
+        results_rows = self.analyze_files(files_path, RESULTS_PROFILE, self.VISUALIZATION_FOLDER)
 
-        on_columns = ['creation date', 'ID']
+        record = pd.concat([self.stage_position_record, results_rows], ignore_index=True)
+        self.stage_position_record = self.update_displacement_vectors(record)
 
-        columns_from_b = on_columns + ['displacement vector']
+        results_files = set(results_rows['file']) if not results_rows.empty else set()
+        results_record = self.stage_position_record[self.stage_position_record['file'].isin(results_files)]
 
-        final_df = pd.merge(merged_df, self.stage_position_record[columns_from_b], on=on_columns, how='left')
+        columns = ['ID', 'creation date', 'points found again', 'radius found again', 'stage position',
+                   'displacement vector']
+        final_df = pd.merge(self.json_files, results_record[columns], left_index=True, right_on='ID')
 
         return final_df
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the tests import the project modules as the scripts run from the project root do
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
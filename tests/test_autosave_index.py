@@ -0,0 +1,118 @@
+import os
+import shutil
+
+from ZeissAPI.autosave_index import AutosaveIndex, LocalFileSystem
+
+
+class WatchedFileSystem(LocalFileSystem):
+    """
+    LocalFileSystem reporting a watcher, so the index is updated only by the events fed by the test
+    """
+
+    @staticmethod
+    def watch(folder, index):
+        return object()
+
+
+def write(folder, name, mtime):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(b"data")
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_newer_fcs_takes_over(tmp_path):
+    folder = str(tmp_path)
+    old_fcs = write(folder, "aaa_1.fcs", 100)
+    old_raws = [write(folder, "aaa_1_R1.raw", 90), write(folder, "aaa_1_R2.raw", 95)]
+    write(folder, "notes.txt", 300)
+    index = AutosaveIndex(folder, file_system=LocalFileSystem)
+
+    assert index.latest() == (old_fcs, old_raws[::-1])
+
+    new_fcs = write(folder, "bbb_2.fcs", 200)
+    new_raw = write(folder, "bbb_2_R1.raw", 190)
+
+    assert index.latest() == (new_fcs, [new_raw])
+
+
+def test_deleted_and_moved_files(tmp_path):
+    folder = str(tmp_path / "autosave")
+    os.makedirs(folder)
+    old_fcs = write(folder, "aaa_1.fcs", 100)
+    old_raw = write(folder, "aaa_1_R1.raw", 90)
+    new_fcs = write(folder, "bbb_2.fcs", 200)
+    new_raw = write(folder, "bbb_2_R1.raw", 190)
+    index = AutosaveIndex(folder, file_system=LocalFileSystem)
+    assert index.latest() == (new_fcs, [new_raw])
+
+    os.remove(new_fcs)
+    assert index.latest() == (old_fcs, [old_raw])
+
+    shutil.move(old_raw, str(tmp_path / "aaa_1_R1.raw"))
+    assert index.latest() == (old_fcs, [])
+
+    os.remove(old_fcs)
+    assert index.latest() == (None, [])
+
+
+def test_rewritten_fcs_is_ranked_again(tmp_path):
+    folder = str(tmp_path)
+    first = write(folder, "aaa_1.fcs", 100)
+    second = write(folder, "bbb_2.fcs", 200)
+    index = AutosaveIndex(folder, file_system=LocalFileSystem)
+    assert index.latest()[0] == second
+
+    os.utime(first, (300, 300))
+    assert index.latest()[0] == first
+
+
+def test_event_handlers(tmp_path):
+    folder = str(tmp_path)
+    first = write(folder, "aaa_1.fcs", 100)
+    index = AutosaveIndex(folder, file_system=WatchedFileSystem)
+
+    second = write(folder, "bbb_2.fcs", 200)
+    assert index.latest() == (first, [])
+
+    index.on_created(second)
+    raw = write(folder, "bbb_2_R1.raw", 210)
+    index.on_created(raw)
+    assert index.latest() == (second, [raw])
+
+    os.utime(first, (300, 300))
+    index.on_changed(first)
+    assert index.latest() == (first, [])
+
+    renamed = os.path.join(folder, "ccc_3.fcs")
+    os.rename(first, renamed)
+    index.on_renamed(first, renamed)
+    assert index.latest() == (renamed, [])
+
+    os.remove(renamed)
+    index.on_deleted(renamed)
+    assert index.latest() == (second, [raw])
+
+
+def test_invalidate_rescans_the_folder(tmp_path):
+    folder = str(tmp_path)
+    first = write(folder, "aaa_1.fcs", 100)
+    index = AutosaveIndex(folder, file_system=WatchedFileSystem)
+
+    # the event of the new file was lost, e.g. by the overflow of the watcher buffer
+    second = write(folder, "bbb_2.fcs", 200)
+    assert index.latest() == (first, [])
+
+    index.invalidate()
+    assert index.latest() == (second, [])
+
+
+def test_file_gone_without_event_triggers_rescan(tmp_path):
+    folder = str(tmp_path)
+    first = write(folder, "aaa_1.fcs", 100)
+    second = write(folder, "bbb_2.fcs", 200)
+    index = AutosaveIndex(folder, file_system=WatchedFileSystem)
+
+    os.remove(second)
+    assert index.latest() == (first, [])
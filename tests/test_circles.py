@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+from data_processing.image_analysis.circles import Circles
+
+
+def transmitted_light_edges(seed, kind, n_objects=40, size=512, radii=(2, 50), noise=2.0):
+    """
+    Canny edges of the synthetic GUVs as in the TL mode of Circles, with the returned centers and radii in pixels
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size), 100.0)
+    truth = []
+    for _ in range(n_objects):
+        radius = rng.uniform(*radii)
+        x, y = rng.integers(0, size, 2)
+        truth.append((x, y, radius))
+        cv2.circle(image, (int(x), int(y)), int(radius), 160, 2 if kind == 'ring' else -1)
+
+    image = cv2.GaussianBlur(image + rng.normal(0, noise, image.shape), (5, 5), 1.5).astype(np.float32)
+    normalized = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return cv2.Canny(cv2.GaussianBlur(normalized, (3, 3), 0), 5, 15), truth
+
+
+def contour_centers(edges, min_fit_ratio, radii):
+    """
+    The external contours measured one by one, the method Circles used before the label-image statistics
+    """
+    contours, hierarchy = cv2.findContours(edges, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    centers = []
+    for i, contour in enumerate(contours):
+        moments = cv2.moments(contour)
+        if hierarchy[0][i][3] != -1 or moments["m00"] == 0:
+            continue
+        _, radius = cv2.minEnclosingCircle(contour)
+        if cv2.contourArea(contour) / (np.pi * radius ** 2) >= min_fit_ratio and radii[0] <= int(radius) <= radii[1]:
+            centers.append((int(moments["m10"] / moments["m00"]), int(moments["m01"] / moments["m00"])))
+    return np.array(centers).reshape(-1, 2)
+
+
+def label_centers(edges, min_fit_ratio, radii):
+    found = Circles.get_centers_and_radii(edges, min_fit_ratio)
+    return np.array([v["center"] for v in found.values() if radii[0] <= v["radius"] <= radii[1]]).reshape(-1, 2)
+
+
+def found_objects(centers, truth):
+    return sum(1 for x, y, r in truth
+               if len(centers) and np.min(np.hypot(centers[:, 0] - x, centers[:, 1] - y)) < max(2, r / 10))
+
+
+def test_edge_fragments_are_not_counted_as_objects():
+    for kind in ['ring', 'disc']:
+        old_count = new_count = old_found = new_found = 0
+        for seed in range(3):
+            edges, truth = transmitted_light_edges(seed, kind)
+            old, new = contour_centers(edges, 0.2, (2, 50)), label_centers(edges, 0.2, (2, 50))
+            old_count, new_count = old_count + len(old), new_count + len(new)
+            old_found, new_found = old_found + found_objects(old, truth), new_found + found_objects(new, truth)
+
+        assert new_count <= old_count, kind
+        assert new_found >= 0.95 * old_found, kind
+
+
+def test_open_fragment_is_dropped_and_closed_ring_kept():
+    edges = np.zeros((100, 100), dtype=np.uint8)
+    cv2.ellipse(edges, (30, 50), (20, 20), 0, 0, 200, 255, 1)
+    cv2.circle(edges, (75, 50), 12, 255, 1)
+
+    found = Circles.get_centers_and_radii(edges, 0.2)
+
+    assert len(found) == 1
+    assert list(found.values())[0]["center"] == (75, 50)
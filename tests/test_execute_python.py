@@ -0,0 +1,81 @@
+import json
+import sys
+
+import pytest
+
+from ZeissAPI import execute_python
+from ZeissAPI.execute_python import RESULT_MARKER, PythonAnalysisRunner
+from ZeissAPI.process_standin import Process
+
+# fake main_processor: the behaviour is chosen by the --mode argument
+FAKE_SCRIPT = """
+import json, sys, time
+args = dict(a[2:].split('=', 1) for a in sys.argv[1:] if a.startswith('--'))
+mode = args.get('mode')
+if mode == 'flood':
+    for i in range(20000):
+        sys.stderr.write('progress line {} of the analysis\\n'.format(i))
+elif mode == 'sleep':
+    time.sleep(30)
+elif mode == 'fail':
+    sys.stderr.write('Traceback: analysis failed\\n')
+    sys.exit(3)
+print('analysing ' + args['file_path'])
+print('RESULT_MARKER' + json.dumps({'p1': {'position': [1.0, 2.0, 3.0], 'source': args['file_path']}}))
+"""
+
+
+@pytest.fixture(autouse=True)
+def no_log_file(monkeypatch):
+    # the runner logs to the ZEN log file of the microscope computer
+    monkeypatch.setattr(execute_python, "log", lambda msg: None)
+
+
+@pytest.fixture
+def runner(tmp_path):
+    script = tmp_path / "fake_processor.py"
+    script.write_text(FAKE_SCRIPT.replace("'RESULT_MARKER'", repr(RESULT_MARKER)))
+
+    config = tmp_path / "path_config.json"
+    config.write_text(json.dumps({"python_exe": sys.executable, "python_script": str(script),
+                                  "python_project_root": str(tmp_path), "analysis_timeout_s": 1}))
+
+    return PythonAnalysisRunner(str(config), process_factory=Process)
+
+
+def analysis_args(tmp_path, mode):
+    return {'type': 'overview', 'file_path': str(tmp_path / "over view.czi"), 'mode': mode,
+            'saving_path': str(tmp_path / "points.json"), 'analysis_arguments': 'FLGUV', 'is_FCS': False}
+
+
+def test_points_are_streamed_back(runner, tmp_path):
+    points = runner.run(**analysis_args(tmp_path, None))
+
+    assert points == {'p1': {'position': [1.0, 2.0, 3.0], 'source': str(tmp_path / "over view.czi")}}
+
+
+def test_stderr_flood_does_not_block(runner, tmp_path):
+    job = runner.start(**analysis_args(tmp_path, 'flood'))
+
+    assert job.wait()
+    assert job.poll() == "finished"
+    assert len(job.errors) == 20000
+    assert job.result()['p1']['position'] == [1.0, 2.0, 3.0]
+
+
+def test_timeout_kills_the_process(runner, tmp_path):
+    job = runner.start(**analysis_args(tmp_path, 'sleep'))
+
+    assert not job.wait()
+    assert job.poll() == "timed out"
+    assert job.result() is None
+    assert runner.run(**analysis_args(tmp_path, 'sleep')) is None
+
+
+def test_failed_analysis_returns_none(runner, tmp_path):
+    job = runner.start(**analysis_args(tmp_path, 'fail'))
+    job.wait()
+
+    assert job.poll() == "failed"
+    assert job.errors == ['Traceback: analysis failed']
+    assert runner.run(**analysis_args(tmp_path, 'fail')) is None
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+
+from IO.measurement_points_table import read_measurement_points_folder, save_measurement_points_table
+
+
+def points(prefix, count, **properties):
+    return {"{}-{}".format(prefix, i): dict({"position": [float(i), 2.0 * i, 0.5], "source": "{}.czi".format(prefix),
+                                             "timestamp": "2025-10-20T12:00:0{}.000000Z".format(i)}, **properties)
+            for i in range(count)}
+
+
+def test_folder_mixing_npz_and_json_has_one_schema(tmp_path):
+    columnar = points("npz", 2, radius=3.0)
+    save_measurement_points_table(columnar, str(tmp_path / "overview.npz"))
+    (tmp_path / "overview.json").write_text(json.dumps(columnar))
+
+    (tmp_path / "reanalysis_z.json").write_text(json.dumps(points("json", 3, radius=4.0, refined=True)))
+    (tmp_path / "points_for_overview.json").write_text(json.dumps([{"name": "A", "position": [0, 0, 0]}]))
+
+    df = read_measurement_points_folder(str(tmp_path), with_position=True, include_json=True)
+
+    assert sorted(df.index) == ["json-0", "json-1", "json-2", "npz-0", "npz-1"]
+    assert np.issubdtype(df["timestamp"].dtype, np.datetime64)
+    assert df["x"].dtype == np.float64 and df["radius"].dtype == np.float64
+    assert df.loc["json-2", "position"] == [2.0, 4.0, 0.5]
+    assert df.loc["npz-1", "file"].endswith("overview.npz")
+    assert df.loc["json-0", "file"].endswith("reanalysis_z.json")
+    assert df.loc["npz-0", "refined"] is None and df.loc["json-0", "refined"] == True
+
+
+def test_json_only_folder(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps(points("a", 2)))
+
+    df = read_measurement_points_folder(str(tmp_path), include_json=True)
+
+    assert list(df.columns[:5]) == ["x", "y", "z", "source", "timestamp"]
+    assert len(df) == 2 and np.issubdtype(df["timestamp"].dtype, np.datetime64)
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+from data_processing.image_analysis.region_statistics import fill_holes, label_image, region_statistics
+
+
+def ring_with_disc():
+    image = np.zeros((80, 80), dtype=np.uint8)
+    cv2.circle(image, (40, 40), 25, 1, 2)
+    cv2.circle(image, (40, 40), 5, 1, -1)
+    return image
+
+
+def test_fit_ratio_does_not_exceed_one_for_tiny_objects():
+    image = np.zeros((20, 20), dtype=np.uint8)
+    image[3, 3] = 1
+    image[10:12, 10:12] = 1
+
+    stats = region_statistics(label_image(image), with_perimeter=False)
+
+    assert np.all(stats['fit_ratio'] <= 1)
+    assert stats['fit_ratio'][0] < 0.7
+
+
+def test_object_inside_ring_stays_separate():
+    labels = fill_holes(label_image(ring_with_disc()))
+    stats = region_statistics(labels, with_perimeter=False)
+
+    assert len(stats['label']) == 2
+    ring, disc = np.argsort(-stats['area'])
+    # the hole of the ring is filled around the disc, the disc keeps its own pixels
+    assert stats['area'][disc] == (labels == stats['label'][disc]).sum() < 100
+    assert stats['area'][ring] > np.pi * 24 ** 2 - stats['area'][disc]
+    np.testing.assert_allclose([stats['centroid-0'][disc], stats['centroid-1'][disc]], [40, 40], atol=0.1)
+
+
+def test_radius_is_the_farthest_pixel_center():
+    image = np.zeros((50, 50), dtype=np.uint8)
+    cv2.circle(image, (25, 25), 10, 1, -1)
+
+    stats = region_statistics(label_image(image), with_perimeter=False)
+
+    np.testing.assert_allclose(stats['enclosing_radius'], [10], atol=0.5)
+    assert 0.8 < stats['fit_ratio'][0] <= 1
+
+
+def test_circles_keep_the_ring_and_the_nested_disc():
+    from data_processing.image_analysis.circles import Circles
+
+    results = Circles.get_centers_and_radii(ring_with_disc(), min_fit_ratio=0.2)
+    radii = sorted(v['radius'] for v in results.values())
+
+    assert len(radii) == 2
+    assert radii[0] == 5 and 25 <= radii[1] <= 26
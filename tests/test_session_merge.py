@@ -0,0 +1,37 @@
+from data_processing.session_merge import merge_tile_points
+
+
+def detection(tile, point_id, x, radius=2.0):
+    return {'position': [x, 0.0, 0.0], 'radius': radius, 'tile_file': tile, 'tile_point_id': point_id}
+
+
+def members_by_object(merged):
+    return sorted(sorted(entry['members']) for entry in merged.values())
+
+
+def test_overlap_detections_are_merged():
+    points = [detection('a.json', 'a1', 0.0), detection('b.json', 'b1', 1.0), detection('b.json', 'b2', 20.0)]
+
+    merged = merge_tile_points(points, match_radius_um=5.0)
+
+    assert members_by_object(merged) == [['a1', 'b1'], ['b2']]
+
+
+def test_chain_does_not_merge_two_objects_of_one_tile():
+    # a1 - b1 - c1 - a2 are neighbours closer than the radius, a1 and a2 are different objects of tile a
+    points = [detection('a.json', 'a1', 0.0), detection('b.json', 'b1', 3.0), detection('c.json', 'c1', 7.0),
+              detection('a.json', 'a2', 11.5)]
+
+    merged = merge_tile_points(points, match_radius_um=5.0)
+
+    assert members_by_object(merged) == [['a1', 'b1', 'c1'], ['a2']]
+    for entry in merged.values():
+        assert len(entry['tiles']) == entry['detections']
+
+
+def test_detection_matches_only_the_closest_of_the_other_tile():
+    points = [detection('a.json', 'a1', 0.0), detection('b.json', 'b1', 2.5), detection('a.json', 'a2', 4.0)]
+
+    merged = merge_tile_points(points, match_radius_um=5.0)
+
+    assert members_by_object(merged) == [['a1'], ['a2', 'b1']]
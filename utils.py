@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import sys
 import numpy as np
 
@@ -10,7 +9,16 @@ def visualize_points(ZIP_object, save_path=None):
     :param str save_path: path to which the png will be saved
     :return: None
     """
-    plt.imshow(ZIP_object.image_to_analyze, cmap='gray')
+    # imported here, so the analysis without visualization does not pay for the matplotlib import
+    import matplotlib.pyplot as plt
+
+    image = ZIP_object.image_to_analyze
+    if hasattr(image, 'preview'):
+        # the image read tile by tile is shown downsampled, stretched over the full resolution pixel coordinates
+        H, W = image.shape
+        plt.imshow(image.preview(), cmap='gray', extent=(-0.5, W - 0.5, H - 0.5, -0.5))
+    else:
+        plt.imshow(image, cmap='gray')
 
     plt.colorbar()
     meas_points = ZIP_object.not_scaled_points
@@ -54,12 +62,20 @@ def choose_the_closest_point(measurement_points, stage_position):
     Function to choose the closest point from the founded to the stage position
     :param list measurement_points: list coordinates of the points which will be compared
     :param dict stage_position: position of the stage
-    :return: list coordinates of the closest point
+    :return: list coordinates of the closest point, None when no point has the XY position
     """
-    stage = np.array([stage_position['x'], stage_position['y'], stage_position['z']])
+    # imported here, so the utils used by the macro tools do not pay for the scipy import of the spatial index
+    from data_processing.spatial_index import points_to_array
+
+    positions = points_to_array(measurement_points)
+    stage = np.array([np.nan if stage_position[axis] is None else stage_position[axis] for axis in "xyz"], dtype=float)
 
-    distances = [np.linalg.norm(np.array(p["position"]) - stage) for p in measurement_points]
+    # the Z coordinate is compared only when it is known for every point, as in PointIndex
+    dims = 3 if np.isfinite(positions[:, 2]).all() and np.isfinite(stage[2]) else 2
 
-    closest_idx = int(np.argmin(distances))
+    distances = np.linalg.norm(positions[:, :dims] - stage[:dims], axis=1)
+    distances[~np.isfinite(distances)] = np.inf
+    if len(distances) == 0 or not np.isfinite(distances).any():
+        return None
 
-    return measurement_points[closest_idx]
\ No newline at end of file
+    return measurement_points[int(np.argmin(distances))]